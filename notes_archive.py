@@ -0,0 +1,298 @@
+# 古いメモを圧縮して別に置く「アーカイブ」（どのバックエンドの外側にも重ねられる）
+#
+#   data/notes.archive/manifest.json          … セグメントの一覧と、セグメントごとのブロック索引
+#   data/notes.archive/seg-000001.jsonl.gz    … BLOCK_NOTES 件ずつの JSONL を、ブロックごとに別々に圧縮して連結したもの
+#
+# gzip / xz は「圧縮したものを連結しても1つのファイルとして展開できる」ので、
+# セグメントは gzip -dc / xz -dc でそのまま中身を見られる。それでいて、ブロック索引
+# （位置・長さ・id の範囲・created_at の範囲）があるので、1件を読むときは1ブロックだけ展開すればよい。
+#
+# archive_notes() は cutoff より前に作られたメモをセグメントに書き出し、元の保存先から消す。
+# 読むときは ArchivedBackend がアーカイブ（古い順）→ 元の保存先の順に並べて返すので、
+# list / search / show からはアーカイブされたかどうかは見えない。
+# アーカイブ済みのメモを更新・削除するときは、まず元の保存先に戻し（そのセグメントの removed に id を足す）、
+# そのうえでふつうに変更する。セグメントそのものは書き直さない。
+# セグメントには書いたときのメモの形の版（notes_schema.py）を残し、古い版のものは読むときに今の形に揃える。
+
+import os
+import json
+import gzip
+import lzma
+
+import notes_store
+import notes_schema
+
+BLOCK_NOTES = 256                       # 1ブロックに入れるメモの数（1件読むときに展開する量）
+DEFAULT_CODEC = "gzip"
+CODECS = {                              # 名前 → (拡張子, 圧縮, 展開)
+    "gzip": (".jsonl.gz", gzip.compress, gzip.decompress),
+    "lzma": (".jsonl.xz", lzma.compress, lzma.decompress),
+}
+
+
+def archive_dir(filepath):
+    """notes.json → notes.archive/"""
+    root, _ = os.path.splitext(filepath)
+    return root + ".archive"
+
+
+def _day(d):
+    """date / "YYYY-MM-DD" → "YYYY-MM-DD"（None はそのまま）"""
+    return None if d is None else str(d)[:10]
+
+
+class Archive:
+    """notes.archive/ の読み書き"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.dirpath = archive_dir(filepath)
+        self.path = os.path.join(self.dirpath, "manifest.json")
+
+    # ----- manifest -----
+    def load_manifest(self):
+        """{"seq": n, "segments": [{"name", "codec", "before", "state", "count", "raw_bytes", "blocks", "removed"}]}
+
+        removed はそのセグメントから元の保存先に戻した id（セグメントの中には残っているが、もう読まない）。
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"seq": 0, "segments": []}
+
+    def save_manifest(self, manifest):
+        manifest["seq"] = manifest.get("seq", 0) + 1
+        notes_store._write_json_atomic(manifest, self.path, indent=2, durable=True)
+
+    def signature(self):
+        return notes_store.stat_signature((self.path,))
+
+    # ----- セグメント -----
+    def write_segment(self, manifest, notes, codec=DEFAULT_CODEC, before=None, schema=0):
+        """notes を新しいセグメントに書き、manifest に "moving" として足す（manifest の保存は呼び出し側）
+
+        schema は notes の形の版（notes_schema.py）。読むときに古ければ今の形に揃える。
+        """
+        ext, compress, _ = CODECS[codec]
+        name = f"seg-{len(manifest['segments']) + 1:06d}{ext}"
+        blocks = []
+        raw_bytes = 0
+        # 一時ファイルから置き換える（同じ名前の古いファイルがバックアップとハードリンクで共有されていても書き換えない）
+        with notes_store.atomic_writer(os.path.join(self.dirpath, name), durable=True, binary=True) as f:
+            for start in range(0, len(notes), BLOCK_NOTES):
+                chunk = notes[start:start + BLOCK_NOTES]
+                raw = "".join(json.dumps(n, ensure_ascii=False, separators=(",", ":")) + "\n" for n in chunk)
+                raw = raw.encode("utf-8")
+                data = compress(raw)
+                ids = [n.get("id", 0) for n in chunk]
+                created = [str(n.get("created_at") or "") for n in chunk]
+                blocks.append({"offset": f.tell(), "length": len(data), "count": len(chunk),
+                               "min_id": min(ids), "max_id": max(ids), "from": min(created), "to": max(created)})
+                f.write(data)
+                raw_bytes += len(raw)
+        segment = {"name": name, "codec": codec, "before": before, "state": "moving",
+                   "count": len(notes), "raw_bytes": raw_bytes, "blocks": blocks, "removed": [], "schema": schema}
+        manifest["segments"].append(segment)
+        return segment
+
+    def _read_block(self, segment, block):
+        with open(os.path.join(self.dirpath, segment["name"]), "rb") as f:
+            f.seek(block["offset"])
+            data = f.read(block["length"])
+        text = CODECS[segment["codec"]][2](data).decode("utf-8")
+        notes = [json.loads(line) for line in text.splitlines() if line]
+        if segment.get("schema", 0) < notes_schema.SCHEMA_VERSION:
+            notes = list(notes_schema.upgrade(notes, segment.get("schema", 0)))
+        return notes
+
+    # ----- 読み込み -----
+    def iter_notes(self, date_from=None, date_to=None, manifest=None):
+        """アーカイブのメモを古い順に返す。期間と重ならないブロックは展開しない（結果は期間より広いことがある）。"""
+        manifest = manifest or self.load_manifest()
+        lo = _day(date_from)
+        hi = None if date_to is None else _day(date_to) + "U"
+        for segment in manifest["segments"]:
+            if segment.get("state") != "done":
+                continue                    # 移し終わっていないもの（まだ元の保存先にある）は読まない
+            removed = set(segment.get("removed", ()))
+            for block in segment["blocks"]:
+                if (lo is not None and block["to"] < lo) or (hi is not None and block["from"] >= hi):
+                    continue
+                for note in self._read_block(segment, block):
+                    if note.get("id") not in removed:
+                        yield note
+
+    def locate(self, note_ids, manifest=None):
+        """id → (セグメント, メモ)（アーカイブにあるものだけ）。id の範囲が合うブロックだけを展開する。"""
+        manifest = manifest or self.load_manifest()
+        wanted = set(note_ids)
+        found = {}
+        for segment in reversed(manifest["segments"]):      # 同じ id が何度か移されていたら、新しいセグメントのもの
+            if segment.get("state") != "done":
+                continue
+            live = wanted - set(segment.get("removed", ()))
+            for block in segment["blocks"]:
+                if not any(block["min_id"] <= i <= block["max_id"] for i in live):
+                    continue
+                for note in self._read_block(segment, block):
+                    if note.get("id") in live:
+                        found[note["id"]] = (segment, note)
+            wanted -= found.keys()
+            if not wanted:
+                break
+        return found
+
+    def get(self, note_id, manifest=None):
+        found = self.locate([note_id], manifest).get(note_id)
+        return None if found is None else found[1]
+
+    def count(self, manifest=None):
+        manifest = manifest or self.load_manifest()
+        return sum(s["count"] - len(s.get("removed", ())) for s in manifest["segments"] if s.get("state") == "done")
+
+    def disk_usage(self, manifest=None):
+        """(展開したときのバイト数, セグメントのファイルの合計バイト数)"""
+        manifest = manifest or self.load_manifest()
+        raw = sum(s["raw_bytes"] for s in manifest["segments"])
+        disk = sum(os.path.getsize(os.path.join(self.dirpath, s["name"])) for s in manifest["segments"])
+        return raw, disk
+
+
+def _finish_moving(archive, backend, manifest):
+    """書き出しただけで元の保存先から消していないセグメント（途中で落ちた跡）を、消して完了にする"""
+    moving = [s for s in manifest["segments"] if s.get("state") == "moving"]
+    for segment in moving:
+        ids = [n.get("id") for block in segment["blocks"] for n in archive._read_block(segment, block)]
+        backend.apply_batch([("delete", i) for i in ids], durable=True)
+        segment["state"] = "done"
+    if moving:
+        archive.save_manifest(manifest)
+
+
+def archive_notes(backend, filepath, before, codec=DEFAULT_CODEC):
+    """created_at が before（"YYYY-MM-DD"）より前のメモを新しいセグメントに移す。移した件数を返す。
+
+    backend は包む前の保存先（ArchivedBackend ではないもの）。
+    1. セグメントを書いて fsync → manifest に "moving" で登録
+    2. 元の保存先から1回の書き込みで消す
+    3. manifest を "done" にする
+    2 の前後で落ちても、次にアーカイブを開いたときに 2・3 をやり直す（消すのは何度やっても同じ）。
+    """
+    archive = Archive(filepath)
+    before = _day(before)
+    with notes_store.write_lock(filepath):
+        manifest = archive.load_manifest()
+        _finish_moving(archive, backend, manifest)
+        old = [n for n in backend.iter_notes() if "" < str(n.get("created_at") or "") < before]
+        if not old:
+            return 0
+        segment = archive.write_segment(manifest, old, codec, before, notes_schema.stored_version(backend))
+        archive.save_manifest(manifest)
+        notes_store._bump_next_id(filepath, old)        # 移したメモの ID を二度と払い出さないように
+        _finish_moving(archive, backend, manifest)
+    return segment["count"]
+
+
+class ArchivedBackend:
+    """ほかのバックエンドを包んで、アーカイブ済みのメモも一緒に見せる（書き込みは元の保存先へ）"""
+
+    def __init__(self, backend, filepath):
+        self.backend = backend
+        self.name = backend.name
+        self.filepath = filepath
+        self.archive = Archive(filepath)
+
+    def _manifest(self):
+        """アーカイブの manifest（途中で止まった移動があれば先に終わらせる）。アーカイブが無ければ None。"""
+        if not os.path.exists(self.archive.path):
+            return None
+        manifest = self.archive.load_manifest()
+        if any(s.get("state") == "moving" for s in manifest["segments"]):
+            with notes_store.write_lock(self.filepath):
+                manifest = self.archive.load_manifest()
+                _finish_moving(self.archive, self.backend, manifest)
+        return manifest
+
+    # ----- 読み込み系：アーカイブ（古い順）→ 元の保存先 -----
+    def iter_notes(self, date_from=None, date_to=None, heads=False):
+        manifest = self._manifest()
+        if manifest is None:
+            return self.backend.iter_notes(date_from, date_to, heads)
+        return self._chain(self.archive.iter_notes(date_from, date_to, manifest),
+                           self.backend.iter_notes(date_from, date_to, heads))
+
+    @staticmethod
+    def _chain(archived, hot):
+        yield from archived
+        yield from hot
+
+    def _archived(self):
+        manifest = self._manifest()
+        return [] if manifest is None else list(self.archive.iter_notes(manifest=manifest))
+
+    def load_all(self):
+        return self._archived() + self.backend.load_all()
+
+    def load_heads(self):
+        return self._archived() + self.backend.load_heads()
+
+    def load_range(self, date_from=None, date_to=None):
+        return list(self.iter_notes(date_from, date_to))
+
+    def body(self, note):
+        if "body" in note:
+            return note["body"]                 # アーカイブのメモは本文つき
+        return self.backend.body(note)
+
+    def with_bodies(self, heads):
+        """本文の無い見出し（元の保存先のもの）だけを元の保存先に渡して、順番どおりに戻す"""
+        filled = iter(self.backend.with_bodies([h for h in heads if "body" not in h]))
+        return [h if "body" in h else next(filled) for h in heads]
+
+    def get(self, note_id):
+        note = self.backend.get(note_id)
+        if note is None and self._manifest() is not None:
+            note = self.archive.get(note_id)
+        return note
+
+    def count(self):
+        manifest = self._manifest()
+        return self.backend.count() + (0 if manifest is None else self.archive.count(manifest))
+
+    def allocate_ids(self, count=1):
+        return self.backend.allocate_ids(count)
+
+    def next_id(self):
+        return self.backend.next_id()
+
+    def signature(self):
+        return (self.backend.signature(), self.archive.signature())
+
+    # ----- 書き込み系：アーカイブ済みのメモは元の保存先に戻してから変更する -----
+    def apply_batch(self, ops, durable=False):
+        targets = [op[1] for op in ops if op[0] in ("update", "delete")]
+        if not targets or self._manifest() is None:
+            return self.backend.apply_batch(ops, durable=durable)
+        with notes_store.write_lock(self.filepath):
+            manifest = self.archive.load_manifest()
+            archived = self.archive.locate(targets, manifest)
+            if archived:
+                # 戻す → removed に足す、の順（間で落ちても消えはしない。2つ見えるのは次に戻すまで）
+                back = [n for i, (_, n) in archived.items() if self.backend.get(i) is None]
+                if back:
+                    self.backend.apply_batch([("add", n) for n in back], durable=True)
+                for note_id, (segment, _) in archived.items():
+                    segment["removed"] = sorted(set(segment.get("removed", ())) | {note_id})
+                self.archive.save_manifest(manifest)
+            return self.backend.apply_batch(ops, durable=durable)
+
+    def add(self, note):
+        return notes_store.unwrap(self.apply_batch([("add", note)])[0])
+
+    def update(self, note_id, fields, expected_version=None):
+        """expected_version を渡すと、version が違うとき VersionConflict にする"""
+        return notes_store.unwrap(self.apply_batch([("update", note_id, fields, expected_version)])[0])
+
+    def delete(self, note_id):
+        return notes_store.unwrap(self.apply_batch([("delete", note_id)])[0])
@@ -0,0 +1,207 @@
+# 差分バックアップ（スナップショット）と、指定した時刻への巻き戻し
+#
+#   data/notes.backups/20251110-120000/manifest.json   … そのときの一覧を作るチャンクの並び・件数・next_id
+#   data/notes.backups/20251110-120000/<sha256>.jsonl   … id を CHUNK_NOTES 件ずつに区切った範囲のメモ（JSONL）
+#   data/notes.backups/20251110-120000/archive/…        … そのときのアーカイブ（notes_archive.py）の manifest とセグメント
+#
+# チャンクの名前は中身の sha256 なので、前回から1件も変わっていない範囲は同じ名前になる。
+# そういうチャンクは前回のバックアップからハードリンクするだけで、新しく書くのは変わった範囲だけ。
+# ディスクの使用量と書き込み量は「前回からの変更の量」で決まり、全体の大きさにはよらない。
+# どのフォルダも単独で完全なので、古いバックアップはフォルダごと消してよい（ほかの回には影響しない）。
+#
+# 1時間ごとに取るなら cron などで:  0 * * * *  python3 test47.py snapshot
+
+import os
+import json
+import shutil
+import hashlib
+import datetime
+
+import notes_store
+import notes_archive
+
+CHUNK_NOTES = 256                       # id をこの件数ずつの範囲に区切って1チャンクにする
+NAME_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def backups_dir(filepath):
+    """notes.json → notes.backups/"""
+    root, _ = os.path.splitext(filepath)
+    return root + ".backups"
+
+
+def _chunk_text(notes):
+    return "".join(json.dumps(n, ensure_ascii=False, sort_keys=True, separators=(",", ":")) + "\n" for n in notes)
+
+
+def _link_or_copy(src, dst):
+    """ハードリンクできない環境（別のファイルシステムなど）ではコピーする"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def list_backups(filepath):
+    """[(フォルダ名, manifest), ...] を古い順に返す（書きかけの一時フォルダは含めない）"""
+    root = backups_dir(filepath)
+    result = []
+    if not os.path.isdir(root):
+        return result
+    for name in sorted(os.listdir(root)):
+        try:
+            with open(os.path.join(root, name, "manifest.json"), "r", encoding="utf-8") as f:
+                result.append((name, json.load(f)))
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            continue
+    result.sort(key=lambda item: item[1].get("created", ""))
+    return result
+
+
+def create_backup(backend, filepath, now=None):
+    """今の一覧をバックアップする。manifest（new_chunks / linked_chunks / new_bytes つき）を返す。
+
+    backend は包む前の保存先（archived=False で開いたもの）。アーカイブは別にまるごと取る。
+    一時フォルダに作ってから名前を変えるので、途中で落ちても書きかけのバックアップは見えない。
+    """
+    now = now or datetime.datetime.now()
+    root = backups_dir(filepath)
+    previous = list_backups(filepath)
+    prev_dir = os.path.join(root, previous[-1][0]) if previous else None
+    name = now.strftime(NAME_FORMAT)
+    while os.path.exists(os.path.join(root, name)):
+        name += "a"                         # 同じ秒に2回取ったとき
+    tmp_dir = os.path.join(root, "." + name + ".tmp")
+    os.makedirs(tmp_dir)
+    try:
+        with notes_store.write_lock(filepath):
+            buckets = {}
+            for note in backend.iter_notes():
+                buckets.setdefault(note.get("id", 0) // CHUNK_NOTES, []).append(note)
+            archive = notes_archive.Archive(filepath)
+            archive_manifest = archive.load_manifest() if os.path.exists(archive.path) else None
+            next_id = notes_store.load_meta(filepath).get("next_id")
+
+        chunks = []
+        stats = {"new_chunks": 0, "linked_chunks": 0, "new_bytes": 0}
+        for key in sorted(buckets):
+            notes = sorted(buckets[key], key=lambda n: n.get("id", 0))
+            data = _chunk_text(notes).encode("utf-8")
+            digest = hashlib.sha256(data).hexdigest()
+            path = os.path.join(tmp_dir, digest + ".jsonl")
+            if prev_dir and os.path.exists(os.path.join(prev_dir, digest + ".jsonl")):
+                _link_or_copy(os.path.join(prev_dir, digest + ".jsonl"), path)
+                stats["linked_chunks"] += 1
+            else:
+                with open(path, "wb") as f:
+                    f.write(data)
+                stats["new_chunks"] += 1
+                stats["new_bytes"] += len(data)
+            chunks.append({"key": key, "hash": digest, "count": len(notes)})
+
+        if archive_manifest is not None:
+            os.makedirs(os.path.join(tmp_dir, "archive"))
+            for segment in archive_manifest["segments"]:
+                _link_or_copy(os.path.join(archive.dirpath, segment["name"]),
+                              os.path.join(tmp_dir, "archive", segment["name"]))
+
+        manifest = dict(stats, created=now.strftime("%Y-%m-%dT%H:%M:%S"), count=sum(c["count"] for c in chunks),
+                        next_id=next_id, chunks=chunks, archive=archive_manifest)
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_dir, os.path.join(root, name))
+        notes_store.fsync_dir(root)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    manifest["name"] = name
+    return manifest
+
+
+def find_backup(filepath, at):
+    """at（datetime か "YYYY-MM-DDTHH:MM:SS" / "YYYY-MM-DD HH:MM" / "YYYY-MM-DD"、またはフォルダ名）の時点で
+    いちばん新しいバックアップを (フォルダ名, manifest) で返す。見つからなければ None。
+
+    秒や時刻を省いたときは、その分・その日の終わりまでに取ったものを探す。
+    """
+    backups = list_backups(filepath)
+    if not isinstance(at, str):
+        at = at.strftime("%Y-%m-%dT%H:%M:%S")
+    at = at.strip()
+    for name, manifest in backups:
+        if name == at:
+            return name, manifest
+    at = at.replace(" ", "T")
+    at += "T23:59:59"[len(at) - 10:] if 10 <= len(at) < 19 else ""
+    found = None
+    for name, manifest in backups:
+        if manifest.get("created", "") <= at:
+            found = (name, manifest)
+    return found
+
+
+def read_backup(filepath, name):
+    """バックアップ name のメモの一覧（id 順）"""
+    folder = os.path.join(backups_dir(filepath), name)
+    with open(os.path.join(folder, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    notes = []
+    for chunk in manifest["chunks"]:
+        with open(os.path.join(folder, chunk["hash"] + ".jsonl"), "r", encoding="utf-8") as f:
+            notes.extend(json.loads(line) for line in f if line.strip())
+    return notes
+
+
+def restore_backup(backend, filepath, name):
+    """保存先をバックアップ name の中身に戻す。(追加, 更新, 削除) の件数を返す。
+
+    違うメモだけを1回の apply_batch で直すので、戻す量は差分の大きさで決まる。
+    戻したメモの version は今の version より1つ進める（古い版を持った画面からの上書きを防ぐため）。
+    next_id は戻さない（バックアップのあとで使った ID は、消えたあとも再利用しない）。
+    バックアップのあとで増えた項目（あとから付いた updated_at など）は update では消せないので残る。
+    """
+    notes = read_backup(filepath, name)
+    folder = os.path.join(backups_dir(filepath), name)
+    with open(os.path.join(folder, "manifest.json"), "r", encoding="utf-8") as f:
+        saved_archive = json.load(f).get("archive")
+
+    def content(note):
+        return {k: v for k, v in note.items() if k != "version"}
+
+    with notes_store.write_lock(filepath):
+        current = {n.get("id"): n for n in backend.iter_notes()}
+        wanted = {n.get("id"): n for n in notes}
+        ops = [("delete", i) for i in current if i not in wanted]
+        added = updated = 0
+        for note_id, note in wanted.items():
+            if note_id not in current:
+                ops.append(("add", dict(note)))
+                added += 1
+            elif content(current[note_id]) != content(note):
+                fields = {k: v for k, v in note.items() if k not in ("id", "version")}
+                ops.append(("update", note_id, fields, None))
+                updated += 1
+        if ops:
+            for result in backend.apply_batch(ops, durable=True):
+                notes_store.unwrap(result)
+
+        # アーカイブも同じ時点に戻す（セグメントは消さずに、manifest が指すものだけを揃える）
+        archive = notes_archive.Archive(filepath)
+        if saved_archive is not None or os.path.exists(archive.path):
+            restored = saved_archive or {"segments": []}
+            os.makedirs(archive.dirpath, exist_ok=True)
+            for segment in restored["segments"]:
+                path = os.path.join(archive.dirpath, segment["name"])
+                saved = os.path.join(folder, "archive", segment["name"])
+                if os.path.exists(path) and os.path.samefile(path, saved):
+                    continue
+                tmp = path + ".restore"             # 同じ名前の別のセグメントがあれば、置き換えで差し替える
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                _link_or_copy(saved, tmp)
+                os.replace(tmp, path)
+            restored = dict(restored, seq=archive.load_manifest().get("seq", 0))
+            archive.save_manifest(restored)
+    return added, updated, len(ops) - added - updated
@@ -0,0 +1,705 @@
+# notes_store.py まわりの簡易ベンチマーク
+#
+# 使い方:
+#   python3 notes_bench.py index            # 線形探索 vs NoteStore（id → 位置の辞書）
+#   python3 notes_bench.py groupcommit      # 同時に追加する人数ごとの書き込み件数/秒
+#   python3 notes_bench.py split            # 一覧表示：notes.json 全件 vs 見出しだけ（split）
+#   python3 notes_bench.py shards           # 1か月分の期間検索：notes.json 全件 vs 月ごとのファイル
+#   python3 notes_bench.py stream           # 全件検索：load_notes（json.load）vs iter_notes（1件ずつ）
+#   python3 notes_bench.py snapshot         # test47 の起動：notes.json vs バイナリのスナップショット（notes.snap）
+#   python3 notes_bench.py archive          # 古いメモを圧縮したときのディスク量と、1件/全件の読み込み時間
+#   python3 notes_bench.py wal              # ジャーナル（WAL）への追加件数/秒：NOTES_FSYNC ごと
+#   python3 notes_bench.py backup           # 差分バックアップ：変更の割合ごとの書き込み量と時間
+#   python3 notes_bench.py schema           # 形の版の移行：全件を読んで書き直す vs 1件ずつ流して書き直す
+#   python3 notes_bench.py order            # 新しい順の一覧：毎回 strptime で並べ替え vs created_ts の並びから切り出し
+#   python3 notes_bench.py serial           # notes.json の書き出し・読み込み時間とファイルの大きさ：indent=2 vs 詰めた形（json / orjson）
+#   python3 notes_bench.py record           # キャッシュに持つ一覧のメモリ：辞書 vs Note（__slots__）vs Note + 文字列の共有
+#   python3 notes_bench.py search           # キーワード検索：全件を1件ずつ見る vs 転置インデックス（ファイルを mmap して検索）
+#   python3 notes_bench.py rank             # 関連度順（BM25）：当てはまる全件を並べる vs 上位 k 件だけをヒープで選ぶ
+#   python3 notes_bench.py highlight        # 検索結果1ページ（1万行）のハイライトとスニペット：1行ごとに正規表現を作る vs 使い回す
+#   python3 notes_bench.py indexupdate      # 書き込みのたびのインデックス更新：全件から作り直す vs 差分のセグメント + 墓石
+
+import os
+import sys
+import time
+import random
+import shutil
+import subprocess
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+import notes_store
+import notes_writer
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def make_notes(n):
+    """ベンチ用のダミーメモを n 件作る"""
+    return [
+        {"id": i, "title": "テスト", "body": f"本文 {i}", "created_at": "2025-11-10T12:00:00"}
+        for i in range(1, n + 1)
+    ]
+
+
+SEARCH_WORDS = ["会議", "議事録", "買い物", "旅行", "東京", "大阪", "読書", "映画", "料理", "予定", "メモ",
+                "python", "flask", "sql", "backup", "release", "テスト", "レビュー", "打ち合わせ", "振り返り"]
+
+
+def make_text_notes(n, seed=0):
+    """検索のベンチ用に、よくある語をランダムに並べた本文のメモを n 件作る（案件番号 = id % 1000 は少ない語）"""
+    rng = random.Random(seed)
+    notes = []
+    for i in range(1, n + 1):
+        title = f"{rng.choice(SEARCH_WORDS)}の{rng.choice(SEARCH_WORDS)} 案件{i % 1000}"
+        body = "、".join(rng.choice(SEARCH_WORDS) for _ in range(rng.randint(5, 20)))
+        notes.append({"id": i, "title": title, "body": body, "created_at": "2025-11-10T12:00:00"})
+    return notes
+
+
+def per_op_us(func, ops):
+    """func(op) を ops の数だけ呼んで、1回あたりのマイクロ秒を返す"""
+    start = time.perf_counter()
+    for op in ops:
+        func(op)
+    return (time.perf_counter() - start) / len(ops) * 1e6
+
+
+def bench_index(args):
+    print(f"{'件数':>10} {'線形get':>12} {'辞書get':>10} {'線形delete':>12} {'辞書delete':>12}  (µs/回)")
+    for n in SIZES[: args.max_sizes]:
+        notes = make_notes(n)
+        store = notes_store.NoteStore(notes)
+        ids = [random.randint(1, n) for _ in range(1000)]
+
+        def linear_get(nid):
+            for row in notes:
+                if row.get("id") == nid:
+                    return row
+            return None
+
+        # 線形探索は遅いので、件数が多いときは回数を減らして測る
+        few = ids[: max(5, 100_000 // n)]
+        lin_get = per_op_us(linear_get, few)
+        dict_get = per_op_us(store.get, ids)
+        lin_del = per_op_us(lambda nid: [row for row in notes if row.get("id") != nid], few[:5])
+        dict_del = per_op_us(store.delete, random.sample(range(1, n + 1), min(n, 1000)))
+        print(f"{n:>10,} {lin_get:>12.1f} {dict_get:>10.2f} {lin_del:>12.1f} {dict_del:>12.2f}")
+
+
+def run_clients(backend, clients, total):
+    """clients 本のスレッドで合計 total 件を追加して、件数/秒を返す"""
+    per_client = max(1, total // clients)
+
+    def client():
+        for _ in range(per_client):
+            backend.add({"id": backend.next_id(), "title": "テスト", "body": "本文",
+                         "created_at": "2025-11-10T12:00:00"})
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return per_client * clients / (time.perf_counter() - start)
+
+
+def bench_groupcommit(args):
+    modes = [
+        ("1件ずつ保存", lambda b: b),
+        ("group/request", lambda b: notes_writer.GroupCommitBackend(b, args.interval_ms, "request")),
+        ("group/batch", lambda b: notes_writer.GroupCommitBackend(b, args.interval_ms, "batch")),
+    ]
+    print(f"既存 {args.base:,} 件の notes.json に {args.total} 件を追加（interval={args.interval_ms}ms）")
+    print(f"{'モード':<16} " + " ".join(f"{c:>3}人(件/秒)" for c in args.clients) + "   平均まとめ件数")
+    for label, wrap in modes:
+        rates = []
+        per_batch = []
+        for clients in args.clients:
+            workdir = tempfile.mkdtemp(prefix="notes-bench-")
+            try:
+                path = os.path.join(workdir, "notes.json")
+                notes_store.save_notes(make_notes(args.base), path)
+                backend = wrap(notes_store.open_backend(path, args.backend))
+                rates.append(run_clients(backend, clients, args.total))
+                if isinstance(backend, notes_writer.GroupCommitBackend):
+                    backend.close()
+                    per_batch.append(backend.ops / max(1, backend.batches))
+            finally:
+                shutil.rmtree(workdir)
+        avg = f"{sum(per_batch) / len(per_batch):.1f}" if per_batch else "1.0"
+        print(f"{label:<16} " + " ".join(f"{r:>12.0f}" for r in rates) + f"   {avg:>8}")
+
+
+def measure(func):
+    """func() の (秒, ピークのメモリ MB) を返す（時間は tracemalloc なしで別に測る）"""
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def measure_time(func):
+    """func() を1回呼んだ秒数"""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_split(args):
+    import notes_split
+
+    print(f"本文 {args.body_chars} 文字のメモで、一覧用に読み込むコスト")
+    print(f"{'件数':>10} {'notes.json':>12} {'heads.json':>12} {'json 読込':>10} {'heads 読込':>10} "
+          f"{'json MB':>9} {'heads MB':>9} {'1件 show':>10}")
+    for n in SIZES[: args.max_sizes]:
+        workdir = tempfile.mkdtemp(prefix="notes-bench-")
+        try:
+            path = os.path.join(workdir, "notes.json")
+            filler = "あ" * args.body_chars
+            notes = [dict(row, body=filler) for row in make_notes(n)]
+            notes_store.save_notes(notes, path)
+            del notes
+            backend = notes_split.SplitBackend(path)
+            notes_split.import_json(path, backend)
+            json_t, json_mb = measure(lambda: notes_store.load_notes(path))
+            heads_t, heads_mb = measure(backend.load_heads)
+            heads = notes_store.NoteStore(backend.load_heads())
+            ids = [random.randint(1, n) for _ in range(1000)]
+            show_us = per_op_us(lambda nid: backend.body(heads.get(nid)), ids)
+            print(f"{n:>10,} {os.path.getsize(path) / 1e6:>10.1f}MB {os.path.getsize(backend.path) / 1e6:>10.1f}MB "
+                  f"{json_t:>9.2f}s {heads_t:>9.2f}s {json_mb:>9.1f} {heads_mb:>9.1f} {show_us:>8.1f}µs")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def bench_shards(args):
+    import notes_shards
+
+    n = args.per_month * args.months
+    notes = make_notes(n)
+    for i, note in enumerate(notes):
+        year, month = divmod(i // args.per_month, 12)
+        note["created_at"] = f"{2024 + year}-{month + 1:02d}-15T12:00:00"
+    print(f"{args.months} か月 × {args.per_month:,} 件 = {n:,} 件から、1か月分を期間指定で読む")
+    workdir = tempfile.mkdtemp(prefix="notes-bench-")
+    try:
+        path = os.path.join(workdir, "notes.json")
+        notes_store.save_notes(notes, path)
+        del notes
+        sharded = notes_shards.ShardedBackend(path)
+        notes_shards.import_json(path, sharded)
+        print(f"{'保存先':<10} {'読んだ件数':>10} {'秒':>8}")
+        for label, backend in (("json", notes_store.JsonBackend(path)), ("sharded", sharded)):
+            start = time.perf_counter()
+            rows = backend.load_range("2024-06-01", "2024-06-30")
+            print(f"{label:<10} {len(rows):>10,} {time.perf_counter() - start:>8.3f}")
+        start = time.perf_counter()
+        sharded.add({"id": sharded.next_id(), "title": "追加", "body": "本文", "created_at": "2025-12-01T00:00:00"})
+        print(f"sharded への追加1件: {(time.perf_counter() - start) * 1000:.1f} ms（その月のファイルに追記するだけ）")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_stream(args):
+    def search(rows):
+        return sum(1 for row in rows if "99" in row.get("body", ""))
+
+    print(f"{'件数':>10} {'notes.json':>12} {'load 秒':>9} {'iter 秒':>9} {'load MB':>9} {'iter MB':>9}")
+    for n in SIZES[: args.max_sizes]:
+        workdir = tempfile.mkdtemp(prefix="notes-bench-")
+        try:
+            path = os.path.join(workdir, "notes.json")
+            notes_store.save_notes(make_notes(n), path)
+            load_t, load_mb = measure(lambda: search(notes_store.load_notes(path)))
+            iter_t, iter_mb = measure(lambda: search(notes_store.iter_notes(path)))
+            print(f"{n:>10,} {os.path.getsize(path) / 1e6:>10.1f}MB {load_t:>9.2f} {iter_t:>9.2f} "
+                  f"{load_mb:>9.1f} {iter_mb:>9.1f}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+# test47.py の NOTES_PATH だけ差し替えて、新しいプロセスでコマンドを1回実行する
+COLD_START = "import sys, test47; test47.NOTES_PATH = sys.argv[1]; sys.argv[1:2] = []; test47.main()"
+
+
+def cold_start(path, command, snapshot):
+    """python3 test47.py <command> を別プロセスで1回動かした秒数（出力は捨てる）"""
+    import notes_snapshot
+
+    env = dict(os.environ, **{notes_snapshot.SNAPSHOT_ENV: "1" if snapshot else "0"})
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", COLD_START, path] + command, env=env, check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def bench_snapshot(args):
+    import notes_snapshot
+
+    commands = [["search", "該当なし"], ["list"]]
+    print(f"{'件数':>10} {'json MB':>8} {'snap MB':>8} {'json.load':>10} {'snap 読込':>10}  "
+          + " ".join(f"{'test47 ' + c[0] + ' json/snap':>26}" for c in commands))
+    for n in args.sizes:
+        workdir = tempfile.mkdtemp(prefix="notes-bench-")
+        try:
+            path = os.path.join(workdir, "notes.json")
+            notes = make_notes(n)
+            for note in notes:
+                note["version"] = 1
+            notes_store.save_notes(notes, path)
+            notes_snapshot.write_snapshot(notes, path)
+            del notes
+            json_t = min(measure_time(lambda: notes_store.load_notes(path)) for _ in range(args.repeat))
+            snap_t = min(measure_time(lambda: notes_snapshot.read_snapshot(path)) for _ in range(args.repeat))
+            cells = []
+            for command in commands:
+                json_cold = min(cold_start(path, command, False) for _ in range(args.repeat))
+                snap_cold = min(cold_start(path, command, True) for _ in range(args.repeat))
+                cells.append(f"{json_cold:>11.2f}s / {snap_cold:>6.2f}s")
+            print(f"{n:>10,} {os.path.getsize(path) / 1e6:>8.1f} "
+                  f"{os.path.getsize(notes_snapshot.snapshot_path(path)) / 1e6:>8.1f} "
+                  f"{json_t:>9.2f}s {snap_t:>9.2f}s  " + " ".join(f"{c:>26}" for c in cells))
+        finally:
+            shutil.rmtree(workdir)
+
+
+def bench_archive(args):
+    import notes_archive
+
+    n = args.notes
+    notes = make_notes(n)
+    words = ["メモ", "会議", "買い物", "予定", "確認", "明日", "資料", "送る", "memo", "todo", "、", "。"]
+    rng = random.Random(0)
+    for i, note in enumerate(notes):
+        note["created_at"] = f"{2020 + i * 5 // n}-06-15T12:00:00"      # 5年に均等に散らばる
+        note["body"] = "".join(rng.choice(words) for _ in range(args.body_chars // 2))
+    cutoff = "2024-01-01"
+    print(f"{n:,} 件（本文 約{args.body_chars} 文字）のうち {cutoff} より前をアーカイブする")
+    print(f"{'形式':<6} {'移した件数':>10} {'元 MB':>8} {'圧縮 MB':>8} {'削減':>6} {'notes.json MB':>14} "
+          f"{'get 通常':>10} {'get 古い':>10} {'うち展開':>10} {'全件 通常':>10} {'全件 古い':>10}")
+    for codec in notes_archive.CODECS:
+        workdir = tempfile.mkdtemp(prefix="notes-bench-")
+        try:
+            path = os.path.join(workdir, "notes.json")
+            notes_store.save_notes(notes, path)
+            hot = notes_store.open_backend(path, "json", archived=False)
+            moved = notes_archive.archive_notes(hot, path, cutoff, codec)
+            archive = notes_archive.Archive(path)
+            raw, disk = archive.disk_usage()
+            backend = notes_store.open_backend(path, "json")
+            old_ids = random.sample(range(1, moved + 1), 20)
+            new_ids = random.sample(range(moved + 1, n + 1), 20)
+            hot_get = per_op_us(backend.get, new_ids) / 1000
+            old_get = per_op_us(backend.get, old_ids) / 1000          # 通常の保存先に無いのを確かめてから、1ブロック展開
+            block_get = per_op_us(archive.get, old_ids) / 1000
+            hot_scan = measure_time(lambda: sum(1 for _ in hot.iter_notes()))
+            old_scan = measure_time(lambda: sum(1 for _ in archive.iter_notes()))
+            print(f"{codec:<6} {moved:>10,} {raw / 1e6:>8.1f} {disk / 1e6:>8.1f} {1 - disk / raw:>6.0%} "
+                  f"{os.path.getsize(path) / 1e6:>14.1f} {hot_get:>8.1f}ms {old_get:>8.1f}ms {block_get:>8.2f}ms "
+                  f"{hot_scan:>9.2f}s {old_scan:>9.2f}s")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def bench_wal(args):
+    print(f"NOTES_JOURNAL=1 で既存 {args.base:,} 件に1件ずつ {args.total} 件追加（1スレッド）")
+    print(f"{'NOTES_FSYNC':<12} {'件/秒':>10}")
+    for policy in args.policies:
+        workdir = tempfile.mkdtemp(prefix="notes-bench-")
+        saved = {k: os.environ.get(k) for k in (notes_store.JOURNAL_ENV, notes_store.FSYNC_ENV)}
+        try:
+            os.environ[notes_store.JOURNAL_ENV] = "1"
+            os.environ[notes_store.FSYNC_ENV] = policy
+            path = os.path.join(workdir, "notes.json")
+            notes_store.save_notes(make_notes(args.base), path)
+            rate = run_clients(notes_store.JsonBackend(path), 1, args.total)
+            print(f"{policy:<12} {rate:>10.0f}")
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            shutil.rmtree(workdir)
+
+
+def bench_backup(args):
+    import datetime
+    import notes_backup
+
+    workdir = tempfile.mkdtemp(prefix="notes-bench-")
+    try:
+        path = os.path.join(workdir, "notes.json")
+        notes_store.save_notes(make_notes(args.notes), path)
+        backend = notes_store.open_backend(path, "json", archived=False)
+        clock = datetime.datetime(2025, 11, 10, 0, 0, 0)
+        start = time.perf_counter()
+        first = notes_backup.create_backup(backend, path, now=clock)
+        print(f"{args.notes:,} 件、notes.json {os.path.getsize(path) / 1e6:.1f}MB。"
+              f"最初のバックアップ: {first['new_bytes'] / 1e6:.1f}MB / {time.perf_counter() - start:.2f}s")
+        print(f"{'変更した件数':>12} {'新規チャンク':>12} {'リンク':>8} {'書いた MB':>10} {'全体比':>8} {'秒':>8}")
+        for changed in args.changes:
+            ids = random.sample(range(1, args.notes + 1), changed)
+            backend.apply_batch([("update", i, {"title": "変更"}, None) for i in ids])
+            clock += datetime.timedelta(hours=1)
+            start = time.perf_counter()
+            m = notes_backup.create_backup(backend, path, now=clock)
+            print(f"{changed:>12,} {m['new_chunks']:>12} {m['linked_chunks']:>8} {m['new_bytes'] / 1e6:>10.2f} "
+                  f"{m['new_bytes'] / first['new_bytes']:>8.1%} {time.perf_counter() - start:>8.2f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_schema(args):
+    import notes_schema
+
+    print(f"{'件数':>10} {'全件で移行':>12} {'ピークMB':>10} {'流して移行':>12} {'ピークMB':>10}")
+    for n in SIZES[: args.max_sizes]:
+        workdir = tempfile.mkdtemp(prefix="notes-bench-")
+        try:
+            path = os.path.join(workdir, "notes.json")
+
+            def reset():
+                notes_store.save_notes(make_notes(n), path)     # updated_at / version の無い版0のメモ
+                notes_schema.set_version(path, "json", 0)
+
+            def whole():
+                notes = [notes_schema._to_v1(note) for note in notes_store.load_notes(path)]
+                notes_store.save_notes(notes, path, durable=True)
+
+            def streamed():
+                notes_schema.migrate(notes_store.open_backend(path, "json", archived=False))
+
+            results = []
+            for func in (whole, streamed):
+                # 移行は1回しか効かないので、時間とメモリを測る前にそれぞれ版0へ戻す（戻す手間は測らない）
+                reset()
+                elapsed = measure_time(func)
+                reset()
+                tracemalloc.start()
+                func()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results.append((elapsed, peak / 1e6))
+            (t1, m1), (t2, m2) = results
+            print(f"{n:>10,} {t1:>11.2f}s {m1:>10.1f} {t2:>11.2f}s {m2:>10.1f}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def bench_order(args):
+    import datetime
+    import notes_schema
+
+    def strptime_sort(notes):
+        # 以前の test48 の index()：1件ずつ created_at を datetime にして並べ替える
+        return sorted(notes, key=lambda n: datetime.datetime.strptime(n["created_at"][:19], "%Y-%m-%dT%H:%M:%S"),
+                      reverse=True)
+
+    print(f"{'件数':>10} {'strptime並べ替え':>16} {'並びを作る':>12} {'先頭50件':>10} {'追加して先頭50件':>18}  (ms)")
+    for n in SIZES[: args.max_sizes]:
+        base = datetime.datetime(2025, 1, 1)
+        notes = [dict(note, created_at=(base + datetime.timedelta(seconds=random.randrange(10 ** 8))).isoformat())
+                 for note in make_notes(n)]
+        notes = list(notes_schema.upgrade(notes, 0))    # created_ts を付ける（保存するときと同じ）
+        old = measure_time(lambda: strptime_sort(notes)) * 1e3
+        store = notes_store.NoteStore(notes)
+        build = measure_time(lambda: store.newest_first(0, 50)) * 1e3
+        page = measure_time(lambda: store.newest_first(0, 50)) * 1e3
+        note = notes_store.stamp_times({"id": n + 1, "title": "新規", "body": "", "created_at": "2030-01-01T00:00:00"})
+
+        def add_then_page():
+            store.add(note)
+            assert store.newest_first(0, 50)[0] is note
+        after_add = measure_time(add_then_page) * 1e3
+        print(f"{n:>10,} {old:>16.1f} {build:>12.1f} {page:>10.3f} {after_add:>18.3f}")
+
+
+def bench_serial(args):
+    import json
+    import notes_schema
+    import notes_serial
+
+    def pretty_dumps(notes):
+        # 以前の save_notes：json.dump(一覧, indent=2)
+        return json.dumps(notes, ensure_ascii=False, indent=2).encode("utf-8")
+
+    formats = [("indent=2（以前）", pretty_dumps, json.loads)]
+    for name in notes_serial.available():
+        codec = notes_serial.get_codec(name)
+        formats.append((f"{name}（詰めた形）", codec.dumps, codec.loads))
+    if notes_serial.orjson is None:
+        print("（orjson は入っていないので測りません。pip install orjson で比べられます）")
+
+    for n in SIZES[: args.max_sizes]:
+        notes = list(notes_schema.upgrade(make_notes(n), 0))   # 保存するときと同じ今の形（version / エポック秒つき）
+        print(f"\n{n:,} 件")
+        print(f"{'形式':<18} {'書き出し':>10} {'読み込み':>10} {'大きさ':>10}")
+        for label, dumps, loads in formats:
+            data = dumps(notes)
+            encode = min(measure_time(lambda: dumps(notes)) for _ in range(args.repeat))
+            decode = min(measure_time(lambda: loads(data)) for _ in range(args.repeat))
+            print(f"{label:<18} {encode * 1e3:>8.1f}ms {decode * 1e3:>8.1f}ms {len(data) / 1e6:>8.2f}MB")
+
+
+def bench_record(args):
+    import notes_schema
+    import notes_serial
+
+    def retained(build):
+        # build() が作って持ち続ける分のメモリ（読み込みの途中で一時的に使った分は数えない）
+        tracemalloc.start()
+        notes = build()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return notes, current / 1e6
+
+    print(f"{'件数':>10} {'辞書MB':>10} {'NoteMB':>10} {'共有ありMB':>12} {'辞書B/件':>10} {'共有ありB/件':>14} {'作る時間':>10}")
+    for n in SIZES[: args.max_sizes]:
+        # notes.json から読んだときと同じく、同じ中身の文字列もメモごとに別のオブジェクトにしておく
+        data = notes_serial.dumps(list(notes_schema.upgrade(make_notes(n), 0)))
+        dicts, dict_mb = retained(lambda: notes_serial.loads(data))
+        del dicts
+        records, note_mb = retained(lambda: [notes_schema.Note(d) for d in notes_serial.loads(data)])
+        del records
+        records, shared_mb = retained(lambda: notes_schema.compact(notes_serial.loads(data)))
+        assert records[0]["title"] == "テスト" and records[-1].title is records[0].title
+        del records
+        build = measure_time(lambda: notes_schema.compact(notes_serial.loads(data)))
+        print(f"{n:>10,} {dict_mb:>10.1f} {note_mb:>10.1f} {shared_mb:>12.1f} "
+              f"{dict_mb * 1e6 / n:>10.0f} {shared_mb * 1e6 / n:>14.0f} {build:>9.2f}s")
+
+
+def bench_search(args):
+    import notes_index
+
+    queries = [
+        (["案件123"], "any"),                   # 少ない語（1000件に1件）
+        (["旅行", "東京"], "all"),
+        (["旅行", "東京"], "any"),
+        (["python", "議事録", "大阪"], "all"),
+        (["pyth"], "any"),                      # 単語の途中（語の一覧から python を探す）
+    ]
+    print(f"{'件数':>10} {'作る時間':>10} {'ファイルMB':>10}  {'検索語':<26} {'全件を見る':>12} {'mmap して検索':>14} {'結果':>10}")
+    for n in SIZES[: args.max_sizes]:
+        notes = make_text_notes(n)
+        workdir = tempfile.mkdtemp(prefix="notes-bench-")
+        try:
+            path = os.path.join(workdir, "seg.seg")
+            start = time.perf_counter()
+            notes_index.Segment.build(notes).write(path)
+            build = time.perf_counter() - start
+            size = os.path.getsize(path) / 1e6
+            for words, match in queries:
+                query = notes_index.Query(words, match)
+                scan = measure_time(lambda: [note for note in notes if query.matches(note)])
+                # test47 の検索と同じく、毎回ファイルを開いて mmap するところから測る
+                indexed = min(measure_time(lambda: notes_index.Segment.open(path).search(query)) for _ in range(3))
+                found = notes_index.Segment.open(path).search(query)
+                label = f"{' '.join(words)}（{match}）"
+                print(f"{n:>10,} {build:>9.2f}s {size:>10.1f}  {label:<26} {scan * 1e3:>10.1f}ms {indexed * 1e3:>12.2f}ms "
+                      f"{len(found):>10,}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def bench_rank(args):
+    import notes_index
+
+    queries = [(["旅行"], "any"), (["旅行", "東京"], "any"), (["pyth"], "any")]
+    print(f"{'件数':>10}  {'検索語':<18} {'結果':>10} {'全部を並べる':>14} {'上位k（ヒープ）':>16}  (k={args.k})")
+    for n in SIZES[: args.max_sizes]:
+        workdir = tempfile.mkdtemp(prefix="notes-bench-")
+        try:
+            path = os.path.join(workdir, "notes.json")
+            notes_store.save_notes(make_text_notes(n), path)
+            backend = notes_store.open_backend(path, "json")
+            index = notes_index.open_index(backend, path)
+            for words, match in queries:
+                query = notes_index.Query(words, match)
+                found = len(index.search(query))
+                full = min(measure_time(lambda: index.rank(query)) for _ in range(3))
+                top = min(measure_time(lambda: index.rank(query, limit=args.k)) for _ in range(3))
+                label = f"{' '.join(words)}（{match}）"
+                print(f"{n:>10,}  {label:<18} {found:>10,} {full * 1e3:>12.1f}ms {top * 1e3:>14.1f}ms")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def bench_highlight(args):
+    import re
+    import html
+    import notes_highlight
+
+    def render(parts):
+        return "".join(f"<mark>{html.escape(t)}</mark>" if hit else html.escape(t) for t, hit in parts)
+
+    def old_row(note, words, ctx=40):
+        # 1行ごとに正規表現を作り、スニペットの窓を探してから、窓の中をもう一度 re.sub で光らせる（以前の test48）
+        def mark(text):
+            return re.sub("|".join(re.escape(w) for w in words), lambda m: f"<mark>{m.group(0)}</mark>",
+                          html.escape(text), flags=re.IGNORECASE)
+        body = note["body"]
+        m = re.compile("|".join(re.escape(w) for w in words), re.IGNORECASE).search(body)
+        snip = html.escape(body[:ctx * 2]) if m is None else mark(body[max(0, m.start() - ctx):m.end() + ctx])
+        return mark(note["title"]), snip
+
+    def new_row(note, words, ctx=40):
+        title, body = note["title"], note["body"]
+        spans = notes_highlight.find_spans(body, words)
+        snip = " … ".join(render(notes_highlight.split_marks(body, spans, s, e))
+                          for s, e in notes_highlight.windows(len(body), spans, ctx))
+        return render(notes_highlight.mark_parts(title, words)), snip
+
+    notes = make_text_notes(args.rows)
+    print(f"{'行数':>8}  {'検索語':<14} {'毎回コンパイル':>14} {'パターンを使い回す':>18}")
+    for words in (["旅行"], ["旅行", "東京"], ["python", "議事録", "大阪"]):
+        old = min(measure_time(lambda: [old_row(n, words) for n in notes]) for _ in range(3))
+        new = min(measure_time(lambda: [new_row(n, words) for n in notes]) for _ in range(3))
+        print(f"{args.rows:>8,}  {' '.join(words):<14} {old * 1e3:>12.1f}ms {new * 1e3:>16.1f}ms")
+    info = notes_highlight._compile.cache_info()
+    print(f"パターンのキャッシュ: ヒット {info.hits:,} 回 / 作成 {info.misses} 回")
+
+
+def bench_indexupdate(args):
+    import notes_index
+
+    print(f"{'件数':>10} {'作り直し':>10} {'書き込みだけ':>12} {'+ 差分反映':>12} {'セグメント':>10}  (書き込みは1件あたり)")
+    for n in SIZES[: args.max_sizes]:
+        workdir = tempfile.mkdtemp(prefix="notes-bench-")
+        try:
+            path = os.path.join(workdir, "notes.json")
+            notes_store.save_notes(make_text_notes(n), path)
+            backend = notes_store.open_backend(path, "json")
+            texts = make_text_notes(args.writes, seed=1)
+            plain = notes_store.open_backend(path, "json", archived=False)
+            start = time.perf_counter()
+            for i, note in zip(random.sample(range(1, n + 1), args.writes), texts):
+                plain.update(i, {"title": note["title"], "body": note["body"]})
+            bare = (time.perf_counter() - start) / args.writes
+
+            index = notes_index.SearchIndex(path)
+            rebuild = measure_time(lambda: index.rebuild(backend))
+            start = time.perf_counter()
+            for i, note in zip(random.sample(range(1, n + 1), args.writes), texts):
+                backend.update(i, {"title": note["title"], "body": note["body"]})
+                index.merge()           # バックグラウンドのまとめ直しを待たずに、その場で済ませる（時間に含める）
+            indexed = (time.perf_counter() - start) / args.writes
+            print(f"{n:>10,} {rebuild:>9.2f}s {bare * 1e3:>10.2f}ms {indexed * 1e3:>10.2f}ms "
+                  f"{len(index.stats()['segments']):>10}")
+            problems, _ = index.check(backend, samples=20)
+            if problems:
+                print(f"  ❗ 食い違い: {problems[:3]}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="notes_store のベンチマーク")
+    sub = parser.add_subparsers(dest="command")
+
+    p_index = sub.add_parser("index", help="id 検索/削除：線形探索 vs NoteStore")
+    p_index.add_argument("--max-sizes", type=int, default=len(SIZES), help="何段階目の件数まで測るか")
+    p_index.set_defaults(func=bench_index)
+
+    p_gc = sub.add_parser("groupcommit", help="同時追加：1件ずつ保存 vs group commit")
+    p_gc.add_argument("--clients", type=int, nargs="+", default=[1, 8, 64], help="同時に追加するスレッド数")
+    p_gc.add_argument("--total", type=int, default=256, help="追加する合計件数")
+    p_gc.add_argument("--base", type=int, default=5000, help="最初から入っている件数")
+    p_gc.add_argument("--interval-ms", type=int, default=5, help="まとめる時間（ミリ秒）")
+    p_gc.add_argument("--backend", choices=["json", "sqlite", "split"], default="json")
+    p_gc.set_defaults(func=bench_groupcommit)
+
+    p_split = sub.add_parser("split", help="一覧表示：notes.json 全件 vs 見出しだけ")
+    p_split.add_argument("--max-sizes", type=int, default=3, help="何段階目の件数まで測るか")
+    p_split.add_argument("--body-chars", type=int, default=500, help="1件あたりの本文の文字数")
+    p_split.set_defaults(func=bench_split)
+
+    p_shards = sub.add_parser("shards", help="期間検索：notes.json 全件 vs 月ごとのファイル")
+    p_shards.add_argument("--months", type=int, default=24, help="何か月分のメモを作るか")
+    p_shards.add_argument("--per-month", type=int, default=20_000, help="1か月あたりの件数")
+    p_shards.set_defaults(func=bench_shards)
+
+    p_stream = sub.add_parser("stream", help="全件検索：load_notes vs iter_notes")
+    p_stream.add_argument("--max-sizes", type=int, default=len(SIZES), help="何段階目の件数まで測るか")
+    p_stream.set_defaults(func=bench_stream)
+
+    p_snap = sub.add_parser("snapshot", help="test47 の起動：notes.json vs notes.snap")
+    p_snap.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000], help="測る件数")
+    p_snap.add_argument("--repeat", type=int, default=3, help="それぞれ何回測って一番速いものを取るか")
+    p_snap.set_defaults(func=bench_snapshot)
+
+    p_arc = sub.add_parser("archive", help="アーカイブ：ディスク量と読み込み時間（通常 vs 圧縮済み）")
+    p_arc.add_argument("--notes", type=int, default=100_000, help="メモの件数")
+    p_arc.add_argument("--body-chars", type=int, default=200, help="1件あたりの本文の文字数")
+    p_arc.set_defaults(func=bench_archive)
+
+    p_wal = sub.add_parser("wal", help="ジャーナル（WAL）への追加：fsync の設定ごとの件数/秒")
+    p_wal.add_argument("--policies", nargs="+", default=["always", "50", "never"], help="NOTES_FSYNC の値")
+    p_wal.add_argument("--total", type=int, default=500, help="追加する件数")
+    p_wal.add_argument("--base", type=int, default=5000, help="最初から入っている件数")
+    p_wal.set_defaults(func=bench_wal)
+
+    p_bk = sub.add_parser("backup", help="差分バックアップ：変更の割合ごとの書き込み量")
+    p_bk.add_argument("--notes", type=int, default=100_000, help="メモの件数")
+    p_bk.add_argument("--changes", type=int, nargs="+", default=[0, 10, 100, 1000, 10_000],
+                      help="バックアップの間に更新する件数（順に1時間ずつ進める）")
+    p_bk.set_defaults(func=bench_backup)
+
+    p_sch = sub.add_parser("schema", help="形の版の移行：全件を読んで書き直す vs 1件ずつ流して書き直す")
+    p_sch.add_argument("--max-sizes", type=int, default=3, help="何段階目の件数まで測るか")
+    p_sch.set_defaults(func=bench_schema)
+
+    p_ord = sub.add_parser("order", help="新しい順の一覧：strptime で並べ替え vs created_ts の並びから切り出し")
+    p_ord.add_argument("--max-sizes", type=int, default=len(SIZES), help="何段階目の件数まで測るか")
+    p_ord.set_defaults(func=bench_order)
+
+    p_ser = sub.add_parser("serial", help="notes.json の書き出し・読み込み：indent=2 vs 詰めた形（json / orjson）")
+    p_ser.add_argument("--max-sizes", type=int, default=3, help="何段階目の件数まで測るか")
+    p_ser.add_argument("--repeat", type=int, default=3, help="それぞれ何回測って一番速いものを取るか")
+    p_ser.set_defaults(func=bench_serial)
+
+    p_rec = sub.add_parser("record", help="キャッシュに持つ一覧のメモリ：辞書 vs Note（__slots__ と文字列の共有）")
+    p_rec.add_argument("--max-sizes", type=int, default=len(SIZES), help="何段階目の件数まで測るか")
+    p_rec.set_defaults(func=bench_record)
+
+    p_srch = sub.add_parser("search", help="キーワード検索：全件を1件ずつ見る vs 転置インデックス")
+    p_srch.add_argument("--max-sizes", type=int, default=3, help="何段階目の件数まで測るか")
+    p_srch.set_defaults(func=bench_search)
+
+    p_rank = sub.add_parser("rank", help="関連度順（BM25）：当てはまる全件を並べる vs 上位 k 件をヒープで選ぶ")
+    p_rank.add_argument("--max-sizes", type=int, default=3, help="何段階目の件数まで測るか")
+    p_rank.add_argument("-k", type=int, default=20, help="上位何件を選ぶか")
+    p_rank.set_defaults(func=bench_rank)
+
+    p_hl = sub.add_parser("highlight", help="検索結果1ページ分のハイライトとスニペット：毎回コンパイル vs 使い回す")
+    p_hl.add_argument("--rows", type=int, default=10_000, help="1ページの行数")
+    p_hl.set_defaults(func=bench_highlight)
+
+    p_iu = sub.add_parser("indexupdate", help="書き込みのたびのインデックス更新：全件の作り直し vs 差分のセグメント")
+    p_iu.add_argument("--max-sizes", type=int, default=3, help="何段階目の件数まで測るか")
+    p_iu.add_argument("--writes", type=int, default=200, help="更新する件数")
+    p_iu.set_defaults(func=bench_indexupdate)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if hasattr(args, "func"):
+        args.func(args)
+    else:
+        print("❗ベンチマーク名を指定してください（index / groupcommit / split / shards / stream / snapshot / archive / wal / backup / schema / order / serial / record / search / rank / highlight / indexupdate）")
+
+
+if __name__ == "__main__":
+    main()
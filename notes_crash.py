@@ -0,0 +1,153 @@
+# ジャーナル（WAL）の障害試験：書き込み中のプロセスをランダムな時点で落として、何が残るかを確かめる
+#
+# 使い方:
+#   python3 notes_crash.py                          # 30回、NOTES_FSYNC=always
+#   python3 notes_crash.py --runs 100 --fsync 50    # 50ms ごとに fsync する設定で100回
+#
+# 1回の試験：
+#   1. 書き込み役（このファイルを --writer で起動した子プロセス）が NOTES_JOURNAL=1 で
+#      1〜5件ずつの追加・更新を繰り返す。書く前に「begin」、保存から戻ったら「ack」を標準出力に出す。
+#      ジャーナルはすぐコンパクションされる大きさにしてあるので、コンパクションの途中でも落ちる。
+#   2. ランダムな時間のあと SIGKILL で落とす。--tear の割合で、書き込み役が自分で
+#      「1まとまりを途中のバイトまで書いて落ちる」（書きかけの追記）を起こす回も混ぜる。
+#   3. recover_journal() → load_notes() で読み直し、次を確かめる。
+#        - ack まで出たまとまりは全部残っている
+#        - どのまとまりも「全部ある」か「全部ない」（半分だけ反映されていない）
+#        - 知らない id が無い、id が重複していない
+#        - 復旧後にもう1件追記して、それがちゃんと読める
+#
+# SIGKILL はプロセスが落ちるだけで OS のページキャッシュは残るので、ここで確かめられるのは
+# 「プロセスが落ちたとき」の整合性。電源断での違い（always / 間隔 / never）はこの試験では見えない。
+
+import os
+import sys
+import time
+import random
+import signal
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import notes_store
+
+BASE_NOTES = 200
+
+
+def writer(path, tear):
+    """子プロセス側：落とされるまで追加・更新を続ける"""
+    notes_store.JOURNAL_COMPACT_BYTES = 16 * 1024       # コンパクションを頻繁に起こす
+    backend = notes_store.JsonBackend(path)
+    rng = random.Random()
+    tear_after = rng.randint(5, 200) if tear else None
+    batch_no = 0
+    while True:
+        batch_no += 1
+        ids = list(backend.allocate_ids(rng.randint(1, 5)))
+        ops = [("add", {"id": i, "title": f"crash {i}", "body": "x" * rng.randint(0, 300),
+                        "created_at": "2025-11-10T12:00:00"}) for i in ids]
+        if rng.random() < 0.3:
+            ops.append(("update", rng.randint(1, BASE_NOTES), {"title": f"updated in {batch_no}"}, None))
+        print("begin", *ids, flush=True)
+        if tear_after is not None and batch_no >= tear_after:
+            # 1まとまりを途中まで書いたところで落ちる（書きかけの追記）
+            entries = [{"op": "add", "note": dict(op[1], version=1)} for op in ops if op[0] == "add"]
+            data = notes_store.format_journal(entries)
+            with notes_store.write_lock(path):
+                with open(notes_store.journal_path(path), "ab") as f:
+                    f.write(data[:rng.randint(1, len(data) - 1)])
+            os._exit(9)
+        backend.apply_batch(ops)
+        print("ack", *ids, flush=True)
+
+
+def run_once(workdir, fsync, tear, max_wait):
+    """1回落として確かめる。(問題のリスト, ack 済みのまとまり数, 書きかけを起こしたか) を返す"""
+    path = os.path.join(workdir, "notes.json")
+    notes_store.save_notes([{"id": i, "title": f"base {i}", "body": "", "created_at": "2025-11-01T00:00:00"}
+                            for i in range(1, BASE_NOTES + 1)], path)
+    env = dict(os.environ, **{notes_store.JOURNAL_ENV: "1", notes_store.FSYNC_ENV: fsync})
+    cmd = [sys.executable, os.path.abspath(__file__), "--writer", path] + (["--writer-tear"] if tear else [])
+    out_path = os.path.join(workdir, "writer.out")
+    with open(out_path, "w") as out:
+        child = subprocess.Popen(cmd, env=env, stdout=out)
+        time.sleep(random.uniform(0.05, max_wait))
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+
+    begun, acked = [], set()
+    with open(out_path) as f:
+        for line in f:
+            parts = line.split()
+            if not parts or (parts[0] in ("begin", "ack") and not line.endswith("\n")):
+                continue                    # 出力の途中で落ちた行
+            ids = tuple(int(x) for x in parts[1:])
+            if parts[0] == "begin":
+                begun.append(ids)
+            elif parts[0] == "ack":
+                acked.add(ids)
+
+    problems = []
+    notes_store.recover_journal(path)
+    try:
+        notes = notes_store.load_notes(path)
+    except Exception as e:
+        return [f"読めない: {type(e).__name__} - {e}"], len(acked), tear
+    ids = [n.get("id") for n in notes]
+    present = set(ids)
+    if len(ids) != len(present):
+        problems.append("id が重複している")
+    known = set(range(1, BASE_NOTES + 1)) | {i for batch in begun for i in batch}
+    if present - known:
+        problems.append(f"知らない id: {sorted(present - known)[:5]}")
+    if not set(range(1, BASE_NOTES + 1)) <= present:
+        problems.append("最初からあったメモが消えた")
+    for batch in begun:
+        got = [i in present for i in batch]
+        if batch in acked and not all(got):
+            problems.append(f"ack 済みなのに消えた: {batch}")
+        elif any(got) and not all(got):
+            problems.append(f"半分だけ反映された: {batch}")
+
+    # 復旧後の追記がちゃんと読めるか（書きかけの行にくっついて消えないか）
+    backend = notes_store.JsonBackend(path)
+    probe = backend.next_id()
+    with notes_store.write_lock(path):
+        notes_store.append_journal_entries(path, [{"op": "add", "note": {"id": probe, "title": "probe"}}])
+    if notes_store.NoteStore(notes_store.load_notes(path)).get(probe) is None:
+        problems.append("復旧後の追記が読めない")
+    return problems, len(acked), tear
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ジャーナル（WAL）の障害試験")
+    parser.add_argument("--runs", type=int, default=30, help="何回落とすか")
+    parser.add_argument("--fsync", default="always", help="NOTES_FSYNC（always / never / ミリ秒）")
+    parser.add_argument("--tear", type=float, default=0.3, help="書きかけの追記で落とす回の割合")
+    parser.add_argument("--max-wait", type=float, default=1.5, help="落とすまでの最長秒数")
+    parser.add_argument("--writer", help=argparse.SUPPRESS)
+    parser.add_argument("--writer-tear", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.writer:
+        writer(args.writer, args.writer_tear)
+        return
+
+    failed = torn = total_acked = 0
+    for run in range(1, args.runs + 1):
+        workdir = tempfile.mkdtemp(prefix="notes-crash-")
+        try:
+            problems, acked, tear = run_once(workdir, args.fsync, random.random() < args.tear, args.max_wait)
+        finally:
+            shutil.rmtree(workdir)
+        total_acked += acked
+        torn += tear
+        if problems:
+            failed += 1
+            print(f"❌️ {run:>3}回目（ack {acked}）: " + " / ".join(problems))
+    print(f"{args.runs} 回（うち書きかけの追記 {torn} 回）、ack 済みのまとまり {total_acked} 個、"
+          f"問題のあった回 {failed}（NOTES_FSYNC={args.fsync}）")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# 検索結果のキーワードを光らせる（<mark>）ところと、本文のスニペット（一致箇所の前後だけ）を作るところ
+#
+# 1ページに何千行も出すので、1行ごとに正規表現を作り直さない:
+#   pattern()    … 検索語の並び + 大文字小文字の区別 → コンパイル済みの正規表現（LRU で使い回す）
+#   find_spans() … 1つの文字列の中の一致箇所を、1回だけ探す
+#   windows()    … 一致箇所の前後 ctx 文字ずつの窓。近い窓はつなげて、先頭から何個かだけ使う
+#   split_marks()… 窓の中を「ふつうの文字 / 光らせる文字」に分ける（見つけ済みの一致箇所をそのまま使う）
+#   mark_parts() … 切り出さない文字列（タイトル）を、探すのと分けるのを1回で済ませて分ける
+# HTML にするのは呼ぶ側（test48 は markupsafe の escape / Markup）。ここでは文字列の位置だけを扱う。
+# 一致箇所は元の文字列で探してからエスケープするので、"&" や "<" を含む検索語も光り、&amp; の中に <mark> が入ることもない。
+
+import re
+import functools
+
+PATTERN_CACHE = 256         # 覚えておく正規表現の数（検索語の組み合わせごとに1つ）
+SNIPPET_CTX = 40            # 一致箇所の前後に何文字ずつ見せるか
+SNIPPET_WINDOWS = 3         # スニペットに使う窓の数（多すぎると長くなるので先頭から）
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE)
+def _compile(words, case_sensitive):
+    # 長い語から並べる（"py" と "python" の両方なら python 全体を光らせる）
+    alternation = "|".join(re.escape(w) for w in sorted(set(words), key=len, reverse=True))
+    # 全体を ( ) で囲んでおく（split() で一致した部分も返ってくるように）
+    return re.compile(f"({alternation})", 0 if case_sensitive else re.IGNORECASE)
+
+
+def pattern(words, case_sensitive=False):
+    """words のどれかに一致する正規表現。光らせる語が無ければ None。"""
+    words = tuple(w for w in (words or ()) if w)
+    if not words:
+        return None
+    return _compile(words, bool(case_sensitive))
+
+
+def find_spans(text, words, case_sensitive=False):
+    """text の中で words のどれかに一致する箇所 [(開始, 終了), ...]（重ならない、前から順）"""
+    pat = pattern(words, case_sensitive)
+    if pat is None or not text:
+        return []
+    return [m.span() for m in pat.finditer(text)]
+
+
+def mark_parts(text, words, case_sensitive=False):
+    """text 全体を [(文字列, 光らせるか), ...] に分ける（タイトルなど、切り出さずに全部見せるもの）
+
+    一致箇所を探すのと分けるのを re の split() 1回で済ませる（find_spans + split_marks と同じ結果）。
+    """
+    pat = pattern(words, case_sensitive)
+    if pat is None or not text:
+        return [(text, False)] if text else []
+    pieces = pat.split(text)            # [ふつう, 一致, ふつう, 一致, ..., ふつう]
+    return [(piece, i % 2 == 1) for i, piece in enumerate(pieces) if piece]
+
+
+def split_marks(text, spans, start=0, end=None):
+    """text[start:end] を [(文字列, 光らせるか), ...] に分ける。spans は find_spans の結果（範囲の外のものは無視する）"""
+    end = len(text) if end is None else end
+    parts = []
+    at = start
+    for s, e in spans:
+        if e <= start or s < at:
+            continue
+        if s >= end:
+            break
+        if s > at:
+            parts.append((text[at:s], False))
+        parts.append((text[s:e], True))
+        at = e
+    if at < end:
+        parts.append((text[at:end], False))
+    return parts
+
+
+def windows(length, spans, ctx=SNIPPET_CTX, limit=SNIPPET_WINDOWS):
+    """一致箇所の前後 ctx 文字ずつの窓 [(開始, 終了), ...]
+
+    となりの窓との間が ctx 文字以内なら1つにつなげる（同じ話題の一致を1つの窓で見せる）。先頭から limit 個まで。
+    """
+    merged = []
+    for s, e in spans:
+        lo, hi = max(0, s - ctx), min(length, e + ctx)
+        if merged and lo - merged[-1][1] <= ctx:
+            merged[-1][1] = max(merged[-1][1], hi)
+            continue
+        if len(merged) == limit:
+            break
+        merged.append([lo, hi])
+    return [tuple(w) for w in merged]
@@ -0,0 +1,881 @@
+# メモ検索の転置インデックス（語 → その語を含むメモの番号の並び）
+#
+# 語の切り方（title と body をそれぞれ、小文字にしてから切る）:
+#   英数字（ASCII）の連なり … 単語1つを1語にする           "Python Flask" → python / flask
+#   それ以外の文字の連なり   … となり合う2文字ずつ（2-gram） "議事録メモ"   → 議事 / 事録 / 録メ / メモ
+#                              1文字だけの連なりはその1文字を1語にする
+#   空白・記号              … 区切り（語にしない）
+#
+# 検索語 q の「部分一致」（q in title / q in body）を、次の2段で調べる:
+#   1. 候補を絞る … q を同じ規則で切って「q を含むメモなら必ず持っている語」を集め、その語の並びの共通部分を取る
+#                   （並びは番号順なので、いちばん短い並びの番号だけを二分探索でほかの並びに探す）
+#   2. 確かめる   … 候補のメモだけ、今までどおり q in title / body で確かめる（Query.matches）
+#                   title / body はセグメントにも入れてあるので、notes.json は読まない
+# 候補は「本当の答え」を必ず含む（少し多いことはある）ので、結果は全件を1件ずつ見たときと同じになる。
+# 大文字小文字を区別しない title + body の検索では、語そのものか語の一部だけの検索語（"python" や "議事"）は
+# 候補がそのまま答えなので確かめない（ほかの検索語だけを確かめる）。
+#
+# q の端の単語は、メモの中ではもっと長い単語の一部かもしれない（"pyth" は python の一部）。
+# そういう語は語の一覧から「その文字で始まる / 終わる / を含む」語を探して、その並びを合わせたものを使う。
+# 当てはまる語が多すぎるとき（"a" など）は絞り込みに使わない（確かめる段で落とすので、結果は変わらない）。
+#
+# 関連度順（test47 の --sort relevance / test48 の ?sort=relevance）は BM25 で点数をつける（SearchIndex.rank）。
+# title に出てくる語は body の TITLE_BOOST 回分に数える。語ごとの回数（tf）とメモの語の数（文書の長さ）は
+# セグメントに入れてあるのでメモは読まない。上位 k 件だけが要るときはヒープで選ぶ（O(n log k)）。
+#
+# インデックスは notes.index/ に置き、書き込みのたびに作り直さず差分だけを足す（IndexedBackend）:
+#   追加・更新 … そのメモだけの小さなセグメント（書いたら変えない転置インデックス）を1つ足す
+#   更新・削除 … 古いセグメントの中のその id に墓石（manifest の "deleted"）を立てる。検索では候補から除く
+#   まとめ直し … 同じくらいの大きさのセグメントがたまる・墓石が増えると、バックグラウンドで1つにまとめる
+# インデックスを通さない書き換え（restore / archive / migrate など）は保存先の signature() が
+# 記録と違うことでわかるので、次に検索するときに全件から作り直す（open_index）。
+# セグメントのファイルは mmap して使うだけなので、test47 の検索のように毎回新しいプロセスでも読み込みの時間はかからない。
+# `python3 test47.py index --check` で、インデックスを使った検索と全件を見る検索が同じになるかを確かめられる。
+
+import os
+import re
+import sys
+import json
+import math
+import array
+import heapq
+import bisect
+import itertools
+import mmap
+import struct
+import random
+import threading
+
+import notes_store
+
+_RUN = re.compile(r"[0-9a-z_]+|[^\W0-9a-z_]+")     # ASCII の英数字の連なり / それ以外の文字（かな・漢字など）の連なり
+MAX_EXPAND = 1000           # 端の単語に当てはまる語がこれより多ければ、その語では絞らない
+
+
+def _is_ascii(run):
+    return run[0] < "\x80"
+
+
+def _fold(text):
+    """小文字にする。ギリシャ文字の語末のシグマ（ς）は位置で変わるので σ に揃える（大文字 Σ の検索語でも見つかるように）"""
+    return text.lower().replace("ς", "σ")
+
+
+def term_counts(text):
+    """text に含まれる語と、それぞれが出てくる回数（関連度の tf にも使う）"""
+    counts = {}
+    for run in _RUN.findall(_fold(text)):
+        if _is_ascii(run) or len(run) == 1:
+            counts[run] = counts.get(run, 0) + 1
+        else:
+            for i in range(len(run) - 1):
+                term = run[i:i + 2]
+                counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+def requirements(word):
+    """検索語 word を含むメモが必ず持っている語の条件 [(種類, 語), ...]
+
+    種類は exact（その語そのもの）/ prefix（その語で始まる語）/ suffix（で終わる語）/ infix（を含む語）。
+    word の端にある連なりは、メモの中ではもっと長い連なりの一部かもしれないので exact にできない。
+    """
+    word = _fold(word)
+    reqs = []
+    for m in _RUN.finditer(word):
+        run = m.group()
+        left_open = m.start() == 0
+        right_open = m.end() == len(word)
+        if not _is_ascii(run) and len(run) >= 2:
+            # 2文字ずつの語は、メモ側の連なりが長くても必ず同じものが出てくる
+            reqs.extend(("exact", run[i:i + 2]) for i in range(len(run) - 1))
+        elif not left_open and not right_open:
+            reqs.append(("exact", run))
+        elif not _is_ascii(run):
+            reqs.append(("infix", run))         # 1文字：その文字を含む2文字の語か、その1文字の語
+        elif left_open and right_open:
+            reqs.append(("infix", run))
+        elif left_open:
+            reqs.append(("suffix", run))
+        else:
+            reqs.append(("prefix", run))
+    return reqs
+
+
+class Query:
+    """検索の条件（キーワード・any / all・対象・大文字小文字）と、1件が当てはまるかの確かめ"""
+
+    def __init__(self, words, match="any", scope="both", case_sensitive=False):
+        self.case_sensitive = case_sensitive
+        self.words = [w for w in words if w] if case_sensitive else [w.lower() for w in words if w]
+        self.match = match
+        self.scope = scope
+
+    def fields(self, note):
+        prep = (lambda s: s or "") if self.case_sensitive else (lambda s: (s or "").lower())
+        if self.scope == "title":
+            return [prep(note.get("title", ""))]
+        if self.scope == "body":
+            return [prep(note.get("body", ""))]
+        return [prep(note.get("title", "")), prep(note.get("body", ""))]
+
+    def matches(self, note):
+        """any: どれかの語がどれかの対象に含まれる / all: すべての語が、どれかの対象に含まれる"""
+        if not self.words:
+            return True
+        fields = self.fields(note)
+        test = any if self.match == "any" else all
+        return test(any(w in f for f in fields) for w in self.words)
+
+
+def _contains(postings, doc):
+    i = bisect.bisect_left(postings, doc)
+    return i < len(postings) and postings[i] == doc
+
+
+def intersect(lists):
+    """番号順の並びの共通部分（いちばん短い並びの番号を、ほかの並びで二分探索する）"""
+    lists = sorted(lists, key=len)
+    result = list(lists[0])
+    for other in lists[1:]:
+        if not result:
+            break
+        result = [doc for doc in result if _contains(other, doc)]
+    return result
+
+
+def union(lists):
+    """番号順の並びを合わせた、重なりの無い番号順の並び"""
+    if len(lists) == 1:
+        return lists[0]
+    return sorted(set().union(*lists))
+
+
+# ===== セグメント（書いたら変えない、小さな転置インデックス） =====
+# 1つのセグメントは1つのファイル（seg-NNNNNN.seg）で、読むときは mmap するだけ（パースしない）。
+#   見出し   … MAGIC / FORMAT / 区画の数、続いて区画ごとの (名前, 位置, バイト数)
+#   ids      … メモの id（q の並び、id 順）。以下「何番目」はこの並びの位置
+#   created  … そのメモの created_ts（q の並び。期間の絞り込みに使う）
+#   docoff   … docs の中での title / body の位置（Q の並び。2i 〜 2i+1 が title、2i+1 〜 2i+2 が body）
+#   docs     … title と body の UTF-8（候補を確かめるのに使う。notes.json を読まずに済む）
+#   termoff  … terms の中での語の位置（Q の並び）
+#   terms    … 語の UTF-8 をバイト順に並べ、1語ごとに "\n" で終えたもの（語の辞書。二分探索する）
+#   postoff  … post の中での、語ごとの並びの位置（Q の並び）
+#   post     … 語を含むメモの「何番目」（I の並び、語ごとに番号順）
+#   tft/tfb  … post と同じ並びで、その語が title / body に出てくる回数（H の並び。関連度の tf）
+#   tlen/blen … メモごとの title / body の語の数（I の並び。関連度の文書の長さ）
+#   totals   … tlen と blen それぞれの合計（Q の並び。平均の長さに使う）
+# UTF-8 のバイト順は文字の順と同じなので、辞書はバイトのまま比べられる。区画は8バイトごとに揃えて置く。
+MAGIC = b"NIDX"
+FORMAT = 2
+_HEADER = struct.Struct("<4sII")
+_SECTION = struct.Struct("<8sQQ")
+_TYPES = {b"ids": "q", b"created": "q", b"docoff": "Q", b"termoff": "Q", b"postoff": "Q", b"post": "I",
+          b"tft": "H", b"tfb": "H", b"tlen": "I", b"blen": "I", b"totals": "Q"}
+TF_MAX = 0xFFFF             # tf はこの回数で頭打ちにする（H に入る大きさ）
+
+
+def _format():
+    """manifest に書く形式（形式やバイト順が違うマシンで作ったものは作り直す）"""
+    return [FORMAT, sys.byteorder]
+
+
+def _encode(text):
+    return text.encode("utf-8", "surrogatepass")
+
+
+def _decode(data):
+    return str(data, "utf-8", "surrogatepass")
+
+
+def _created_ts(note):
+    created = note.get("created_ts")
+    if created is None:
+        created = notes_store.to_epoch(note.get("created_at")) or 0
+    return created
+
+
+def in_span(created, span):
+    """created_ts が期間 (開始, 終了)（test47 の epoch_span()）に入っているか。0 は作成日時が読めないメモで、期間を指定したら含めない。"""
+    if span is None:
+        return True
+    lo, hi = span
+    if lo is not None and (not created or created < lo):
+        return False
+    if hi is not None and (not created or created > hi):
+        return False
+    return True
+
+
+class Segment:
+    """セグメント1つ（ファイルを mmap したもの、または作ったばかりのバイト列）"""
+
+    def __init__(self, buf):
+        self._buf = buf
+        magic, fmt, count = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise ValueError(f"not a search index segment (format {FORMAT})")
+        view = memoryview(buf)
+        sections = {}
+        for k in range(count):
+            name, offset, length = _SECTION.unpack_from(buf, _HEADER.size + k * _SECTION.size)
+            name = name.rstrip(b"\0")
+            part = view[offset:offset + length]
+            sections[name] = part.cast(_TYPES[name]) if name in _TYPES else part
+            if name == b"terms":
+                self._terms_at = offset
+        self.ids = sections[b"ids"]
+        self._created = sections[b"created"]
+        self._docoff = sections[b"docoff"]
+        self._docs = sections[b"docs"]
+        self._termoff = sections[b"termoff"]
+        self._postoff = sections[b"postoff"]
+        self._post = sections[b"post"]
+        self._tft = sections[b"tft"]
+        self._tfb = sections[b"tfb"]
+        self._tlen = sections[b"tlen"]
+        self._blen = sections[b"blen"]
+        self.totals = tuple(sections[b"totals"])
+
+    # ----- 作る -----
+    @staticmethod
+    def pack(notes):
+        """メモの一覧をセグメントのバイト列にする（id 順に並べ直してから入れる）"""
+        ids, created = array.array("q"), array.array("q")
+        docoff, docs = array.array("Q", [0]), bytearray()
+        tlen, blen = array.array("I"), array.array("I")
+        postings = {}           # 語 → [何番目, title での回数, body での回数, 何番目, ...]
+        for pos, note in enumerate(sorted(notes, key=lambda n: n["id"])):
+            ids.append(note["id"])
+            created.append(_created_ts(note))
+            title, body = note.get("title") or "", note.get("body") or ""
+            for text in (title, body):
+                docs += _encode(text)
+                docoff.append(len(docs))
+            in_title, in_body = term_counts(title), term_counts(body)
+            tlen.append(sum(in_title.values()))
+            blen.append(sum(in_body.values()))
+            for term in in_title.keys() | in_body.keys():
+                postings.setdefault(term, []).extend(
+                    (pos, min(in_title.get(term, 0), TF_MAX), min(in_body.get(term, 0), TF_MAX)))
+        termoff, terms = array.array("Q", [0]), bytearray()
+        postoff, post = array.array("Q", [0]), array.array("I")
+        tft, tfb = array.array("H"), array.array("H")
+        for key, term in sorted((_encode(t), t) for t in postings):
+            terms += key + b"\n"
+            termoff.append(len(terms))
+            found = postings[term]
+            post.extend(found[0::3])
+            tft.extend(found[1::3])
+            tfb.extend(found[2::3])
+            postoff.append(len(post))
+        totals = array.array("Q", [sum(tlen), sum(blen)])
+        parts = [(b"ids", ids.tobytes()), (b"created", created.tobytes()), (b"docoff", docoff.tobytes()),
+                 (b"docs", bytes(docs)), (b"termoff", termoff.tobytes()), (b"terms", bytes(terms)),
+                 (b"postoff", postoff.tobytes()), (b"post", post.tobytes()), (b"tft", tft.tobytes()),
+                 (b"tfb", tfb.tobytes()), (b"tlen", tlen.tobytes()), (b"blen", blen.tobytes()),
+                 (b"totals", totals.tobytes())]
+        out = bytearray(_HEADER.pack(MAGIC, FORMAT, len(parts)) + bytes(_SECTION.size * len(parts)))
+        for k, (name, data) in enumerate(parts):
+            out += bytes(-len(out) % 8)
+            _SECTION.pack_into(out, _HEADER.size + k * _SECTION.size, name, len(out), len(data))
+            out += data
+        return bytes(out)
+
+    @classmethod
+    def build(cls, notes):
+        return cls(cls.pack(notes))
+
+    @classmethod
+    def merge(cls, parts):
+        """[(セグメント, 消えた id の集合), ...] を、消えた id を除いて1つにまとめる（保存した本文から作り直す）"""
+        return cls.build(note for seg, dead in parts for note in seg.docs() if note["id"] not in dead)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def write(self, path, durable=False):
+        with notes_store.atomic_writer(path, durable=durable, binary=True) as f:
+            f.write(self._buf)
+
+    # ----- 読む -----
+    def __len__(self):
+        return len(self.ids)
+
+    def has(self, note_id):
+        return _contains(self.ids, note_id)
+
+    def term_count(self):
+        return len(self._termoff) - 1
+
+    def doc(self, pos):
+        """pos 番目のメモの title / body（Query.matches に渡せる形）"""
+        off = self._docoff
+        return {"id": self.ids[pos], "title": _decode(self._docs[off[2 * pos]:off[2 * pos + 1]]),
+                "body": _decode(self._docs[off[2 * pos + 1]:off[2 * pos + 2]]), "created_ts": self._created[pos]}
+
+    def docs(self):
+        return (self.doc(pos) for pos in range(len(self)))
+
+    def _term(self, i):
+        start = self._terms_at + self._termoff[i]
+        return self._buf[start:self._terms_at + self._termoff[i + 1] - 1]
+
+    def _lower_bound(self, key):
+        """key 以上の最初の語の番号"""
+        lo, hi = 0, self.term_count()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _postings(self, i):
+        return self._post[self._postoff[i]:self._postoff[i + 1]]
+
+    def _find(self, term):
+        """語の番号（無ければ None）"""
+        key = _encode(term)
+        i = self._lower_bound(key)
+        return i if i < self.term_count() and self._term(i) == key else None
+
+    def _lookup(self, term):
+        i = self._find(term)
+        return [] if i is None else self._postings(i)
+
+    def _expand(self, kind, run):
+        """端の単語に当てはまる語の並びを合わせたもの。多すぎれば None（その条件では絞らない）"""
+        found = self._matching_terms(kind, run)
+        if found is None:
+            return None
+        return union([self._postings(i) for i in found]) if found else []
+
+    def _matching_terms(self, kind, run):
+        """run で始まる / 終わる / を含む語の番号。MAX_EXPAND より多ければ None。
+
+        prefix は辞書を二分探索、suffix / infix は辞書のバイト列をそのまま find で探す（1語ずつ取り出さない）。
+        """
+        key = _encode(run)
+        if kind == "prefix":
+            lo, hi = self._lower_bound(key), self._lower_bound(key + b"\xff")
+            found = range(lo, hi)
+        else:
+            needle = key + b"\n" if kind == "suffix" else key
+            start, end = self._terms_at, self._terms_at + self._termoff[-1]
+            found = []
+            at = self._buf.find(needle, start, end)
+            while at >= 0:
+                i = bisect.bisect_right(self._termoff, at - start) - 1
+                found.append(i)
+                if len(found) > MAX_EXPAND:
+                    break
+                at = self._buf.find(needle, start + self._termoff[i + 1], end)
+        return None if len(found) > MAX_EXPAND else list(found)
+
+    def _postings_for(self, word):
+        """word を含むメモの候補（番号順）と、候補がそのまま答えになるか。絞り込みに使える語が無ければ (None, False)。"""
+        reqs = requirements(word)
+        lists = []
+        for kind, run in reqs:
+            if kind == "exact":
+                postings = self._lookup(run)
+            else:
+                postings = self._expand(kind, run)
+                if postings is None:
+                    continue
+            if not postings:
+                return [], True
+            lists.append(postings)
+        if not lists:
+            return None, False
+        # 条件が「word 全体を含む語」1つだけなら、その語を持つメモは必ず word を含む（確かめなくてよい）。
+        # 大文字小文字を区別しない title + body の検索のときだけ使える（candidates）
+        whole = len(reqs) == 1 == len(lists) and reqs[0][1] == word and reqs[0][0] in ("exact", "infix")
+        return intersect(lists), whole and "σ" not in word and "ς" not in word
+
+    def candidates(self, query):
+        """query の候補と、その確かめ方 (番号の並び, 確かめずに当てはまる番号, 確かめる Query)
+
+        番号の並びが None ならすべてが候補。確かめる Query が None なら候補がそのまま答え。
+        候補がそのまま答えになる語（_postings_for）は確かめる Query から外し、残りの語だけを確かめる。
+        """
+        per_word = [(w,) + self._postings_for(w) for w in query.words]
+        if not per_word:
+            return None, (), None
+        if query.case_sensitive or query.scope != "both":
+            per_word = [(w, p, False) for w, p, _ in per_word]
+        unsure = [w for w, _, exact in per_word if not exact]
+        check = None
+        if len(unsure) == len(per_word):
+            check = query
+        elif unsure:
+            check = Query(unsure, query.match, query.scope, query.case_sensitive)
+        if query.match == "all":
+            known = [p for _, p, _ in per_word if p is not None]
+            return (intersect(known) if known else None), (), check
+        if any(p is None for _, p, _ in per_word):
+            return None, (), query
+        sure = ()
+        if check is not None and check is not query:
+            sure = set(union([p for _, p, exact in per_word if exact]))
+        return union([p for _, p, _ in per_word]), sure, check
+
+    def matches(self, query, dead=(), span=None):
+        """query と期間 span に当てはまるメモの番号（番号順）。dead の id は除く。"""
+        found, sure, check = self.candidates(query)
+        ids, created = self.ids, self._created
+        out = []
+        for pos in range(len(ids)) if found is None else found:
+            if ids[pos] in dead or not in_span(created[pos], span):
+                continue
+            if check is None or pos in sure or check.matches(self.doc(pos)):
+                out.append(pos)
+        return out
+
+    def search(self, query, dead=(), span=None):
+        """query と期間 span に当てはまるメモの id（id 順）。dead の id は除く。"""
+        ids = self.ids
+        return [ids[pos] for pos in self.matches(query, dead, span)]
+
+    # ----- 関連度（BM25） -----
+    def scoring_terms(self, words):
+        """検索語を切った語と、端の単語に当てはまる語 {語のバイト列: 番号}（点数はこの語ごとに足す）"""
+        found = {}
+        for word in words:
+            for kind, run in requirements(word):
+                if kind == "exact":
+                    i = self._find(run)
+                    hits = [] if i is None else [i]
+                else:
+                    hits = self._matching_terms(kind, run) or []
+                for i in hits:
+                    found[self._term(i)] = i
+        return found
+
+    def doc_freq(self, i):
+        return self._postoff[i + 1] - self._postoff[i]
+
+    def rank(self, positions, terms, weights, avgdl):
+        """positions（番号順）の BM25 の点数を (点数, id) で返す。terms は [(語の番号, idf), ...]。
+
+        weights は title / body の重み（TITLE_BOOST）。tf と文書の長さは、どちらも重みをかけて足したものを使う（BM25F）。
+        """
+        scores = dict.fromkeys(positions, 0.0)
+        wt, wb = weights
+        tft, tfb, tlen, blen = self._tft, self._tfb, self._tlen, self._blen
+        for i, idf in terms:
+            start = self._postoff[i]
+            postings = self._postings(i)
+            if len(scores) * 8 < len(postings):
+                # 当てはまったメモが少なければ、1件ずつ並びの中を二分探索する
+                hits = []
+                for pos in scores:
+                    j = bisect.bisect_left(postings, pos)
+                    if j < len(postings) and postings[j] == pos:
+                        hits.append((pos, start + j))
+            else:
+                hits = [(pos, start + j) for j, pos in enumerate(postings) if pos in scores]
+            for pos, k in hits:
+                tf = wt * tft[k] + wb * tfb[k]
+                if tf:
+                    norm = K1 * (1 - B + B * (wt * tlen[pos] + wb * blen[pos]) / avgdl)
+                    scores[pos] += idf * tf * (K1 + 1) / (tf + norm)
+        ids = self.ids
+        return ((score, ids[pos]) for pos, score in scores.items())
+
+
+# ===== ディスク上のインデックス（セグメントの集まり） =====
+MERGE_FANIN = 4             # 同じくらいの大きさのセグメントがこの数だけたまったら1つにまとめる
+K1 = 1.2                    # BM25：tf が増えたときの点数の伸び方（大きいほど回数が効く）
+B = 0.75                    # BM25：文書の長さでならす強さ（0 ならならさない）
+TITLE_BOOST = 3.0           # title に出てくる語は body の何回分と数えるか
+DELETED_RATIO = 0.25        # 消えた id がこの割合を超えたセグメントは、消えた分を除いて書き直す
+_merge_lock = threading.Lock()      # 同じプロセスの中でまとめ直しが重ならないようにする
+
+
+def index_dir(filepath):
+    """notes.json → notes.index/"""
+    root, _ = os.path.splitext(filepath)
+    return root + ".index"
+
+
+def _plain(value):
+    """signature()（タプルの入れ子）を manifest に書ける・比べられる形（リストの入れ子）にする"""
+    return json.loads(json.dumps(value))
+
+
+class SearchIndex:
+    """notes.index/ の読み書き
+
+    manifest.json … {"seq", "format", "backend", "signature", "segments": [{"name", "count", "deleted"}]}
+    signature は最後にインデックスを合わせたときの保存先の signature()。今のものと違えば、
+    インデックスを通さずに書き換えられた（restore / archive / 別のアプリなど）ので作り直す。
+    deleted はそのセグメントを書いたあとで更新・削除された id（墓石）。読むときに候補から除く。
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.dirpath = index_dir(filepath)
+        self.path = os.path.join(self.dirpath, "manifest.json")
+        self._segments = {}             # 名前 → mmap した Segment（セグメントは変わらないので使い回す）
+        self._lock = threading.Lock()
+
+    # ----- manifest -----
+    def load_manifest(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_manifest(self, manifest):
+        notes_store._write_json_atomic(manifest, self.path, durable=True)
+
+    def is_fresh(self, backend, manifest=None):
+        """インデックスが backend の今の中身と合っているか"""
+        manifest = manifest or self.load_manifest()
+        return (manifest is not None and manifest.get("format") == _format()
+                and manifest.get("backend") == backend.name and manifest.get("signature") == _plain(backend.signature()))
+
+    def _seg_path(self, name):
+        return os.path.join(self.dirpath, name + ".seg")
+
+    def _new_name(self, manifest):
+        manifest["seq"] = manifest.get("seq", 0) + 1
+        return f"seg-{manifest['seq']:06d}"
+
+    def _remove_files(self, names):
+        for name in names:
+            try:
+                os.remove(self._seg_path(name))
+            except FileNotFoundError:
+                pass
+
+    # ----- 読み込み -----
+    def _load(self, manifest):
+        """manifest のセグメントを [(manifest の項目, Segment), ...] で返す（読んでいないものだけ読む）"""
+        with self._lock:
+            names = {entry["name"] for entry in manifest["segments"]}
+            for name in list(self._segments):
+                if name not in names:
+                    del self._segments[name]
+            for name in names - set(self._segments):
+                self._segments[name] = Segment.open(self._seg_path(name))
+            return [(entry, self._segments[entry["name"]]) for entry in manifest["segments"]]
+
+    def segments(self):
+        """今のセグメント。読んでいる途中でまとめ直しに消されたら、manifest から読み直す。"""
+        for _ in range(5):
+            manifest = self.load_manifest()
+            if manifest is None:
+                return None, []
+            try:
+                return manifest, self._load(manifest)
+            except FileNotFoundError:
+                continue
+        raise RuntimeError(f"search index keeps changing: {self.dirpath}")
+
+    def search(self, query, span=None):
+        """query と期間 span（(開始, 終了) のエポック秒）に当てはまるメモの id（id 順）。notes.json は読まない。"""
+        _, segments = self.segments()
+        found = [seg.search(query, set(entry.get("deleted", ())), span) for entry, seg in segments]
+        return sorted(itertools.chain.from_iterable(found)) if len(found) > 1 else (found[0] if found else [])
+
+    def rank(self, query, span=None, limit=None):
+        """search と同じメモを関連度（BM25）の高い順に [(点数, id), ...] で返す。limit 件だけならヒープで選ぶ。
+
+        tf・文書の長さ・df はインデックスに入れてある値を使う（メモは読まない）。墓石のメモも df と平均の長さには
+        数えたまま（まとめ直しで消える）なので、書き込みが続いたあとは点数がわずかにずれることがある。
+        点数が同じなら id の大きい（新しい）メモが先。
+        """
+        _, segments = self.segments()
+        weights = {"title": (1.0, 0.0), "body": (0.0, 1.0)}.get(query.scope, (TITLE_BOOST, 1.0))
+        parts, df = [], {}
+        docs = title_total = body_total = 0
+        for entry, seg in segments:
+            terms = seg.scoring_terms(query.words)
+            for key, i in terms.items():
+                df[key] = df.get(key, 0) + seg.doc_freq(i)
+            docs += len(seg)
+            title_total += seg.totals[0]
+            body_total += seg.totals[1]
+            parts.append((seg, seg.matches(query, set(entry.get("deleted", ())), span), terms))
+        avgdl = (weights[0] * title_total + weights[1] * body_total) / max(docs, 1) or 1.0
+        idf = {key: math.log(1 + (docs - n + 0.5) / (n + 0.5)) for key, n in df.items()}
+        scored = itertools.chain.from_iterable(
+            seg.rank(positions, [(i, idf[key]) for key, i in terms.items()], weights, avgdl)
+            for seg, positions, terms in parts)
+        if limit:
+            return heapq.nlargest(limit, scored)
+        return sorted(scored, reverse=True)
+
+    def stats(self):
+        manifest, segments = self.segments()
+        return {
+            "segments": [(entry["name"], len(seg), len(entry.get("deleted", ())), seg.term_count())
+                         for entry, seg in segments],
+            "live": sum(len(seg) - len(entry.get("deleted", ())) for entry, seg in segments),
+        }
+
+    # ----- 作り直し・差分の反映（write_lock の中で呼ぶ） -----
+    def rebuild(self, backend):
+        """backend の全件から1つのセグメントを作り直す。件数を返す。"""
+        with notes_store.write_lock(self.filepath):
+            signature = backend.signature()
+            seg = Segment.build(backend.iter_notes())
+            old = self.load_manifest() or {}
+            manifest = {"seq": old.get("seq", 0), "format": _format(), "backend": backend.name,
+                        "signature": _plain(signature), "segments": []}
+            name = self._new_name(manifest)
+            os.makedirs(self.dirpath, exist_ok=True)
+            seg.write(self._seg_path(name), durable=True)
+            manifest["segments"].append({"name": name, "count": len(seg), "deleted": []})
+            self.save_manifest(manifest)
+            # 前のセグメントも、前の形式のファイルや途中で止まったまとめ直しの残りも消す
+            for entry in os.scandir(self.dirpath):
+                if entry.name not in ("manifest.json", name + ".seg"):
+                    os.remove(entry.path)
+        return len(seg)
+
+    def apply(self, upserts, deleted, signature):
+        """追加・更新したメモ（本文つき）と削除した id を、新しい小さなセグメントと墓石で反映する
+
+        古いセグメントは書き直さない。更新・削除された id を、その id を持つセグメントの deleted に足すだけ。
+        """
+        manifest = self.load_manifest()
+        upserts = {note["id"]: note for note in upserts}
+        changed = set(upserts) | set(deleted)
+        for entry, seg in self._load(manifest) if changed else ():
+            hit = [i for i in changed if seg.has(i)]
+            if hit:
+                entry["deleted"] = sorted(set(entry.get("deleted", ())) | set(hit))
+        if upserts:
+            seg = Segment.build(upserts.values())
+            name = self._new_name(manifest)
+            seg.write(self._seg_path(name), durable=True)
+            manifest["segments"].append({"name": name, "count": len(seg), "deleted": []})
+        manifest["signature"] = _plain(signature)
+        self.save_manifest(manifest)
+
+    def carry_signature(self, before, after):
+        """保存先の中身を変えずにファイルだけが変わったとき（ジャーナルのコンパクション）に、記録した signature を付け替える"""
+        manifest = self.load_manifest()
+        if manifest is None:
+            return
+        before, after = _plain(before), _plain(after)
+
+        def replace(value):
+            if value == before:
+                return after
+            return [replace(v) for v in value] if isinstance(value, list) else value
+
+        updated = replace(manifest.get("signature"))
+        if updated != manifest.get("signature"):
+            manifest["signature"] = updated
+            self.save_manifest(manifest)
+
+    # ----- まとめ直し（バックグラウンド） -----
+    @staticmethod
+    def _plan(manifest):
+        """まとめ直すセグメントの名前。無ければ None。
+
+        消えた id の多いセグメントは1つで書き直す。そうでなければ、大きさの桁（MERGE_FANIN 倍ごと）が同じ
+        セグメントが MERGE_FANIN 個たまったところでまとめる。大きなセグメントは滅多に書き直されない。
+        """
+        tiers = {}
+        for entry in manifest["segments"]:
+            count = max(entry["count"], 1)
+            if len(entry.get("deleted", ())) > count * DELETED_RATIO:
+                return [entry["name"]]
+            tiers.setdefault(int(math.log(count, MERGE_FANIN)), []).append(entry["name"])
+        for names in tiers.values():
+            if len(names) >= MERGE_FANIN:
+                return names
+        return None
+
+    def maybe_merge(self, background=True):
+        """まとめ直しが必要なら始める（既定はバックグラウンド。daemon にしないので CLI は終わるまで待つ）"""
+        manifest = self.load_manifest()
+        if manifest is None or _merge_lock.locked() or self._plan(manifest) is None:
+            return
+        if background:
+            threading.Thread(target=self.merge).start()
+        else:
+            self.merge()
+
+    def merge(self):
+        """_plan() が選んだセグメントを1つにまとめる。まとめているあいだも読み書きは止めない。"""
+        with _merge_lock:
+            while True:
+                with notes_store.write_lock(self.filepath):
+                    manifest = self.load_manifest()
+                    names = self._plan(manifest) if manifest else None
+                    if not names:
+                        return
+                    target = self._new_name(manifest)       # 名前だけ先に取っておく
+                    self.save_manifest(manifest)
+                entries = [e for e in manifest["segments"] if e["name"] in names]
+                dead = {e["name"]: set(e.get("deleted", ())) for e in entries}
+                merged = Segment.merge([(Segment.open(self._seg_path(e["name"])), dead[e["name"]]) for e in entries])
+                merged.write(self._seg_path(target), durable=True)
+                with notes_store.write_lock(self.filepath):
+                    manifest = self.load_manifest()
+                    current = [e for e in (manifest or {}).get("segments", ()) if e["name"] in names]
+                    if len(current) != len(names):
+                        self._remove_files([target])        # あいだに作り直された
+                        return
+                    # まとめているあいだに更新・削除された id は、まとめたセグメントの墓石として引き継ぐ
+                    later = set()
+                    for e in current:
+                        later |= set(e.get("deleted", ())) - dead[e["name"]]
+                    entry = {"name": target, "count": len(merged),
+                             "deleted": sorted(i for i in later if merged.has(i))}
+                    manifest["segments"] = [e for e in manifest["segments"] if e["name"] not in names] + [entry]
+                    self.save_manifest(manifest)
+                self._remove_files(names)
+
+    # ----- 確かめ -----
+    def check(self, backend, samples=200, seed=None):
+        """インデックスを使った検索と全件を1件ずつ見る検索を比べる。(問題のリスト, 試した検索の数) を返す。"""
+        notes = list(backend.iter_notes())
+        problems = []
+        if not self.is_fresh(backend):
+            problems.append("インデックスが保存先の今の中身と合っていない（作り直しが必要）")
+        _, segments = self.segments()
+        live = {}
+        for entry, seg in segments:
+            dead = set(entry.get("deleted", ()))
+            for i in seg.ids:
+                if i not in dead:
+                    live[i] = live.get(i, 0) + 1
+        ids = {n["id"] for n in notes}
+        twice = sorted(i for i, c in live.items() if c > 1)
+        if twice:
+            problems.append(f"2つのセグメントで生きている id: {twice[:5]}")
+        if ids - set(live):
+            problems.append(f"インデックスに無い id: {sorted(ids - set(live))[:5]}")
+        if set(live) - ids:
+            problems.append(f"もう無いのにインデックスに残っている id: {sorted(set(live) - ids)[:5]}")
+
+        rng = random.Random(seed)
+        stamps = sorted(_created_ts(n) for n in notes)
+        tried = 0
+        for _ in range(samples if notes else 0):
+            words = []
+            for _ in range(rng.randint(1, 2)):
+                text = rng.choice([rng.choice(notes).get("title") or "", rng.choice(notes).get("body") or ""])
+                start = rng.randrange(len(text) + 1)
+                words.append(text[start:start + rng.randint(1, 4)])
+            query = Query(words, rng.choice(["any", "all"]), rng.choice(["title", "body", "both"]), rng.random() < 0.3)
+            if not query.words:
+                continue
+            span = None
+            if rng.random() < 0.3:
+                span = tuple(sorted((rng.choice(stamps), rng.choice(stamps))))
+            tried += 1
+            expected = sorted(n["id"] for n in notes if query.matches(n) and in_span(_created_ts(n), span))
+            got = self.search(query, span)
+            if got == expected:
+                got = sorted(note_id for _, note_id in self.rank(query, span))
+            if got != expected:
+                problems.append(f"検索 {query.words}（{query.match} / {query.scope}）: "
+                                f"インデックス {len(got)} 件 / 全件 {len(expected)} 件")
+        return problems, tried
+
+
+def open_index(backend, filepath):
+    """backend の今の中身と合ったインデックスを返す（無い・古いときは作り直す）"""
+    index = SearchIndex(filepath)
+    if not index.is_fresh(backend):
+        with notes_store.write_lock(filepath):
+            if not index.is_fresh(backend):
+                index.rebuild(backend)
+    return index
+
+
+# ===== 書き込みと一緒にインデックスを直す =====
+class IndexedBackend:
+    """ほかのバックエンドを包んで、書き込みのたびにインデックスへ差分を足す（読み込みはそのまま渡す）
+
+    インデックスがまだ無い・もう古いときは何もしない（次に検索するときに作り直す）。
+    """
+
+    def __init__(self, backend, filepath):
+        self.backend = backend
+        self.name = backend.name
+        self.filepath = filepath
+        self.index = SearchIndex(filepath)
+
+    def apply_batch(self, ops, durable=False):
+        with notes_store.write_lock(self.filepath):
+            fresh = self.index.is_fresh(self.backend)
+            results = self.backend.apply_batch(ops, durable=durable)
+            if fresh:
+                upserts, deleted = self._changes(ops, results)
+                self.index.apply(upserts, deleted, self.backend.signature())
+        if fresh:
+            self.index.maybe_merge()
+        return results
+
+    def _changes(self, ops, results):
+        """反映できた ops から、(インデックスに入れ直すメモ, 消す id) を作る"""
+        upserts, deleted = [], []
+        for op, result in zip(ops, results):
+            if isinstance(result, Exception) or result is None or result is False:
+                continue
+            if op[0] == "add":
+                upserts.append(op[1])
+            elif op[0] == "update" and ("title" in op[2] or "body" in op[2]):
+                note = result if "body" in result else dict(result, body=self.backend.body(result))
+                upserts.append(note)
+            elif op[0] == "delete":
+                deleted.append(op[1])
+        return upserts, deleted
+
+    def add(self, note):
+        return notes_store.unwrap(self.apply_batch([("add", note)])[0])
+
+    def update(self, note_id, fields, expected_version=None):
+        """expected_version を渡すと、version が違うとき VersionConflict にする"""
+        return notes_store.unwrap(self.apply_batch([("update", note_id, fields, expected_version)])[0])
+
+    def delete(self, note_id):
+        return notes_store.unwrap(self.apply_batch([("delete", note_id)])[0])
+
+    # ----- 読み込み系はそのまま -----
+    def iter_notes(self, date_from=None, date_to=None, heads=False):
+        return self.backend.iter_notes(date_from, date_to, heads)
+
+    def load_all(self):
+        return self.backend.load_all()
+
+    def load_heads(self):
+        return self.backend.load_heads()
+
+    def load_range(self, date_from=None, date_to=None):
+        return self.backend.load_range(date_from, date_to)
+
+    def body(self, note):
+        return self.backend.body(note)
+
+    def with_bodies(self, heads):
+        return self.backend.with_bodies(heads)
+
+    def get(self, note_id):
+        return self.backend.get(note_id)
+
+    def count(self):
+        return self.backend.count()
+
+    def allocate_ids(self, count=1):
+        return self.backend.allocate_ids(count)
+
+    def next_id(self):
+        return self.backend.next_id()
+
+    def signature(self):
+        return self.backend.signature()
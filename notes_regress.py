@@ -0,0 +1,102 @@
+# レビューで見つかった不具合の再発確認（回帰テスト）
+#
+# 使い方:
+#   python3 notes_regress.py                 # 全部の確認を、それぞれ使い捨てのフォルダで行う
+#   python3 notes_regress.py split_update    # 名前を指定したものだけ
+#
+# 確認ひとつ = 関数ひとつ。引数は作業用フォルダの notes.json の場所で、見つかった問題の文字列のリストを返す
+# （空なら OK）。不具合を直したら、それが再び起きないことを確かめる関数を CHECKS に足していく。
+# notes_crash.py と同じく、data/ には触らない。
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+import notes_store
+import notes_index
+
+
+def check_split_update(path):
+    """split：インデックスを作ったあとの update が、保存後に KeyError: 'body_file' で落ちない
+
+    apply_batch が返す見出しに本文ファイル名が付いておらず、IndexedBackend が差分を作るときの
+    body() が落ちていた（書き込み自体は済んでいるのに 500 になる）。
+    """
+    problems = []
+    backend = notes_store.open_backend(path, "split")
+    for i in range(1, 21):
+        backend.add({"id": i, "title": f"note {i}", "body": f"body {i}", "created_at": "2025-11-01T00:00:00"})
+    notes_index.open_index(backend, path)          # 1回検索したのと同じ（インデックスができる）
+    try:
+        backend.update(7, {"body": "zebra crossing"})
+        backend.update(8, {"title": "giraffe"})    # 本文を変えない update（本文は見出しから引く）
+    except Exception as e:
+        return [f"update が失敗しました: {type(e).__name__} - {e}"]
+    index = notes_index.open_index(backend, path)
+    for word, want in (("zebra", [7]), ("giraffe", [8]), ("body", [i for i in range(1, 21) if i != 7])):
+        got = sorted(index.search(notes_index.Query([word])))
+        if got != want:
+            problems.append(f"検索 {word!r}: {got} / 期待 {want}")
+    if backend.get(8)["body"] != "body 8":
+        problems.append(f"#8 の本文が変わっています: {backend.get(8)['body']!r}")
+    return problems
+
+
+def check_cache_patch(path):
+    """NotesCache 経由の書き込みは、キャッシュの NoteStore を読み直さずに直す（新しい順の並びも保ったまま）
+
+    以前の test48 は書くたびにキャッシュを捨てていて、NoteStore が二分探索で並びを直す仕組みが使われていなかった。
+    """
+    problems = []
+    backend = notes_store.open_backend(path, "json")
+    for i in range(1, 21):
+        backend.add({"id": i, "title": f"note {i}", "body": "", "created_at": f"2025-11-{i:02d}T00:00:00"})
+    cache = notes_store.NotesCache(backend, loader=lambda b: notes_store.NoteStore(b.load_heads()),
+                                   lock=lambda: notes_store.write_lock(path))
+    cache.get().newest_first()                     # 一覧を表示した（並びができる）
+    cache.add({"id": cache.next_id(), "title": "newest", "body": "", "created_at": "2026-01-01T00:00:00"})
+    cache.update(5, {"title": "edited", "created_at": "2027-01-01T00:00:00"})
+    cache.delete(20)
+    stats = cache.stats()
+    if stats["misses"] != 1 or stats["patches"] != 3:
+        problems.append(f"キャッシュを読み直しています: {stats}")
+    key = lambda store: [(n["id"], n["title"], n["version"]) for n in store.newest_first()]
+    fresh = notes_store.NoteStore(backend.load_heads())
+    if key(cache.get()) != key(fresh):
+        problems.append(f"キャッシュの並びが保存先と違います: {key(cache.get())[:3]} / {key(fresh)[:3]}")
+    return problems
+
+
+CHECKS = {
+    "split_update": check_split_update,
+    "cache_patch": check_cache_patch,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レビューで見つかった不具合の再発確認")
+    parser.add_argument("names", nargs="*", help=f"確認の名前（省略時は全部: {' / '.join(CHECKS)}）")
+    args = parser.parse_args()
+    unknown = [n for n in args.names if n not in CHECKS]
+    if unknown:
+        parser.error(f"知らない確認です: {', '.join(unknown)}")
+
+    failed = 0
+    for name in args.names or CHECKS:
+        workdir = tempfile.mkdtemp(prefix="notes-regress-")
+        try:
+            problems = CHECKS[name](os.path.join(workdir, "notes.json"))
+        finally:
+            shutil.rmtree(workdir)
+        if problems:
+            failed += 1
+            print(f"❌️ {name}: " + " / ".join(problems))
+        else:
+            print(f"✅️ {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
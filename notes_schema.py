@@ -0,0 +1,326 @@
+# メモ1件の形（スキーマ）の版と、古い形で保存されたメモを今の形に揃える移行
+#
+# 版ごとの形:
+#   0 … 版の記録が無いもの。キーは書いた画面しだい（updated_at や version が無いメモが混ざる）
+#   1 … id(int) / title(str) / body(str) / created_at(str) / updated_at(str か None) / version(int) が必ずある
+#   2 … 1 に加えて created_ts(int) / updated_ts(int か None)：created_at / updated_at のエポック秒
+#        （書くとき・移行するときに1回だけ数にしておき、並べ替えや期間の絞り込みでは日時の文字列を読まない）
+#
+# 保存先がどの版かは notes.meta.json の "schema"（保存先の名前 → 版）に書いておく。
+# 今の版なら、読む側は1件ずつ .get() で欠けたキーを補わなくてよい。古い版の保存先は
+# open_backend() が UpgradingBackend で包み、読んだメモをその場で今の形に揃えて返す（ファイルは書き換えない）。
+# `python3 test47.py schema --upgrade` で migrate() を呼ぶと、保存先そのものを今の形に書き直して版を記録する。
+#
+# 版を記録したあとで今の形にそろえずに書くと、記録と中身が食い違って読む側が KeyError で止まる。
+# メモを書くところは必ず open_backend() の add / update / delete（apply_ops が今の形にそろえる）を通すこと。
+# どうしても notes.json などを自分で書き直すものは、set_version(filepath, name, 0) で版を0に戻しておく
+# （読むときに毎回そろえる扱いに戻る）。食い違ってしまった保存先は `schema --upgrade --force` で書き直せる。
+#
+# 形を変えるときは SCHEMA_VERSION を1つ上げ、STEPS に「1つ前の版 → その版」の関数を足す。
+# 移行は古い版から順に STEPS を当てるだけなので、何版前の保存先でも1回読むだけで今の形になる。
+#
+# 今の形のメモは、辞書の代わりに Note（__slots__ の入れ物）でも持てる。キーが決まっているので
+# 1件ごとのハッシュ表が要らず、同じ文字列（タイトル「テスト」や同じ日時など）は1つを共有する。
+# 長く持ち続ける一覧（test48 のキャッシュ）は compact() で Note にしてから NoteStore に入れる。
+# Note は note["title"] / note.get() / "body" in note / dict(note) と、テンプレートの note.title のどちらでも読める。
+
+import os
+
+import notes_store
+import notes_serial
+
+SCHEMA_VERSION = 2
+FIELDS = ("id", "title", "body", "created_at", "updated_at", "version", "created_ts", "updated_ts")
+DERIVED_FIELDS = ("created_ts", "updated_ts")     # ほかの項目から作れるもの（書き出し・取り込みでは扱わない）
+
+
+def _to_v1(note, heads=False):
+    """版0 → 1：欠けたキーを補い、型を揃え、キーを FIELDS の順に並べる（知らないキーは後ろに残す）
+
+    heads=True は本文を持たない見出し（split の notes.heads.json）なので body は足さない。
+    """
+    out = {"id": int(note.get("id") or 0), "title": str(note.get("title") or "")}
+    if not heads or "body" in note:
+        out["body"] = str(note.get("body") or "")
+    out["created_at"] = str(note.get("created_at") or "")
+    out["updated_at"] = note.get("updated_at") or None
+    out["version"] = int(note.get("version") or 1)
+    for key, value in note.items():
+        if key not in out:
+            out[key] = value
+    return out
+
+
+def _to_v2(note, heads=False):
+    """版1 → 2：created_at / updated_at のエポック秒（created_ts / updated_ts）を足す"""
+    note = dict(note)
+    note["created_ts"] = notes_store.to_epoch(note["created_at"]) or 0
+    note["updated_ts"] = notes_store.to_epoch(note["updated_at"])
+    return note
+
+
+STEPS = [(1, _to_v1), (2, _to_v2)]               # (この版にする, 1つ前の版のメモ → この版のメモ)
+
+
+def upgrade(notes, version, heads=False):
+    """version の版のメモを1件ずつ今の版にして返す（イテレーターのまま。全件をリストにしない）"""
+    steps = [step for to, step in STEPS if to > version]
+    if not steps:
+        return iter(notes)
+    return (_apply(steps, note, heads) for note in notes)
+
+
+def _apply(steps, note, heads):
+    for step in steps:
+        note = step(note, heads)
+    return note
+
+
+# ===== 省メモリの入れ物 =====
+INTERN_MAX = 64         # この長さまでの文字列は、同じ中身なら1つを共有する（長い本文は重なりにくいので数えない）
+
+
+class Note:
+    """今の形のメモ1件を、辞書より小さく持つ入れ物
+
+    FIELDS は属性（__slots__）に、それ以外のキーは extra（無ければ None）に入れる。
+    見出し（本文なし）のように値を入れなかった属性は「そのキーが無い」ものとして扱う。
+    辞書と同じ読み方ができるので、NoteStore やテンプレートにはそのまま渡せる。
+    保存（json.dumps など）には to_dict() で辞書に戻してから渡すこと。
+    """
+
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, note, strings=None):
+        self.extra = None
+        for key, value in note.items():
+            if strings is not None and type(value) is str and len(value) <= INTERN_MAX:
+                value = strings.setdefault(value, value)
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in _SLOTS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _SLOTS:
+            setattr(self, key, value)
+        elif self.extra is None:
+            self.extra = {key: value}
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        if key in _SLOTS:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [key for key in FIELDS if hasattr(self, key)]
+        return keys + list(self.extra) if self.extra else keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def update(self, fields):
+        for key, value in fields.items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Note, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Note({self.to_dict()!r})"
+
+
+_SLOTS = frozenset(FIELDS)
+
+
+def compact(notes):
+    """今の形のメモ（辞書）の一覧を Note の一覧にする。同じ文字列は一覧の中で1つを共有する。"""
+    strings = {}
+    return [note if isinstance(note, Note) else Note(note, strings) for note in notes]
+
+
+# ===== 版の記録（notes.meta.json の "schema"） =====
+def stored_version(backend):
+    """保存先のメモがどの版の形か
+
+    SQLite は列で形が決まっていて、エポック秒も読むときに SQL で作るので、いつでも今の版。
+    記録が無いときは、まだ空なら今の版として記録し、メモがあれば版0（記録する前に書かれたもの）とみなす。
+    """
+    if backend.name == "sqlite":
+        return SCHEMA_VERSION
+    version = notes_store.load_meta(backend.filepath).get("schema", {}).get(backend.name)
+    if version is not None:
+        return version
+    if next(iter(backend.iter_notes(heads=True)), None) is not None:
+        return 0
+    set_version(backend.filepath, backend.name)
+    return SCHEMA_VERSION
+
+
+def set_version(filepath, name, version=SCHEMA_VERSION):
+    """保存先 name の版を notes.meta.json に記録する"""
+    with notes_store.write_lock(filepath), notes_store._meta_lock:
+        meta = notes_store.load_meta(filepath)
+        meta.setdefault("schema", {})[name] = version
+        notes_store.save_meta(meta, filepath)
+
+
+# ===== 古い版の保存先を読むとき =====
+class UpgradingBackend:
+    """古い版の保存先を包んで、読んだメモを今の形に揃えて返す（書き込みはそのまま渡す）"""
+
+    def __init__(self, backend, version):
+        self.backend = backend
+        self.name = backend.name
+        self.filepath = backend.filepath
+        self.version = version
+
+    def iter_notes(self, date_from=None, date_to=None, heads=False):
+        return upgrade(self.backend.iter_notes(date_from, date_to, heads), self.version, heads)
+
+    def load_all(self):
+        return list(upgrade(self.backend.load_all(), self.version))
+
+    def load_heads(self):
+        return list(upgrade(self.backend.load_heads(), self.version, heads=True))
+
+    def load_range(self, date_from=None, date_to=None):
+        return list(upgrade(self.backend.load_range(date_from, date_to), self.version))
+
+    def body(self, note):
+        return str(self.backend.body(note) or "")
+
+    def with_bodies(self, heads):
+        return list(upgrade(self.backend.with_bodies(heads), self.version))
+
+    def get(self, note_id):
+        note = self.backend.get(note_id)
+        return None if note is None else next(upgrade([note], self.version))
+
+    def count(self):
+        return self.backend.count()
+
+    def apply_batch(self, ops, durable=False):
+        return self.backend.apply_batch(ops, durable=durable)
+
+    def add(self, note):
+        return self.backend.add(note)
+
+    def update(self, note_id, fields, expected_version=None):
+        return self.backend.update(note_id, fields, expected_version)
+
+    def delete(self, note_id):
+        return self.backend.delete(note_id)
+
+    def allocate_ids(self, count=1):
+        return self.backend.allocate_ids(count)
+
+    def next_id(self):
+        return self.backend.next_id()
+
+    def signature(self):
+        return self.backend.signature()
+
+
+def wrap(backend):
+    """今の版ならそのまま、古い版なら UpgradingBackend で包んで返す"""
+    version = stored_version(backend)
+    return backend if version >= SCHEMA_VERSION else UpgradingBackend(backend, version)
+
+
+# ===== 移行（保存先そのものを書き直す） =====
+def migrate(backend, progress=None, force=False):
+    """保存先（archived=False で開いたもの）を今の版に書き直して記録する。(元の版, 書き直した件数) を返す。
+
+    json    … notes.json + ジャーナルを1件ずつ読みながら、新しい notes.json に1件ずつ書く（全件をメモリに持たない）。
+              書き終わってから置き換えるので、途中で失敗しても元のファイルはそのまま。
+    sharded … 月のファイルを1つずつ読んで書き直す（メモリに載るのは1か月分だけ）
+    split   … 見出しのファイルだけを書き直す（本文のファイルは形が無いので触らない）
+    sqlite  … 列で形が決まっている（エポック秒は SELECT で作る）ので、書き直すものは無い
+    progress を渡すと、書いた件数を1000件ごとに progress(件数) で知らせる。
+    アーカイブのセグメントは書き直さない（バックアップとハードリンクで共有しているため）。
+    読むときに notes_archive がセグメントごとの版を見て揃える。
+    force=True なら記録された版を信じず、版0として全件を書き直す（今の形のメモは、揃えても中身が変わらない）。
+    記録のあとで今の形にそろえずに書かれたメモが混ざってしまったときに使う。
+    """
+    version = 0 if force else stored_version(backend)
+    if version >= SCHEMA_VERSION:
+        return version, 0
+    filepath = backend.filepath
+    with notes_store.write_lock(filepath):
+        version = 0 if force else stored_version(backend)     # ロックを取るまでに、ほかのプロセスが済ませていないか
+        if version >= SCHEMA_VERSION:
+            return version, 0
+        total = 0
+
+        def counted(notes):
+            nonlocal total
+            for note in notes:
+                total += 1
+                if progress and total % 1000 == 0:
+                    progress(total)
+                yield note
+
+        if backend.name == "json":
+            top = 0
+
+            def tracked(notes):
+                nonlocal top
+                for note in notes:
+                    top = max(top, note["id"])
+                    yield note
+
+            # save_notes と同じ詰めた配列を、1件ずつ書いて作る
+            with notes_store.atomic_writer(filepath, durable=True, binary=True) as f:
+                notes_serial.write_array(f, tracked(counted(upgrade(notes_store.iter_notes(filepath), version))))
+            # ジャーナルの中身はもう新しい notes.json に入っている
+            for path in (notes_store._compacting_path(filepath), notes_store.journal_path(filepath)):
+                if os.path.exists(path):
+                    os.remove(path)
+            notes_store._bump_next_id(filepath, [{"id": top}])
+        elif backend.name == "sharded":
+            for month in backend.months():
+                notes = list(counted(upgrade(backend._read_shard(month), version)))
+                backend._write_shard(month, notes, durable=True)
+        elif backend.name == "split":
+            doc = backend._read_doc()
+            heads = list(counted(upgrade(doc["rows"], version, heads=True)))
+            backend._write_doc(heads, doc.get("generation", 1), doc.get("bodies"), durable=True)
+        set_version(filepath, backend.name)
+    return version, total
@@ -0,0 +1,95 @@
+# notes.json（メモの一覧）を書く・読むときの変換（シリアライザ）
+#
+# notes.json は人が開いて読むものではなく、プログラムが読み書きする保存形式なので、
+# 既定では空白・改行を入れない詰めた JSON で書く（indent=2 より小さく、書くのも読むのも速い）。
+# 人が読むための整形した JSON は `python3 test47.py export` で別のファイルに書き出す（write_pretty）。
+#
+# 変換の実装（コーデック）は2つ:
+#   json   … 標準ライブラリ。いつでも使える
+#   orjson … pip install orjson で入れてあれば、何も指定しなくてもこちらを使う（書くのも読むのも数倍速い）
+# NOTES_SERIALIZER=json / orjson で固定もできる（速さを比べるときなど）。
+# どちらで書いても同じ詰めた JSON なので、書いたときと読むときでコーデックが違ってもかまわない。
+# 以前の indent=2 で書いた notes.json もそのまま読める。
+
+import os
+import json
+
+try:
+    import orjson                               # 入っていなければ標準の json だけで動く
+except ImportError:
+    orjson = None
+
+SERIALIZER_ENV = "NOTES_SERIALIZER"             # "json" / "orjson"（空なら、入っていれば orjson）
+
+
+class JsonCodec:
+    """標準ライブラリの json（詰めた形。日本語は \\uXXXX にせずそのまま書く）"""
+
+    name = "json"
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """orjson（bytes を直接作る・読む。出力は JsonCodec と同じ詰めた JSON）"""
+
+    name = "orjson"
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+CODECS = {"json": JsonCodec, "orjson": OrjsonCodec}
+
+
+def available():
+    """この環境で使えるコーデックの名前（速いものが後ろ）"""
+    return ["json"] + (["orjson"] if orjson is not None else [])
+
+
+def get_codec(name=None):
+    """name（省略時は NOTES_SERIALIZER、それも無ければ使える中でいちばん速いもの）のコーデック"""
+    name = (name or os.environ.get(SERIALIZER_ENV, "")).strip().lower() or available()[-1]
+    if name not in CODECS:
+        raise ValueError(f"{SERIALIZER_ENV} must be one of {', '.join(CODECS)}: {name!r}")
+    if name not in available():
+        raise ValueError(f"{name} is not installed (pip install {name})")
+    return CODECS[name]()
+
+
+def dumps(obj, name=None) -> bytes:
+    return get_codec(name).dumps(obj)
+
+
+def loads(data, name=None):
+    """bytes / str の JSON を読む。壊れていれば json.JSONDecodeError（orjson のものもその子クラス）"""
+    return get_codec(name).loads(data)
+
+
+def write_array(f, notes, name=None):
+    """notes（イテレーターでよい）を dumps と同じ詰めた配列として、1件ずつ f（バイナリ）に書く。件数を返す。"""
+    codec = get_codec(name)
+    count = 0
+    for note in notes:
+        f.write((b"," if count else b"[") + codec.dumps(note))
+        count += 1
+    f.write(b"]" if count else b"[]")
+    return count
+
+
+def write_pretty(f, notes):
+    """json.dump(一覧, indent=2) と同じ形（人が読む用）を、1件ずつ f（テキスト）に書く。件数を返す。"""
+    count = 0
+    for note in notes:
+        item = json.dumps(note, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        f.write((",\n  " if count else "[\n  ") + item)
+        count += 1
+    f.write("\n]\n" if count else "[]\n")
+    return count
@@ -0,0 +1,277 @@
+# notes_store.py の「作成月ごとにファイルを分ける」バックエンド
+#
+#   data/notes/2025-11.jsonl   … created_at が 2025-11 のメモ（1行 = 1メモ）
+#   data/notes/undated.jsonl   … created_at が無い・壊れているメモ
+#   data/notes/manifest.json   … 月ごとのファイル名・件数・id の範囲
+#
+# 期間つきの検索や一覧は、manifest を見て期間と重なる月のファイルだけを開く。
+# 追加はその月のファイルに1行追記するだけ、更新・削除はそのメモが入っている月のファイルだけを書き直す。
+# manifest は書き込みのたびに書き直す（seq が増えるので、NotesCache はこれだけ見ればよい）。
+
+import os
+import json
+import datetime
+
+import notes_store
+
+UNDATED = "undated"
+IMPORT_FLUSH = 1000                 # 移行のとき、1か月分を何件ためてから追記するか
+
+
+def shards_dir(filepath):
+    """notes.json → notes/（月ごとのファイルを置くフォルダ）"""
+    root, _ = os.path.splitext(filepath)
+    return root
+
+
+def manifest_path(filepath):
+    return os.path.join(shards_dir(filepath), "manifest.json")
+
+
+def month_of(note):
+    """created_at（YYYY-MM-DDTHH:MM:SS）→ "YYYY-MM"。読めなければ undated。"""
+    created = str(note.get("created_at") or "")
+    try:
+        datetime.datetime.strptime(created[:7], "%Y-%m")
+    except ValueError:
+        return UNDATED
+    return created[:7]
+
+
+def month_key(d):
+    """date / datetime / "YYYY-MM-DD" → "YYYY-MM"（None はそのまま）"""
+    if d is None:
+        return None
+    if isinstance(d, str):
+        return d[:7]
+    return d.strftime("%Y-%m")
+
+
+class ShardedBackend:
+    """data/notes/YYYY-MM.jsonl に保存するバックエンド（JsonBackend と同じメソッドを持つ）"""
+
+    name = "sharded"
+
+    def __init__(self, filepath):
+        self.filepath = filepath            # notes.json の場所（ロック・meta はこれを基準に共有する）
+        self.dirpath = shards_dir(filepath)
+        self.path = manifest_path(filepath)
+
+    # ----- manifest -----
+    def load_manifest(self):
+        """{"seq": n, "shards": {"2025-11": {"count", "min_id", "max_id"}, ...}}"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return self._rebuild_manifest()
+
+    def _rebuild_manifest(self):
+        """manifest が無いときは、フォルダの中の月ファイルを読んで作り直す"""
+        manifest = {"seq": 0, "shards": {}}
+        if os.path.isdir(self.dirpath):
+            for name in sorted(os.listdir(self.dirpath)):
+                if name.endswith(".jsonl"):
+                    month = name[: -len(".jsonl")]
+                    manifest["shards"][month] = self._shard_info(self._read_shard(month))
+        return manifest
+
+    def _save_manifest(self, manifest, durable=False):
+        manifest["seq"] = manifest.get("seq", 0) + 1
+        notes_store._write_json_atomic(manifest, self.path, indent=2, durable=durable)
+
+    @staticmethod
+    def _shard_info(notes):
+        ids = [n.get("id", 0) for n in notes]
+        return {"count": len(notes), "min_id": min(ids, default=0), "max_id": max(ids, default=0)}
+
+    @staticmethod
+    def _count_appended(manifest, month, notes):
+        """月のファイルに notes を追記したぶん、manifest の件数と id の範囲を広げる"""
+        ids = [n.get("id", 0) for n in notes]
+        info = manifest["shards"].get(month)
+        if info is None or info["count"] == 0:
+            info = manifest["shards"][month] = {"count": 0, "min_id": min(ids), "max_id": max(ids)}
+        info["count"] += len(ids)
+        info["min_id"] = min([info["min_id"]] + ids)
+        info["max_id"] = max([info["max_id"]] + ids)
+
+    def months(self, date_from=None, date_to=None, manifest=None):
+        """期間（両端を含む。None は上限・下限なし）と重なる月を古い順に返す
+
+        期間を指定したときは undated は含めない（日付で絞る検索には引っかからないため）。
+        """
+        manifest = manifest or self.load_manifest()
+        lo, hi = month_key(date_from), month_key(date_to)
+        result = []
+        for month in sorted(manifest["shards"]):
+            if month == UNDATED:
+                if lo is None and hi is None:
+                    result.append(month)
+                continue
+            if (lo is None or month >= lo) and (hi is None or month <= hi):
+                result.append(month)
+        return result
+
+    # ----- 月ファイル -----
+    def _shard_path(self, month):
+        return os.path.join(self.dirpath, month + ".jsonl")
+
+    def _read_shard(self, month):
+        return list(notes_store._iter_journal(self._shard_path(month)))   # 書きかけの最終行は読み飛ばす
+
+    def _write_shard(self, month, notes, durable=False):
+        with notes_store.atomic_writer(self._shard_path(month), durable=durable) as f:
+            for note in notes:
+                f.write(json.dumps(note, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def _append_shard(self, month, notes, durable=False):
+        os.makedirs(self.dirpath, exist_ok=True)
+        with open(self._shard_path(month), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(n, ensure_ascii=False, separators=(",", ":")) + "\n" for n in notes))
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _month_of_id(self, manifest, note_id):
+        """id が入っていそうな月（id の範囲で絞ってから、実際に中を見て確かめる）"""
+        for month, info in manifest["shards"].items():
+            if info["min_id"] <= note_id <= info["max_id"]:
+                if any(n.get("id") == note_id for n in self._read_shard(month)):
+                    return month
+        return None
+
+    # ----- 読み込み -----
+    def load_range(self, date_from=None, date_to=None):
+        """期間と重なる月のファイルだけを読む（月単位なので、日単位の絞り込みは呼び出し側で行う）"""
+        return list(self.iter_notes(date_from, date_to))
+
+    def iter_notes(self, date_from=None, date_to=None, heads=False):
+        for month in self.months(date_from, date_to):
+            yield from notes_store._iter_journal(self._shard_path(month))
+
+    def load_all(self):
+        return self.load_range()
+
+    def load_heads(self):
+        return self.load_all()
+
+    def body(self, note):
+        return note.get("body", "")
+
+    def with_bodies(self, heads):
+        return heads
+
+    def get(self, note_id):
+        manifest = self.load_manifest()
+        month = self._month_of_id(manifest, note_id)
+        if month is None:
+            return None
+        return notes_store.NoteStore(self._read_shard(month)).get(note_id)
+
+    def count(self):
+        return sum(info["count"] for info in self.load_manifest()["shards"].values())
+
+    # ----- 書き込み -----
+    def apply_batch(self, ops, durable=False):
+        """ops を月ごとに分け、触る月のファイルだけを書く（追加だけの月は追記で済ませる）"""
+        with notes_store.write_lock(self.filepath):
+            manifest = self.load_manifest()
+            groups = {}                 # 月 → [(ops の中の位置, op)]
+            placed = {}                 # このまとまりで追加した id → 月
+            for i, op in enumerate(ops):
+                if op[0] == "add":
+                    month = month_of(op[1])
+                    placed[op[1].get("id")] = month
+                elif op[0] in ("update", "delete"):
+                    month = placed.get(op[1]) or self._month_of_id(manifest, op[1])
+                else:
+                    month = None
+                groups.setdefault(month, []).append((i, op))
+
+            results = [None] * len(ops)
+            for month, items in groups.items():
+                batch = [op for _, op in items]
+                if month is None:               # どの月にも無い id（または知らない op）
+                    store = notes_store.NoteStore()
+                    group_results, _ = notes_store.apply_ops(store, batch)
+                elif all(op[0] == "add" for op in batch):
+                    group_results, entries = notes_store.apply_ops(notes_store.NoteStore(), batch)
+                    added = [e["note"] for e in entries]
+                    if added:
+                        self._append_shard(month, added, durable=durable)
+                        self._count_appended(manifest, month, added)
+                else:
+                    store = notes_store.NoteStore(self._read_shard(month))
+                    group_results, entries = notes_store.apply_ops(store, batch)
+                    if entries:
+                        notes = store.to_list()
+                        self._write_shard(month, notes, durable=durable)
+                        manifest["shards"][month] = self._shard_info(notes)
+                for (i, _), result in zip(items, group_results):
+                    results[i] = result
+
+            if any(not isinstance(r, Exception) for r in results):
+                self._save_manifest(manifest, durable=durable)
+                top = max((info["max_id"] for info in manifest["shards"].values()), default=0)
+                notes_store._bump_next_id(self.filepath, [{"id": top}])
+        return results
+
+    def add(self, note):
+        return notes_store.unwrap(self.apply_batch([("add", note)])[0])
+
+    def update(self, note_id, fields, expected_version=None):
+        """expected_version を渡すと、version が違うとき VersionConflict にする"""
+        return notes_store.unwrap(self.apply_batch([("update", note_id, fields, expected_version)])[0])
+
+    def delete(self, note_id):
+        return notes_store.unwrap(self.apply_batch([("delete", note_id)])[0])
+
+    # ----- ID の払い出し -----
+    def allocate_ids(self, count=1):
+        top = max((info["max_id"] for info in self.load_manifest()["shards"].values()), default=0)
+        return notes_store.allocate_ids(self.filepath, count, [{"id": top}])
+
+    def next_id(self):
+        return self.allocate_ids(1)[0]
+
+    def signature(self):
+        return notes_store.stat_signature((self.path,))
+
+
+# ===== JSON ⇔ 月ごとのファイルの移行 =====
+def import_json(json_path, backend):
+    """notes.json の中身を月ごとのファイルに振り分ける（既存の月ファイルは置き換える）。入れた件数を返す。"""
+    total = 0
+    with notes_store.write_lock(json_path):
+        old = backend.load_manifest()
+        for month in backend.months(manifest=old):
+            os.remove(backend._shard_path(month))
+        manifest = {"seq": old.get("seq", 0), "shards": {}}
+        pending = {}                        # 月 → まだ書いていない分（IMPORT_FLUSH 件たまったら追記する）
+
+        def flush(month):
+            rows = pending.pop(month)
+            backend._append_shard(month, rows)
+            backend._count_appended(manifest, month, rows)
+
+        for note in notes_store.iter_notes(json_path):      # 1件ずつ読んで、月ごとに振り分ける
+            month = month_of(note)
+            pending.setdefault(month, []).append(note)
+            if len(pending[month]) >= IMPORT_FLUSH:
+                flush(month)
+            total += 1
+        for month in list(pending):
+            flush(month)
+        backend._save_manifest(manifest)
+        top = max((info["max_id"] for info in manifest["shards"].values()), default=0)
+        notes_store._bump_next_id(json_path, [{"id": top}])
+    return total
+
+
+def export_json(backend, json_path):
+    """月ごとのファイルの中身を notes.json（スナップショット）に書き戻す。書いた件数を返す。"""
+    with notes_store.write_lock(json_path):
+        notes = backend.load_all()
+        notes_store.save_notes(notes, json_path)
+    return len(notes)
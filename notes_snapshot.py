@@ -0,0 +1,151 @@
+# notes.json の隣に置く、起動を速くするためのバイナリのスナップショット（notes.snap）
+#
+# CLI は起動のたびに notes.json を丸ごとパースする。NOTES_SNAPSHOT=1 のときは
+# save_notes のたびに同じ中身を marshal 形式でも書いておき、次の起動からはこちらを読む。
+#
+#   b"NOTESNAP" + 版(2バイト) + ヘッダーの長さ(4バイト) + ヘッダー
+#   （長さ 4バイト + 1ブロック）× n … 1ブロック = BLOCK_SIZE 件のメモのリスト
+#   長さ 0 … 終わりの印（これが無ければ書きかけとみなす）
+#
+# ヘッダーには書いたときの notes.json とジャーナルの stat（inode, mtime, サイズ）を入れておき、
+# 今のものと違えば「古い」として notes.json から読み直す。notes.json が正本で、これはただの写し。
+# キーは sys.intern してから書くので、ブロックの中では1回しか入らず、読んだあとも全メモで共有される。
+#
+# marshal は Python のバージョンごとに形式が変わりうるので、書いた Python と違えば使わない。
+# 自分で書いたファイルしか読まない前提（notes.json と同じく、信用できない人に触らせないこと）。
+
+import os
+import sys
+import struct
+import marshal
+
+import notes_store
+
+SNAPSHOT_ENV = "NOTES_SNAPSHOT"                 # "1" なら notes.snap も書き、読むときもそちらを先に見る
+MAGIC = b"NOTESNAP"
+FORMAT_VERSION = 1
+BLOCK_SIZE = 4096                               # 1ブロックに入れるメモの数
+_PREFIX = struct.Struct("<HI")                  # 版, ヘッダーの長さ
+_LENGTH = struct.Struct("<I")                   # ブロックの長さ
+
+
+def snapshot_enabled() -> bool:
+    """環境変数 NOTES_SNAPSHOT=1 のときだけバイナリのスナップショットを使う"""
+    return os.environ.get(SNAPSHOT_ENV, "") == "1"
+
+
+def snapshot_path(filepath):
+    """notes.json → notes.snap"""
+    root, _ = os.path.splitext(filepath)
+    return root + ".snap"
+
+
+def _python():
+    return (marshal.version, sys.version_info[:2])
+
+
+# ===== 書き込み =====
+def write_snapshot(data, filepath, source=None, durable=False):
+    """data（メモの一覧）を notes.snap に書く
+
+    source は data を読んだときの notes_store.json_signature(filepath)。
+    省略すると今の notes.json のものを使う（save_notes の直後に呼ぶ場合）。
+    """
+    if source is None:
+        source = notes_store.json_signature(filepath)
+    header = marshal.dumps({"python": _python(), "source": source, "count": len(data)})
+    intern = sys.intern
+    with notes_store.atomic_writer(snapshot_path(filepath), durable=durable, binary=True) as f:
+        f.write(MAGIC + _PREFIX.pack(FORMAT_VERSION, len(header)) + header)
+        for start in range(0, len(data), BLOCK_SIZE):
+            block = [{intern(k): v for k, v in note.items()} for note in data[start:start + BLOCK_SIZE]]
+            payload = marshal.dumps(block)
+            f.write(_LENGTH.pack(len(payload)) + payload)
+        f.write(_LENGTH.pack(0))
+
+
+# ===== 読み込み =====
+def _open_fresh(filepath):
+    """notes.snap が今の notes.json と同じ中身なら、ブロックの手前まで読んだファイルを返す（違えば None）"""
+    try:
+        f = open(snapshot_path(filepath), "rb")
+    except FileNotFoundError:
+        return None
+    try:
+        prefix = f.read(len(MAGIC) + _PREFIX.size)
+        if len(prefix) < len(MAGIC) + _PREFIX.size or not prefix.startswith(MAGIC):
+            raise ValueError("not a snapshot")
+        version, length = _PREFIX.unpack_from(prefix, len(MAGIC))
+        if version != FORMAT_VERSION:
+            raise ValueError("unknown snapshot version")
+        header = marshal.loads(f.read(length))
+        if header.get("python") != _python():
+            raise ValueError("written by another Python")
+        if header.get("source") != notes_store.json_signature(filepath):
+            raise ValueError("stale snapshot")
+        blocks = f.tell()
+        f.seek(-_LENGTH.size, os.SEEK_END)
+        if f.tell() < blocks or f.read() != _LENGTH.pack(0):
+            raise ValueError("snapshot is truncated")   # 途中で切れたファイルは、読み始める前に notes.json へ回す
+        f.seek(blocks)
+    except (ValueError, EOFError, TypeError, AttributeError, OSError):
+        f.close()
+        return None
+    return f
+
+
+def _iter_blocks(f):
+    """ブロックを1つずつ（メモのリストとして）返す。終わりの印が無ければ ValueError。"""
+    with f:
+        while True:
+            raw = f.read(_LENGTH.size)
+            if len(raw) < _LENGTH.size:
+                raise ValueError("snapshot is truncated")
+            (length,) = _LENGTH.unpack(raw)
+            if length == 0:
+                return
+            payload = f.read(length)
+            if len(payload) < length:
+                raise ValueError("snapshot is truncated")
+            yield marshal.loads(payload)
+
+
+def read_snapshot(filepath):
+    """新しい notes.snap があればメモの一覧を返す。無い・古い・壊れているなら None。"""
+    f = _open_fresh(filepath)
+    if f is None:
+        return None
+    data = []
+    try:
+        for block in _iter_blocks(f):
+            data.extend(block)
+    except (ValueError, EOFError, TypeError):
+        return None
+    return data
+
+
+def load_notes(filepath):
+    """notes_store.load_notes と同じ一覧を、使えるなら notes.snap から読む
+
+    古ければ notes.json から読み、ジャーナルが無ければそのまま notes.snap を書き直しておく
+    （ジャーナルモードでは追記のたびに古くなるので、読むたびに書き直すことはしない）。
+    """
+    data = read_snapshot(filepath)
+    if data is not None:
+        return data
+    source = notes_store.json_signature(filepath)     # 読む前に取る（読んでいる途中で変わっても、次は古いと分かる）
+    data = notes_store.load_notes(filepath)
+    if source[0] is not None and source[1:] == (None, None):
+        try:
+            write_snapshot(data, filepath, source)
+        except OSError:
+            pass                                # 書けなくても notes.json から読めているので困らない
+    return data
+
+
+def iter_notes(filepath):
+    """notes_store.iter_notes と同じものを1件ずつ返す（新しい notes.snap があればブロックごとに読む）"""
+    f = _open_fresh(filepath)
+    if f is None:
+        return notes_store.iter_notes(filepath)
+    return (note for block in _iter_blocks(f) for note in block)
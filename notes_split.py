@@ -0,0 +1,306 @@
+# notes_store.py の「見出しと本文を分けて保存する」バックエンド
+#
+# 一覧（test48list.html / cmd_list）に要るのは id・タイトル・日付だけなのに、
+# notes.json だと本文まで全部パースすることになる。このバックエンドは
+#   - notes.heads.json         … 見出し（id, title, created_at, updated_at, version と本文の位置・長さ）
+#   - notes.bodies.<世代>.bin  … 本文を UTF-8 で後ろに継ぎ足していくだけのファイル
+# の2つに分けて保存し、本文は表示や検索で必要になったときだけ mmap で切り出す。
+# 一覧を出すコストは見出しファイルの大きさだけで決まる。
+#
+# 本文ファイルは追記のみ。更新・削除で使われなくなった部分が半分を超えたら、
+# 生きている本文だけを次の世代のファイルに詰め直す（1つ前の世代は読み途中の人のために残す）。
+# load_heads() や apply_batch()（update の戻り値）が返す見出しには、本文ファイル名（body_file）を付けておく。
+# test48 のキャッシュのように見出しを持ち続けても、本文は見出しと同じ世代のファイルから切り出すので、
+# ほかのプロセスが詰め直したあとでも位置がずれない。その世代が消えていたら、今の見出しを読み直して取り出す。
+
+import os
+import json
+import mmap
+import threading
+
+import notes_store
+
+BODY_KEYS = ("body_offset", "body_length", "body_file")     # 本文の位置（バイト）・長さ（バイト）・どの世代のファイルか
+COMPACT_MIN_BYTES = 1024 * 1024     # 本文ファイルがこれより小さいうちは詰め直さない
+COMPACT_RATIO = 0.5                 # 使われていない部分がこの割合を超えたら詰め直す
+
+
+def heads_path(filepath):
+    """notes.json → notes.heads.json"""
+    root, _ = os.path.splitext(filepath)
+    return root + ".heads.json"
+
+
+def bodies_name(filepath, generation):
+    """notes.json → notes.bodies.<世代>.bin（heads に書くのはファイル名だけ）"""
+    root, _ = os.path.splitext(filepath)
+    return f"{os.path.basename(root)}.bodies.{generation}.bin"
+
+
+class BodyReader:
+    """本文ファイルを mmap で開いておき、指定の位置・長さの本文だけを取り出す"""
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self._lock = threading.Lock()
+        self._maps = {}                 # ファイル名 → mmap（追記で伸びたら開き直す）
+
+    def read(self, name, offset, length):
+        if length == 0:
+            return ""
+        with self._lock:
+            m = self._maps.get(name)
+            if m is None or len(m) < offset + length:
+                m = self._open(name)
+            return m[offset:offset + length].decode("utf-8")
+
+    def _open(self, name):
+        old = self._maps.pop(name, None)
+        if old is not None:
+            old.close()
+        with open(os.path.join(self.dirpath, name), "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[name] = m
+        # 消された古い世代の mmap は閉じる
+        for other in [n for n in self._maps if not os.path.exists(os.path.join(self.dirpath, n))]:
+            self._maps.pop(other).close()
+        return m
+
+
+def _empty_doc():
+    return {"generation": 1, "bodies": None, "rows": []}
+
+
+class SplitBackend:
+    """notes.heads.json + notes.bodies.*.bin に保存するバックエンド（JsonBackend と同じメソッドを持つ）"""
+
+    name = "split"
+
+    def __init__(self, filepath):
+        self.filepath = filepath            # notes.json の場所（ロック・meta はこれを基準に共有する）
+        self.path = heads_path(filepath)
+        self.dirpath = os.path.dirname(filepath)
+        self._reader = BodyReader(self.dirpath)
+        self._current = (None, None)        # (見出しファイルの signature, 今の見出しの NoteStore)。消えた世代を引き直すとき用
+
+    # ----- 見出しファイル -----
+    def _read_doc(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return _empty_doc()
+
+    def _write_doc(self, heads, generation, bodies, durable=False):
+        # 1行 = 1メモにして、見出しだけでも目で追えるようにしておく
+        with notes_store.atomic_writer(self.path, durable=durable) as f:
+            f.write('{"generation": %d, "bodies": %s, "rows": [' % (generation, json.dumps(bodies)))
+            for i, head in enumerate(heads):
+                f.write(",\n" if i else "\n")
+                f.write(json.dumps(head, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n]}\n")
+
+    # ----- 読み込み -----
+    def load_heads(self):
+        """本文を含まない見出しだけの一覧（本文は body() で取り出す）
+
+        各見出しには本文ファイル名（body_file）を付けて返す。ファイルには書かない（世代は doc に1つだけ）。
+        """
+        doc = self._read_doc()
+        bodies = doc.get("bodies")
+        rows = doc["rows"]
+        for head in rows:
+            head["body_file"] = bodies
+        return rows
+
+    def body(self, note):
+        if "body" in note:
+            return note["body"]
+        name = note.get("body_file")
+        if name is not None:
+            try:
+                return self._reader.read(name, note["body_offset"], note["body_length"])
+            except FileNotFoundError:
+                pass
+        # どの世代か分からない・その世代の本文ファイルが詰め直しで消えていた → 今の見出しから同じメモを引き直す
+        head = self._current_heads().get(note["id"])
+        if head is None:
+            return ""                       # 読んだあとで削除されたメモ
+        return self._reader.read(head["body_file"], head["body_offset"], head["body_length"])
+
+    def _current_heads(self):
+        """今の見出しの NoteStore（見出しファイルが変わっていなければ前回のものを使い回す）"""
+        sig = self.signature()
+        if self._current[0] != sig:
+            self._current = (sig, notes_store.NoteStore(self.load_heads()))
+        return self._current[1]
+
+    def with_body(self, head):
+        note = {k: v for k, v in head.items() if k not in BODY_KEYS}
+        note["body"] = self.body(head)
+        return note
+
+    def with_bodies(self, heads):
+        return [self.with_body(h) for h in heads]
+
+    def load_all(self):
+        return self.with_bodies(self.load_heads())
+
+    def load_range(self, date_from=None, date_to=None):
+        """見出しの created_at で先に絞ってから、残ったものの本文だけを読む"""
+        return list(self.iter_notes(date_from, date_to))
+
+    def iter_notes(self, date_from=None, date_to=None, heads=False):
+        """見出しはまとめて読み、本文は1件ずつ mmap から足して返す"""
+        lo = None if date_from is None else str(date_from)[:10]
+        hi = None if date_to is None else str(date_to)[:10] + "U"
+        for head in self.load_heads():
+            created = head.get("created_at", "")
+            if (lo is None or created >= lo) and (hi is None or created < hi):
+                yield head if heads else self.with_body(head)
+
+    def get(self, note_id):
+        head = notes_store.NoteStore(self.load_heads()).get(note_id)
+        return None if head is None else self.with_body(head)
+
+    def count(self):
+        return len(self._read_doc()["rows"])
+
+    # ----- 書き込み -----
+    def _append_bodies(self, ops, bodies, durable):
+        """ops の本文を先に本文ファイルへ追記し、本文の代わりに位置・長さを持つ op に置き換える"""
+        prepared = []
+        os.makedirs(self.dirpath, exist_ok=True)
+        with open(os.path.join(self.dirpath, bodies), "ab") as f:
+            pos = f.tell()
+
+            def put(fields, text):
+                nonlocal pos
+                data = (text or "").encode("utf-8")
+                f.write(data)
+                fields["body_offset"], fields["body_length"] = pos, len(data)
+                pos += len(data)
+                return fields
+
+            for op in ops:
+                if op[0] == "add":
+                    head = {k: v for k, v in op[1].items() if k != "body"}
+                    prepared.append(("add", put(head, op[1].get("body"))))
+                elif op[0] == "update" and "body" in op[2]:
+                    fields = {k: v for k, v in op[2].items() if k != "body"}
+                    prepared.append(("update", op[1], put(fields, op[2]["body"]), op[3]))
+                else:
+                    prepared.append(op)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        return prepared
+
+    def apply_batch(self, ops, durable=False):
+        """本文を追記 → 見出しを1回だけ書き直す（本文が先に残るので、途中で落ちても見出しは壊れない）"""
+        with notes_store.write_lock(self.filepath):
+            doc = self._read_doc()
+            generation = doc.get("generation", 1)
+            bodies = doc.get("bodies") or bodies_name(self.filepath, generation)
+            store = notes_store.NoteStore(doc["rows"])
+            results, entries = notes_store.apply_ops(store, self._append_bodies(ops, bodies, durable))
+            for i, op in enumerate(ops):
+                if op[0] == "add" and not isinstance(results[i], Exception):
+                    op[1].setdefault("version", 1)
+                    results[i] = op[1]              # 呼び出し側には本文つきの元のメモを返す
+            if entries:
+                heads = store.to_list()
+                if self._needs_compact(heads, bodies):
+                    generation, bodies = self._compact(heads, generation, bodies, durable)
+                self._write_doc(heads, generation, bodies, durable=durable)
+                self._remove_old_bodies(generation)
+                notes_store._bump_next_id(self.filepath, heads)
+                for head in heads:
+                    head["body_file"] = bodies      # 書いたあとで付ける（update の戻り値の見出しからも body() で本文を引ける）
+        return results
+
+    def add(self, note):
+        return notes_store.unwrap(self.apply_batch([("add", note)])[0])
+
+    def update(self, note_id, fields, expected_version=None):
+        """expected_version を渡すと、version が違うとき VersionConflict にする"""
+        return notes_store.unwrap(self.apply_batch([("update", note_id, fields, expected_version)])[0])
+
+    def delete(self, note_id):
+        return notes_store.unwrap(self.apply_batch([("delete", note_id)])[0])
+
+    # ----- 本文ファイルの詰め直し -----
+    def _needs_compact(self, heads, bodies):
+        try:
+            size = os.path.getsize(os.path.join(self.dirpath, bodies))
+        except FileNotFoundError:
+            return False
+        live = sum(h["body_length"] for h in heads)
+        return size >= COMPACT_MIN_BYTES and size - live > size * COMPACT_RATIO
+
+    def _compact(self, heads, generation, bodies, durable=False):
+        """生きている本文だけを次の世代のファイルへ写し、heads の位置を付け替える"""
+        generation += 1
+        new_bodies = bodies_name(self.filepath, generation)
+        with open(os.path.join(self.dirpath, new_bodies), "wb") as f:
+            pos = 0
+            for head in heads:
+                data = self._reader.read(bodies, head["body_offset"], head["body_length"]).encode("utf-8")
+                f.write(data)
+                head["body_offset"], head["body_length"] = pos, len(data)
+                pos += len(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        return generation, new_bodies
+
+    def _remove_old_bodies(self, generation):
+        """2世代以上前の本文ファイルを消す（1つ前は、古い見出しを読んだ人のために残す）"""
+        for gen in range(max(1, generation - 3), generation - 1):
+            path = os.path.join(self.dirpath, bodies_name(self.filepath, gen))
+            if os.path.exists(path):
+                os.remove(path)
+
+    # ----- ID の払い出し -----
+    def allocate_ids(self, count=1):
+        data = None
+        if "next_id" not in notes_store.load_meta(self.filepath):
+            data = self.load_heads()            # meta が無いときだけ、見出しの最大 ID から始める
+        return notes_store.allocate_ids(self.filepath, count, data)
+
+    def next_id(self):
+        return self.allocate_ids(1)[0]
+
+    def signature(self):
+        return notes_store.stat_signature((self.path,))
+
+
+# ===== JSON ⇔ 分割形式の移行 =====
+def import_json(json_path, backend):
+    """notes.json の中身を分割形式に書き出す（既存の分割ファイルは置き換える）。入れた件数を返す。"""
+    with notes_store.write_lock(json_path):
+        generation = backend._read_doc().get("generation", 0) + 1
+        bodies = bodies_name(json_path, generation)
+        heads = []
+        os.makedirs(backend.dirpath, exist_ok=True)
+        with open(os.path.join(backend.dirpath, bodies), "wb") as f:
+            pos = 0
+            for note in notes_store.iter_notes(json_path):     # 本文はすぐ書き出すので、手元に残るのは見出しだけ
+                data = (note.get("body") or "").encode("utf-8")
+                f.write(data)
+                head = {k: v for k, v in note.items() if k != "body"}
+                head["body_offset"], head["body_length"] = pos, len(data)
+                pos += len(data)
+                heads.append(head)
+        backend._write_doc(heads, generation, bodies)
+        backend._remove_old_bodies(generation)
+        notes_store._bump_next_id(json_path, heads)
+    return len(heads)
+
+
+def export_json(backend, json_path):
+    """分割形式の中身を notes.json（スナップショット）に書き戻す。書いた件数を返す。"""
+    with notes_store.write_lock(json_path):
+        notes = backend.load_all()
+        notes_store.save_notes(notes, json_path)
+    return len(notes)
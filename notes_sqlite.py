@@ -0,0 +1,287 @@
+# notes_store.py の SQLite バックエンド
+#
+# data/notes.db に 1メモ = 1行 で保存する。追加・更新・削除はその1行だけを触るので、
+# JSON のように全件を書き直す必要がない。
+#   - WAL モード（読み込みと書き込みが互いを待たない）
+#   - id は INTEGER PRIMARY KEY（= rowid の索引）、created_at にも索引
+#   - 次に使う ID（最高到達点）は meta テーブルに保存（削除済みの ID は再利用しない）
+#   - version 列は UPDATE のたびに +1。WHERE version = ? で「読んだときのまま」か確かめる
+
+import os
+import sqlite3
+import threading
+import contextlib
+
+import notes_store
+import notes_serial
+
+COLUMNS = ("id", "title", "body", "created_at", "updated_at", "version")
+DERIVED = {                 # 読むときに足す列（エポック秒）。created_at と同じ時刻を UTC とみなして数える（notes_store.to_epoch と同じ）
+    "created_ts": "COALESCE(CAST(strftime('%s', created_at) AS INTEGER), 0)",
+    "updated_ts": "CAST(strftime('%s', updated_at) AS INTEGER)",
+}
+READ_COLUMNS = COLUMNS + tuple(DERIVED)
+BATCH_SIZE = 1000           # 移行のとき、何件ずつまとめて INSERT するか
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id         INTEGER PRIMARY KEY,
+    title      TEXT NOT NULL,
+    body       TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL DEFAULT '',
+    updated_at TEXT,
+    version    INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_notes_created_at ON notes(created_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def db_path(filepath):
+    """notes.json → notes.db"""
+    root, _ = os.path.splitext(filepath)
+    return root + ".db"
+
+
+def select_list(cols):
+    """SELECT に並べる列（DERIVED の列は式に置き換える）"""
+    return ", ".join(f"{DERIVED[c]} AS {c}" if c in DERIVED else c for c in cols)
+
+
+def row_to_note(row):
+    """DB の1行（READ_COLUMNS の順）→ JSON 版と同じ形の dict（notes_schema.py の今の版。更新していなければ updated_at は None）"""
+    return dict(zip(READ_COLUMNS, row))
+
+
+def note_to_row(note):
+    return (
+        note.get("id"),
+        note.get("title") or "",
+        note.get("body") or "",
+        note.get("created_at") or "",
+        note.get("updated_at"),
+        notes_store.note_version(note),
+    )
+
+
+class SqliteBackend:
+    """notes.db に保存するバックエンド（JsonBackend と同じメソッドを持つ）"""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    @contextlib.contextmanager
+    def connect(self):
+        """毎回つなぎ直す（Flask のスレッドをまたいで接続を共有しないため）。抜けるときにコミットして閉じる。"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._ready:
+                with self._init_lock:
+                    conn.execute("PRAGMA journal_mode=WAL")     # WAL はファイルに記録されるので最初の1回だけでよい
+                    conn.executescript(SCHEMA)
+                    cols = {row[1] for row in conn.execute("PRAGMA table_info(notes)")}
+                    if "version" not in cols:           # version 列が無かった頃の notes.db
+                        conn.execute("ALTER TABLE notes ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+                    self._ready = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def load_all(self):
+        with self.connect() as conn:
+            cur = conn.execute(f"SELECT {select_list(READ_COLUMNS)} FROM notes ORDER BY id")
+            return [row_to_note(row) for row in cur]
+
+    def get(self, note_id):
+        with self.connect() as conn:
+            return self._get(conn, note_id)
+
+    def load_heads(self):
+        """一覧用：body 列は読まない"""
+        cols = [c for c in READ_COLUMNS if c != "body"]
+        with self.connect() as conn:
+            cur = conn.execute(f"SELECT {select_list(cols)} FROM notes ORDER BY id")
+            return [dict(zip(cols, row)) for row in cur]
+
+    def body(self, note):
+        if "body" in note:
+            return note["body"]
+        with self.connect() as conn:
+            row = conn.execute("SELECT body FROM notes WHERE id = ?", (note.get("id"),)).fetchone()
+        return "" if row is None else row[0]
+
+    def with_bodies(self, heads):
+        with self.connect() as conn:
+            bodies = dict(conn.execute("SELECT id, body FROM notes"))
+        return [dict(h, body=bodies.get(h.get("id"), "")) for h in heads]
+
+    def load_range(self, date_from=None, date_to=None):
+        """created_at の索引で期間内（両端の日を含む）だけを読む。date_from / date_to は date か "YYYY-MM-DD"。"""
+        return list(self.iter_notes(date_from, date_to))
+
+    def iter_notes(self, date_from=None, date_to=None, heads=False):
+        """カーソルから1行ずつ返す（全件をリストにしない）。heads=True なら body 列は読まない。"""
+        cols = [c for c in READ_COLUMNS if c != "body"] if heads else list(READ_COLUMNS)
+        where, params = [], []
+        if date_from is not None:
+            where.append("created_at >= ?")
+            params.append(str(date_from)[:10])
+        if date_to is not None:
+            where.append("created_at < ?")
+            params.append(str(date_to)[:10] + "U")     # "T..." より後ろに来る文字で、その日の終わりまで含める
+        sql = f"SELECT {select_list(cols)} FROM notes"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self.connect() as conn:
+            for row in conn.execute(sql + " ORDER BY id", params):
+                yield dict(zip(cols, row))
+
+    # ----- 書き込み（apply_batch で1回のトランザクションにまとめる） -----
+    def _get(self, conn, note_id):
+        row = conn.execute(f"SELECT {select_list(READ_COLUMNS)} FROM notes WHERE id = ?", (note_id,)).fetchone()
+        return None if row is None else row_to_note(row)
+
+    def _add(self, conn, note):
+        note.setdefault("updated_at", None)
+        note.setdefault("version", 1)
+        notes_store.stamp_times(note)
+        conn.execute(
+            f"INSERT OR REPLACE INTO notes ({', '.join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+            note_to_row(note),
+        )
+        self._bump_next_id(conn, note.get("id", 0) + 1)
+        return note
+
+    def _update(self, conn, note_id, fields, expected_version):
+        cols = [col for col in fields if col in COLUMNS and col not in ("id", "version")]
+        sets = [c + " = ?" for c in cols] + ["version = version + 1"]
+        params = [fields[c] for c in cols] + [note_id]
+        where = "id = ?"
+        if expected_version is not None:
+            where += " AND version = ?"
+            params.append(int(expected_version))
+        cur = conn.execute(f"UPDATE notes SET {', '.join(sets)} WHERE {where}", params)
+        current = self._get(conn, note_id)
+        if cur.rowcount == 0 and current is not None:
+            raise notes_store.VersionConflict(current)
+        return current
+
+    def _delete(self, conn, note_id):
+        cur = conn.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+        return cur.rowcount > 0
+
+    def apply_batch(self, ops, durable=False):
+        """ops（notes_store.apply_ops と同じ形）を1回のトランザクションで反映する"""
+        results = []
+        with self.connect() as conn:
+            if durable:
+                conn.execute("PRAGMA synchronous=FULL")     # コミットのたびに WAL を fsync する
+            for op in ops:
+                kind = op[0]
+                try:
+                    if kind == "add":
+                        results.append(self._add(conn, op[1]))
+                    elif kind == "update":
+                        results.append(self._update(conn, *op[1:]))
+                    elif kind == "delete":
+                        results.append(self._delete(conn, op[1]))
+                    else:
+                        raise ValueError(f"unknown op: {kind}")
+                except Exception as e:
+                    results.append(e)
+        return results
+
+    def add(self, note):
+        return notes_store.unwrap(self.apply_batch([("add", note)])[0])
+
+    def update(self, note_id, fields, expected_version=None):
+        """expected_version を渡すと、version が違うとき VersionConflict にする"""
+        return notes_store.unwrap(self.apply_batch([("update", note_id, fields, expected_version)])[0])
+
+    def delete(self, note_id):
+        return notes_store.unwrap(self.apply_batch([("delete", note_id)])[0])
+
+    def count(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    # ----- ID の払い出し（meta テーブルの next_id） -----
+    def _read_next_id(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        if row is not None:
+            return int(row[0])
+        top = conn.execute("SELECT COALESCE(MAX(id), 0) FROM notes").fetchone()[0]
+        return top + 1
+
+    def _bump_next_id(self, conn, at_least):
+        if self._read_next_id(conn) < at_least:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)", (str(at_least),))
+
+    def allocate_ids(self, count=1):
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")     # 他のプロセスと同じ ID を取り合わないように書き込みロックを先に取る
+            start = self._read_next_id(conn)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)", (str(start + count),))
+        return range(start, start + count)
+
+    def next_id(self):
+        return self.allocate_ids(1)[0]
+
+    def signature(self):
+        return notes_store.stat_signature((self.path, self.path + "-wal"))
+
+
+# ===== JSON ⇔ SQLite の移行 =====
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_json(json_path, backend):
+    """notes.json の中身を notes.db に流し込む。入れた件数を返す。"""
+    total = 0
+    top = 0
+    with backend.connect() as conn:
+        for batch in _batches(notes_store.iter_notes(json_path), BATCH_SIZE):   # 1件ずつ読んで、BATCH_SIZE 件ずつ入れる
+            conn.executemany(
+                f"INSERT OR REPLACE INTO notes ({', '.join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                [note_to_row(n) for n in batch],
+            )
+            total += len(batch)
+            top = max([top] + [n.get("id", 0) for n in batch])
+        next_id = max(notes_store.load_meta(json_path).get("next_id", 0), top + 1)
+        backend._bump_next_id(conn, next_id)
+    return total
+
+
+def export_json(backend, json_path):
+    """notes.db の中身を1件ずつ notes.json に書き出す（全件をメモリに持たない）。書いた件数を返す。"""
+    with notes_store.write_lock(json_path):
+        with backend.connect() as conn, notes_store.atomic_writer(json_path, binary=True) as f:
+            cur = conn.execute(f"SELECT {select_list(READ_COLUMNS)} FROM notes ORDER BY id")
+            total = notes_serial.write_array(f, (row_to_note(row) for row in cur))   # save_notes と同じ詰めた形
+            next_id = backend._read_next_id(conn)
+        # JSON 側のジャーナルは古い内容なので捨て、ID の最高到達点も引き継ぐ
+        for path in (notes_store.journal_path(json_path), notes_store.journal_path(json_path) + ".compacting"):
+            if os.path.exists(path):
+                os.remove(path)
+        meta = notes_store.load_meta(json_path)
+        meta["next_id"] = max(meta.get("next_id", 0), next_id)
+        notes_store.save_meta(meta, json_path)
+    return total
@@ -0,0 +1,1118 @@
+# test47.py（CLI）と test48.py（Flask）で共通に使う、メモデータの保存まわり
+#
+# notes.json（スナップショット）に加えて、ジャーナルモードでは
+# 「1回の変更 = 1行のJSON」を notes.journal.jsonl に追記していく。
+#   - 読み込み時：スナップショット → ジャーナルの順に再生して最新の一覧を作る
+#   - 書き込み時：1件分の変更だけを追記（全件の書き直しはしない）
+#   - ジャーナルが大きくなったら、裏でスナップショットへまとめ直す（コンパクション）
+# ジャーナルは WAL（先行書き込みログ）として扱う。1回の書き込みのまとまりの最後に commit 行を付け、
+# 読むときは commit 行まで揃ったまとまりだけを再生する。fsync のタイミングは NOTES_FSYNC で選ぶ
+# （always = 追記のたび / ミリ秒の数字 = その間隔で1回 / never = OS まかせ）。
+# NOTES_FSYNC はジャーナルを使わない既定のモード（毎回 notes.json を置き換える）にも同じように効く。
+# 電源が落ちても「保存しました」のあとの変更が消えないのは NOTES_FSYNC=always（既定）のときだけ。
+# ミリ秒の数字なら最後のその時間ぶん、never なら OS がディスクに書くまでのぶんを失うことがある。
+# （json 以外の保存先は、呼び出し側が durable=True を渡したときに fsync する。group commit は常に渡す）
+# 起動時（JsonBackend を作るとき）には recover_journal() で書きかけの末尾を切り詰める。
+#
+# 書き込みは data/.notes.lock を fcntl でロックしてから行うので、Flask を複数プロセスで
+# 動かしても「読んで→書き換えて→保存」が混ざらない。読み込みはロックなしで行う
+# （notes.json は置き換えで一瞬で切り替わり、ジャーナルの書きかけ行は読み飛ばすため）。
+# 各メモは version を持ち、更新のたびに1つ増える。edit() はこれで先を越されていないか確かめる。
+#
+# 保存先（バックエンド）は差し替えられる。既定は JSON ファイル（JsonBackend）で、
+# NOTES_BACKEND=sqlite または --backend sqlite で SQLite（notes_sqlite.py）になる。
+# NOTES_BACKEND=split なら見出しと本文を別ファイルに分けて保存する（notes_split.py）。
+# NOTES_BACKEND=sharded なら作成月ごとのファイル（data/notes/2025-11.jsonl）に分けて保存する（notes_shards.py）。
+# どの保存先でも、古いメモは notes.archive/ に圧縮して移しておける（notes_archive.py。読むときは一緒に見える）。
+# メモ1件の形には版があり、notes.meta.json に記録する（notes_schema.py。古い版は読むときに揃える）。
+# notes.json は空白を入れない詰めた JSON で書く（notes_serial.py。orjson が入っていれば自動で使う）。
+# NOTES_SNAPSHOT=1 なら notes.json と同じ中身をバイナリ（notes.snap）でも書き、起動時はそちらを読む（notes_snapshot.py）。
+
+import os
+import re
+import json
+import zlib
+import bisect
+import datetime
+import tempfile
+import threading
+import contextlib
+
+try:
+    import fcntl                                # macOS / Linux のみ。無ければプロセス内のロックだけで動かす
+except ImportError:
+    fcntl = None
+
+import notes_serial
+
+JOURNAL_ENV = "NOTES_JOURNAL"                   # "1" ならジャーナルモードで書き込む
+JOURNAL_COMPACT_BYTES = 512 * 1024              # ジャーナルがこのサイズを超えたらコンパクションする
+STREAM_CHUNK_CHARS = 64 * 1024                  # iter_notes が1回に読む文字数
+FSYNC_ENV = "NOTES_FSYNC"                       # ジャーナルの fsync："always" / "never" / ミリ秒の数字（"100" = 100ms ごと）
+DEFAULT_FSYNC = "always"
+BACKEND_ENV = "NOTES_BACKEND"                   # "json"（既定）/ "sqlite" / "split" / "sharded"
+DEFAULT_BACKEND = "json"
+
+_compact_lock = threading.Lock()                # 同じプロセス内でコンパクションが重ならないようにする
+_meta_lock = threading.Lock()                   # 同じプロセス内で ID の払い出しが重ならないようにする
+
+
+def journal_enabled() -> bool:
+    """環境変数 NOTES_JOURNAL=1 のときだけジャーナルモードにする"""
+    return os.environ.get(JOURNAL_ENV, "") == "1"
+
+
+def fsync_policy():
+    """環境変数 NOTES_FSYNC → ("always", 0) / ("never", 0) / ("interval", 秒)"""
+    raw = os.environ.get(FSYNC_ENV, "").strip().lower() or DEFAULT_FSYNC
+    if raw in ("always", "never"):
+        return raw, 0
+    ms = raw[:-2] if raw.endswith("ms") else raw
+    if ms.isdigit():
+        return "interval", int(ms) / 1000
+    raise ValueError(f"{FSYNC_ENV} must be always / never / milliseconds: {raw!r}")
+
+
+def journal_path(filepath):
+    """notes.json → notes.journal.jsonl"""
+    root, _ = os.path.splitext(filepath)
+    return root + ".journal.jsonl"
+
+
+def meta_path(filepath):
+    """notes.json → notes.meta.json（次に使う ID などを覚えておく小さなファイル）"""
+    root, _ = os.path.splitext(filepath)
+    return root + ".meta.json"
+
+
+def _compacting_path(filepath):
+    """コンパクション中のジャーナルを退避しておく場所"""
+    return journal_path(filepath) + ".compacting"
+
+
+def lock_path(filepath):
+    """notes.json → .notes.lock（書き込み用のロックファイル）"""
+    root, _ = os.path.splitext(filepath)
+    return os.path.join(os.path.dirname(root), "." + os.path.basename(root) + ".lock")
+
+
+# ===== 書き込みロック（プロセス間） =====
+_lock_state = threading.local()                 # スレッドごとに「どのロックを何重に持っているか」
+_fallback_lock = threading.RLock()              # fcntl が無い環境ではプロセス内だけで順番にする
+
+
+@contextlib.contextmanager
+def write_lock(filepath):
+    """notes.json への書き込みを、ほかのプロセス・スレッドと順番にする
+
+    同じスレッドの中で入れ子にしても固まらない（2回目以降は数を数えるだけ）。
+    """
+    path = lock_path(filepath)
+    held = getattr(_lock_state, "held", None)
+    if held is None:
+        held = _lock_state.held = {}
+    if path in held:
+        fd, depth = held[path]
+        held[path] = (fd, depth + 1)
+        try:
+            yield
+        finally:
+            fd, depth = held[path]
+            held[path] = (fd, depth - 1)
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)      # ファイルを開き直したスレッド同士でもここで待ち合わせになる
+        else:
+            _fallback_lock.acquire()
+        held[path] = (fd, 1)
+        try:
+            yield
+        finally:
+            del held[path]
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                _fallback_lock.release()
+    finally:
+        os.close(fd)
+
+
+# ===== メモの版（version / ETag） =====
+class VersionConflict(Exception):
+    """更新しようとしたメモが、読んだときから別の誰かに書き換えられていた"""
+
+    def __init__(self, current):
+        super().__init__(f"note #{current.get('id')} is now version {note_version(current)}")
+        self.current = current
+
+
+def note_version(note):
+    """version が無い古いメモは 1 とみなす"""
+    return int(note.get("version", 1))
+
+
+def note_etag(note):
+    """HTTP の ETag ヘッダー用の文字列（id と version から作る）"""
+    return f'"{note.get("id")}-{note_version(note)}"'
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_SECOND = datetime.timedelta(seconds=1)
+
+
+def to_epoch(value):
+    """"YYYY-MM-DDTHH:MM:SS"（または datetime）→ エポック秒の int。空・読めないものは None。
+
+    タイムゾーンは付けずに、書いてある時刻をそのまま UTC とみなして数える（並べ替え・範囲の比較にだけ使う）。
+    SQLite の strftime('%s', ...) と同じ数になる。
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value[:19])
+        except ValueError:
+            return None
+    return (value - _EPOCH) // _SECOND
+
+
+def stamp_times(fields):
+    """fields に created_at / updated_at があれば、エポック秒の created_ts / updated_ts も入れて返す
+
+    日時の文字列は書くときに1回だけ数にしておき、読む側（並べ替え・期間の絞り込み）は数を比べるだけにする。
+    created_ts は読めなければ 0（いちばん古い扱い）、updated_ts は None。
+    """
+    if "created_at" in fields:
+        fields["created_ts"] = to_epoch(fields["created_at"]) or 0
+    if "updated_at" in fields:
+        fields["updated_ts"] = to_epoch(fields["updated_at"])
+    return fields
+
+
+def check_version(current, expected_version):
+    """expected_version（None なら確認しない）が今の version と違えば VersionConflict"""
+    if expected_version is not None and int(expected_version) != note_version(current):
+        raise VersionConflict(current)
+
+
+# ===== 読み込み =====
+def _read_snapshot(filepath):
+    try:
+        with open(filepath, "rb") as f:
+            return notes_serial.loads(f.read()) or []
+    except FileNotFoundError:
+        return []
+
+
+def _iter_journal(path):
+    """JSONL（1行 = 1件）を1行ずつ dict にして返す。書きかけの最終行（クラッシュ跡）は読み飛ばす。"""
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def _journal_units(path):
+    """ジャーナルを先頭から読み、確定した変更のまとまりごとに (そこまでのバイト数, [変更, ...]) を返す
+
+    txn の付いた行は、同じ txn の commit 行（件数と CRC32 が合うもの）が来て初めて確定とみなす。
+    txn の無い行は以前の形式（1行 = 1変更）なので、1行ずつ確定として扱う。
+    commit の無いまま終わったまとまりや壊れた行（書いている途中で落ちた跡）は返さない。
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        offset = 0
+        txn, batch, crc = None, [], 0
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break                               # 改行まで書けていない最終行は、中身が読めても書きかけ
+            offset += len(raw)
+            try:
+                entry = json.loads(raw)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                txn, batch, crc = None, [], 0
+                continue
+            if not isinstance(entry, dict):
+                continue
+            if entry.get("op") == "commit":
+                if entry.get("txn") == txn and entry.get("count") == len(batch) and entry.get("crc") == crc:
+                    yield offset, batch
+                txn, batch, crc = None, [], 0
+            elif "txn" not in entry:
+                yield offset, [entry]
+            else:
+                if entry["txn"] != txn:             # 前のまとまりは commit が無いまま終わった
+                    txn, batch, crc = entry["txn"], [], 0
+                batch.append(entry)
+                crc = zlib.crc32(raw, crc)
+
+
+def _iter_committed(path):
+    """ジャーナルの確定した変更だけを1つずつ返す"""
+    for _, entries in _journal_units(path):
+        yield from entries
+
+
+def apply_entries(data, entries):
+    """ジャーナルの変更を data（メモのリスト）に順番に当てはめる
+
+    同じ変更を2回当てても結果が変わらないようにしてある（コンパクション途中で
+    落ちたときに、スナップショットと退避ジャーナルの両方に同じ変更が残るため）。
+    """
+    store = NoteStore(data)
+    for entry in entries:
+        op = entry.get("op")
+        if op == "add":
+            store.add(entry["note"])
+        elif op == "update":
+            store.update(entry.get("id"), entry.get("set", {}))
+        elif op == "delete":
+            store.delete(entry.get("id"))
+    return store.to_list()
+
+
+def load_notes(filepath):
+    """スナップショット + ジャーナルを再生して、最新のメモ一覧を返す
+
+    JSONが壊れているときの json.JSONDecodeError などは呼び出し側で扱う。
+    """
+    data = _read_snapshot(filepath)
+    for path in (_compacting_path(filepath), journal_path(filepath)):
+        if os.path.exists(path):
+            data = apply_entries(data, _iter_committed(path))
+    return data
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_SEPARATOR = re.compile(r"[ \t\n\r]*,[ \t\n\r]*")
+
+
+def _iter_snapshot(filepath, chunk_chars=None):
+    """notes.json の一番外側の [ ... ] を少しずつ読み、要素を1つずつ返す
+
+    json.load と違って全体を一度に読まないので、メモリは「1件分 + 読み込み単位」で済む。
+    壊れていれば json.JSONDecodeError を出す（それまでに返した分はそのまま）。
+    """
+    chunk_chars = chunk_chars or STREAM_CHUNK_CHARS
+    decoder = json.JSONDecoder()
+    scan = decoder.scan_once
+    try:
+        f = open(filepath, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with f:
+        buf = ""
+        pos = 0
+        eof = False
+        started = False                             # "[" を読んだか
+        count = 0                                   # 返した要素の数
+        after_value = False                         # 直前が要素なら、次は "," か "]" のはず
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_chars)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        while True:
+            # 空白を読み飛ばす（足りなければ読み足す）
+            while True:
+                pos = _WHITESPACE.match(buf, pos).end()
+                if pos < len(buf) or eof:
+                    break
+                fill()
+            if pos >= len(buf):
+                if started:
+                    raise json.JSONDecodeError("Expecting ']'", buf, pos)
+                return                              # 空のファイルは「メモなし」
+            if not started:
+                if len(buf) - pos < 4 and not eof:
+                    fill()
+                    continue
+                if buf.startswith("null", pos):     # json.load が None を返すファイル（= 空の一覧）
+                    return
+                if buf[pos] != "[":
+                    raise json.JSONDecodeError("Expecting '['", buf, pos)
+                started = True
+                pos += 1
+                continue
+            c = buf[pos]
+            if after_value:
+                if c == "]":
+                    return
+                if c != ",":
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+                pos += 1
+                after_value = False
+                continue
+            if c == "]" and count == 0:
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()                              # 1件がまだ途中までしか読めていない
+                continue
+            if end >= len(buf) and not eof:
+                fill()                              # 数値などが切れ目で終わっているかもしれないので読み足して確かめる
+                continue
+            yield obj
+            count += 1
+            after_value = True
+            pos = end
+            # 速い道：区切りの "," と次の要素がバッファの中に丸ごとあるあいだは、続けて読む
+            while True:
+                m = _SEPARATOR.match(buf, pos)
+                if m is None:
+                    break
+                try:
+                    obj, end = scan(buf, m.end())
+                except (StopIteration, json.JSONDecodeError):
+                    break                           # 途中で切れている・壊れている → 上の丁寧な道で確かめる
+                if end >= len(buf):
+                    break
+                yield obj
+                count += 1
+                pos = end
+            if pos > chunk_chars:
+                buf = buf[pos:]
+                pos = 0
+
+
+def iter_notes(filepath, chunk_chars=None):
+    """load_notes と同じ一覧を、1件ずつ返すイテレーターとして読む（巨大な notes.json 向け）
+
+    ジャーナルの変更は id ごとにまとめておき、スナップショットの各メモに当てはめてから返す。
+    スナップショットに無い id（ジャーナルで追加されたもの）は最後に返す。順番は load_notes と同じ。
+    """
+    changes = {}                                    # id → その id への変更（順番どおり）
+    for path in (_compacting_path(filepath), journal_path(filepath)):
+        for entry in _iter_committed(path):
+            note_id = entry["note"].get("id") if entry.get("op") == "add" else entry.get("id")
+            changes.setdefault(note_id, []).append(entry)
+
+    def replay(note, entries):
+        for entry in entries:
+            op = entry.get("op")
+            if op == "add":
+                note = dict(entry["note"])
+            elif op == "update" and note is not None:
+                note.update(entry.get("set", {}))
+            elif op == "delete":
+                note = None
+        return note
+
+    seen = set()
+    for note in _iter_snapshot(filepath, chunk_chars):
+        note_id = note.get("id")
+        if note_id in changes:
+            if note_id in seen:
+                continue                            # 同じ id が2回あっても、変更を当てた1件だけを返す
+            seen.add(note_id)
+            note = replay(note, changes[note_id])
+            if note is None:
+                continue
+        yield note
+    for note_id, entries in changes.items():
+        if note_id not in seen:
+            note = replay(None, entries)
+            if note is not None:
+                yield note
+
+
+# ===== 書き込み =====
+def _write_json_atomic(obj, filepath, indent=None, durable=False):
+    """一時ファイル→置き換えで、途中失敗でも壊れにくく保存する"""
+    with atomic_writer(filepath, durable=durable) as f:
+        json.dump(obj, f, ensure_ascii=False, indent=indent)
+
+
+@contextlib.contextmanager
+def atomic_writer(filepath, durable=False, binary=False):
+    """一時ファイルに書かせてから filepath に置き換える
+
+    一時ファイル名は毎回ちがう名前にする（複数プロセスが同時に保存しても取り合わない）。
+    durable=True なら中身とフォルダを fsync してから戻る（電源断でも消えない）。
+    binary=True なら bytes を書くファイルとして渡す。
+    """
+    dirpath = os.path.dirname(filepath)
+    os.makedirs(dirpath, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix="." + os.path.basename(filepath) + ".", suffix=".tmp")
+    try:
+        with (os.fdopen(fd, "wb") if binary else os.fdopen(fd, "w", encoding="utf-8")) as f:
+            yield f
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(filepath).st_mode & 0o777)   # mkstemp は 0600 で作るので、元の権限に合わせる
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, filepath)
+        if durable:
+            fsync_dir(dirpath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def fsync_dir(dirpath):
+    """名前の変更（os.replace）をディスクに確定させる"""
+    try:
+        fd = os.open(dirpath, os.O_RDONLY)
+    except OSError:
+        return                              # Windows などフォルダを開けない環境では何もしない
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_snapshot(data, filepath, durable=False):
+    """notes.json を詰めた JSON で書く（人が読む整形済みのものは test47.py export で別に書き出す）"""
+    with atomic_writer(filepath, durable=durable, binary=True) as f:
+        f.write(notes_serial.dumps(data))
+
+
+def save_notes(data, filepath, durable=False):
+    """全件をスナップショットとして書き出す。ジャーナルはもう不要なので消す。
+
+    fsync は NOTES_FSYNC に従う（always なら中身とフォルダを fsync してから戻る）。
+    durable=True なら設定にかかわらず、戻る前に fsync する。
+    """
+    policy, interval = fsync_policy()
+    _write_snapshot(data, filepath, durable=durable or policy == "always")
+    if not durable and policy == "interval":
+        _interval_sync.request(filepath, interval, with_dir=True)
+    _bump_next_id(filepath, data)
+    for path in (_compacting_path(filepath), journal_path(filepath)):
+        if os.path.exists(path):
+            os.remove(path)
+    import notes_snapshot
+    if notes_snapshot.snapshot_enabled():
+        notes_snapshot.write_snapshot(data, filepath)
+
+
+def append_journal(filepath, entry, durable=False):
+    """変更1件を1行のJSONとしてジャーナルに追記する"""
+    append_journal_entries(filepath, [entry], durable=durable)
+
+
+def format_journal(entries):
+    """ジャーナルに書く1まとまり分のバイト列（各行に txn を付け、最後に件数と CRC32 の commit 行）"""
+    txn = os.urandom(8).hex()
+    lines = [(json.dumps(dict(e, txn=txn), ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+             for e in entries]
+    crc = 0
+    for line in lines:
+        crc = zlib.crc32(line, crc)
+    commit = {"op": "commit", "txn": txn, "count": len(lines), "crc": crc}
+    return b"".join(lines) + (json.dumps(commit, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def append_journal_entries(filepath, entries, durable=False):
+    """変更をまとめて1回の write でジャーナルに追記する（write_lock の中で呼ぶこと）
+
+    fsync は NOTES_FSYNC に従う。durable=True なら設定にかかわらず、戻る前に fsync する。
+    """
+    path = journal_path(filepath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    policy, interval = fsync_policy()
+    created = not os.path.exists(path)
+    with open(path, "ab") as f:
+        f.write(format_journal(entries))
+        f.flush()
+        if durable or policy == "always":
+            os.fsync(f.fileno())
+            if created:
+                fsync_dir(os.path.dirname(path))    # 新しく作ったジャーナルは、名前もディスクに確定させる
+        elif policy == "interval":
+            _interval_sync.request(path, interval, with_dir=created)
+    maybe_compact(filepath)
+
+
+class _IntervalSync:
+    """NOTES_FSYNC=<ミリ秒> のとき、追記のたびではなく「最初の未 fsync の追記から N ミリ秒後」に1回 fsync する
+
+    タイマーは daemon にしないので、CLI が終了するときも最後の fsync を待ってから終わる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timers = {}                   # パス → 予約済みのタイマー
+        self._dirs = set()                  # fsync のあとでフォルダも fsync するパス（新しく作った・置き換えたもの）
+
+    def request(self, path, delay, with_dir=False):
+        with self._lock:
+            if with_dir:
+                self._dirs.add(path)
+            if path in self._timers:
+                return                      # もう予約してある（その fsync で今回の追記もまとめて確定する）
+            timer = threading.Timer(delay, self._sync, args=(path,))
+            self._timers[path] = timer
+            timer.start()
+
+    def _sync(self, path):
+        with self._lock:
+            self._timers.pop(path, None)
+            with_dir = path in self._dirs
+            self._dirs.discard(path)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return                          # コンパクションで消えた（中身は fsync 済みのスナップショットにある）
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        if with_dir:
+            fsync_dir(os.path.dirname(path))    # 中身を確定させてから、名前（置き換え・新規作成）を確定させる
+
+
+_interval_sync = _IntervalSync()
+
+
+def recover_journal(filepath):
+    """起動時の後始末。(再生できる変更の数, 切り詰めたバイト数) を返す。
+
+    1. ジャーナル末尾の書きかけ（commit の無いまとまり・壊れた行）を切り詰める
+       （残したままだと、次の追記が書きかけの行の続きにくっついて読めなくなる）
+    2. 途中で止まったコンパクション（.compacting が残っている）があれば最後まで行う
+    確定した変更はこのあと load_notes / iter_notes がふつうに再生する。
+    """
+    path = journal_path(filepath)
+    if not os.path.exists(path) and not os.path.exists(_compacting_path(filepath)):
+        return 0, 0
+    with write_lock(filepath):
+        committed, end = 0, 0
+        for end, entries in _journal_units(path):
+            committed += len(entries)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if size > end:
+            with open(path, "r+b") as f:
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+        if os.path.exists(_compacting_path(filepath)):
+            compact_journal(filepath)
+    return committed, max(0, size - end)
+
+
+def compact_journal(filepath):
+    """ジャーナルをスナップショットにまとめ、ジャーナルを空にする
+
+    1. notes.journal.jsonl を .compacting に名前変更（以降の追記は新しいジャーナルへ）
+    2. スナップショット + .compacting を再生して notes.json を書き直す
+    3. .compacting を消す
+    中身は変わらないので、検索インデックス（notes_index.py）が記録した signature も付け替えておく。
+    """
+    with write_lock(filepath), _compact_lock:
+        before = json_signature(filepath)
+        src = journal_path(filepath)
+        moved = _compacting_path(filepath)
+        if not os.path.exists(moved):
+            try:
+                os.replace(src, moved)
+            except FileNotFoundError:
+                return
+        data = apply_entries(_read_snapshot(filepath), _iter_committed(moved))
+        _write_snapshot(data, filepath, durable=True)   # ジャーナルを消す前に、スナップショットを確実にディスクへ
+        os.remove(moved)
+        import notes_index                  # 使うときだけ読み込む
+        notes_index.SearchIndex(filepath).carry_signature(before, json_signature(filepath))
+
+
+def maybe_compact(filepath, threshold=None, background=True):
+    """ジャーナルがしきい値を超えていたらコンパクションを始める（既定はバックグラウンド）"""
+    limit = JOURNAL_COMPACT_BYTES if threshold is None else threshold
+    try:
+        size = os.path.getsize(journal_path(filepath))
+    except FileNotFoundError:
+        return
+    if size < limit or _compact_lock.locked():
+        return
+    if background:
+        # daemon にしないので、CLI が終了する前にコンパクションは最後まで走る
+        threading.Thread(target=compact_journal, args=(filepath,)).start()
+    else:
+        compact_journal(filepath)
+
+
+# ===== ID の払い出し =====
+def load_meta(filepath):
+    """notes.meta.json を dict で返す（無ければ空の dict）"""
+    try:
+        with open(meta_path(filepath), "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_meta(meta, filepath):
+    _write_json_atomic(meta, meta_path(filepath))
+
+
+def allocate_ids(filepath, count=1, data=None):
+    """新しい ID を count 個まとめて予約し、range で返す
+
+    次に使う ID（最高到達点）は notes.meta.json に保存してあるので、
+    全件を見なくても一定時間で払い出せる。削除された ID は二度と使わない。
+    meta が無いときだけ、data（無ければファイル）の最大 ID から始める。
+    """
+    with write_lock(filepath), _meta_lock:
+        meta = load_meta(filepath)
+        start = meta.get("next_id")
+        if start is None:
+            rows = load_notes(filepath) if data is None else data
+            start = max((row.get("id", 0) for row in rows), default=0) + 1
+        meta["next_id"] = start + count
+        save_meta(meta, filepath)
+        return range(start, start + count)
+
+
+def next_id(filepath, data=None):
+    """新しい ID を1つ払い出す"""
+    return allocate_ids(filepath, 1, data)[0]
+
+
+def _bump_next_id(filepath, data):
+    """全件保存のついでに、meta の next_id が既存の最大 ID より後ろにあることを保証する"""
+    top = max((row.get("id", 0) for row in data), default=0)
+    with _meta_lock:
+        meta = load_meta(filepath)
+        if meta.get("next_id", 0) <= top:
+            meta["next_id"] = top + 1
+            save_meta(meta, filepath)
+
+
+# ===== id で引ける一覧 =====
+class NoteStore:
+    """メモの一覧 + 「id → 一覧の何番目か」の辞書
+
+    get / update / delete は辞書を引くだけなので、件数に関係なく一定時間で終わる。
+    削除した場所はすぐには詰めずに None（墓石）を置いておき、
+    墓石が増えすぎたら reorganize() でまとめて詰め直す。
+    新しい順の一覧（newest_first）用に (created_ts, id) の並びも持てる。最初に呼ばれたときに1回だけ並べ、
+    そのあとの add / update / delete では二分探索で1か所ずつ直すので、並べ直しは起きない。
+    """
+
+    REORG_RATIO = 0.25          # 墓石が全体のこの割合を超えたら詰め直す
+    REORG_MIN = 1024            # 小さい一覧では詰め直しの手間のほうが大きいので待つ
+
+    def __init__(self, notes=()):
+        self._rows = []
+        self._pos = {}
+        self._dead = 0
+        self._order = None      # (created_ts, id) の昇順。newest_first() を呼ぶまでは作らない
+        for note in notes:
+            self.add(note)
+
+    def __len__(self):
+        return len(self._rows) - self._dead
+
+    def __iter__(self):
+        return (row for row in self._rows if row is not None)
+
+    def __contains__(self, note_id):
+        return note_id in self._pos
+
+    def get(self, note_id):
+        """id のメモを返す。無ければ None。"""
+        i = self._pos.get(note_id)
+        return None if i is None else self._rows[i]
+
+    def add(self, note):
+        """末尾に追加する。同じ id が既にあれば、その場所を置き換える。"""
+        nid = note.get("id")
+        i = self._pos.get(nid)
+        if self._order is not None:
+            if i is not None:
+                self._unorder(self._rows[i])
+            bisect.insort(self._order, self._order_key(note))
+        if i is not None:
+            self._rows[i] = note
+            return note
+        self._pos[nid] = len(self._rows)
+        self._rows.append(note)
+        return note
+
+    def update(self, note_id, fields):
+        """id のメモに fields を反映して返す。無ければ None。"""
+        note = self.get(note_id)
+        if note is not None:
+            moved = self._order is not None and "created_ts" in fields
+            if moved:
+                self._unorder(note)
+            note.update(fields)
+            if moved:
+                bisect.insort(self._order, self._order_key(note))
+        return note
+
+    def delete(self, note_id):
+        """id のメモを墓石に置き換える。消せたら True。"""
+        i = self._pos.pop(note_id, None)
+        if i is None:
+            return False
+        if self._order is not None:
+            self._unorder(self._rows[i])
+        self._rows[i] = None
+        self._dead += 1
+        if self._dead >= self.REORG_MIN and self._dead > len(self._rows) * self.REORG_RATIO:
+            self.reorganize()
+        return True
+
+    def reorganize(self):
+        """墓石を取り除いて詰め直し、位置の辞書を作り直す"""
+        self._rows = [row for row in self._rows if row is not None]
+        self._pos = {row.get("id"): i for i, row in enumerate(self._rows)}
+        self._dead = 0
+
+    def to_list(self):
+        """保存用に、墓石を除いたふつうのリストを返す"""
+        return list(self)
+
+    @staticmethod
+    def _order_key(note):
+        return (note.get("created_ts") or 0, note.get("id"))
+
+    def _unorder(self, note):
+        key = self._order_key(note)
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+
+    def newest_first(self, start=0, stop=None):
+        """created_at の新しい順に並べたときの [start:stop] を返す（同じ時刻なら id の大きい順）
+
+        並びは持っているので、切り出す分だけ id を引けばよい（日時の文字列は読まない）。
+        """
+        if self._order is None:
+            self._order = sorted(self._order_key(row) for row in self)
+        n = len(self._order)
+        stop = n if stop is None else min(stop, n)
+        keys = self._order[max(n - stop, 0):max(n - start, 0)]
+        return [self._rows[self._pos[nid]] for _, nid in reversed(keys)]
+
+
+# ===== 変更のまとめ適用 =====
+# 変更（op）はタプルで表す：
+#   ("add", note) / ("update", note_id, fields, expected_version) / ("delete", note_id)
+# 結果は op ごとに「戻り値」か「例外オブジェクト」（VersionConflict など）が入ったリストで返す。
+def apply_ops(store, ops):
+    """store に ops を順に当てはめ、(結果のリスト, ジャーナルに書く行のリスト) を返す"""
+    results = []
+    entries = []
+    for op in ops:
+        kind = op[0]
+        try:
+            if kind == "add":
+                note = op[1]
+                note.setdefault("updated_at", None)     # 新しく書くメモは最初から今の形（notes_schema.py）にそろえる
+                note.setdefault("version", 1)
+                stamp_times(note)
+                store.add(note)
+                entries.append({"op": "add", "note": note})
+                results.append(note)
+            elif kind == "update":
+                _, note_id, fields, expected_version = op
+                current = store.get(note_id)
+                if current is None:
+                    results.append(None)
+                    continue
+                check_version(current, expected_version)
+                fields = stamp_times(dict(fields, version=note_version(current) + 1))
+                store.update(note_id, fields)
+                entries.append({"op": "update", "id": note_id, "set": fields})
+                results.append(current)
+            elif kind == "delete":
+                ok = store.delete(op[1])
+                if ok:
+                    entries.append({"op": "delete", "id": op[1]})
+                results.append(ok)
+            else:
+                raise ValueError(f"unknown op: {kind}")
+        except Exception as e:
+            results.append(e)
+    return results, entries
+
+
+def unwrap(result):
+    """apply_batch の結果1つ分を、ふつうの戻り値 / 例外に戻す"""
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+# ===== 保存先（バックエンド）の差し替え =====
+def stat_signature(paths):
+    """ファイル群の (inode, st_mtime_ns, st_size)。どれかが変わったら中身が変わったとみなす。"""
+    sig = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            sig.append(None)
+            continue
+        sig.append((st.st_ino, st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def json_signature(filepath):
+    """notes.json とジャーナル（退避中のものも）の stat_signature"""
+    return stat_signature((filepath, _compacting_path(filepath), journal_path(filepath)))
+
+
+class JsonBackend:
+    """notes.json（+ ジャーナル）に保存するバックエンド。これが既定。
+
+    どのバックエンドも同じメソッドを持つ：
+      load_all / get / add / update / delete / count / allocate_ids / signature
+      load_heads / body / with_bodies（一覧用の見出しだけを読み、本文はあとから取り出す）
+      load_range（created_at の期間で読む量を減らせる保存先向け。結果は期間より広いことがある）
+      iter_notes（load_range と同じものを1件ずつ返す。heads=True なら本文を省いてよい）
+    """
+
+    name = "json"
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        recover_journal(filepath)           # 前回落ちたときの書きかけがあれば片付けてから使う
+
+    def load_all(self):
+        import notes_snapshot
+        if notes_snapshot.snapshot_enabled():
+            return notes_snapshot.load_notes(self.filepath)     # 新しい notes.snap があればそちらを読む
+        return load_notes(self.filepath)
+
+    def iter_notes(self, date_from=None, date_to=None, heads=False):
+        """1件ずつ読む（期間・heads は指定されても全件を返す。絞り込みは呼び出し側で行う）"""
+        import notes_snapshot
+        if notes_snapshot.snapshot_enabled():
+            return notes_snapshot.iter_notes(self.filepath)
+        return iter_notes(self.filepath)
+
+    def get(self, note_id):
+        return NoteStore(self.load_all()).get(note_id)
+
+    # notes.json は本文も一緒に入っているので、見出し = 全件そのまま
+    def load_heads(self):
+        return self.load_all()
+
+    def body(self, note):
+        return note.get("body", "")
+
+    def with_bodies(self, heads):
+        return heads
+
+    def load_range(self, date_from=None, date_to=None):
+        return self.load_all()              # 1つのファイルなので、結局全件を読む
+
+    # 書き込みはすべて write_lock の中で「読み直し → 変更 → 保存」する
+    def apply_batch(self, ops, durable=False):
+        """ops をまとめて1回の読み込み・1回の保存で反映する（group commit 用）"""
+        with write_lock(self.filepath):
+            if journal_enabled() and all(op[0] == "add" for op in ops):
+                # 追加だけなら既存のメモを見なくていいので、読み込まずに追記する
+                results, entries = apply_ops(NoteStore(), ops)
+            else:
+                store = NoteStore(self.load_all())
+                results, entries = apply_ops(store, ops)
+                if entries and not journal_enabled():
+                    save_notes(store.to_list(), self.filepath, durable=durable)
+            if entries and journal_enabled():
+                append_journal_entries(self.filepath, entries, durable=durable)
+        return results
+
+    def add(self, note):
+        return unwrap(self.apply_batch([("add", note)])[0])
+
+    def update(self, note_id, fields, expected_version=None):
+        """expected_version を渡すと、version が違うとき VersionConflict にする"""
+        return unwrap(self.apply_batch([("update", note_id, fields, expected_version)])[0])
+
+    def delete(self, note_id):
+        return unwrap(self.apply_batch([("delete", note_id)])[0])
+
+    def count(self):
+        return len(self.load_all())
+
+    def allocate_ids(self, count=1):
+        return allocate_ids(self.filepath, count)
+
+    def next_id(self):
+        return self.allocate_ids(1)[0]
+
+    def signature(self):
+        return json_signature(self.filepath)
+
+
+def backend_name(name=None):
+    """引数 → 環境変数 NOTES_BACKEND → 既定（json）の順で、使うバックエンド名を決める"""
+    return (name or os.environ.get(BACKEND_ENV) or DEFAULT_BACKEND).lower()
+
+
+def open_backend(filepath, name=None, archived=True):
+    """バックエンド名に応じた保存先を開く。filepath は notes.json の場所（ほかのファイルはその隣に置く）。
+
+    archived=True なら、アーカイブ（notes.archive/）に移したメモも一緒に見える形で包んで返す。
+    保存先の形が古い版（notes_schema.py）なら、読んだメモを今の形に揃えてから返すようにも包む。
+    いちばん外側は、書き込みのたびに検索インデックス（notes_index.py）へ差分を足す IndexedBackend。
+    保存先そのものだけを扱いたいとき（移行・アーカイブ作業）は archived=False にする。
+    """
+    name = backend_name(name)
+    if name == "json":
+        backend = JsonBackend(filepath)
+    elif name == "sqlite":
+        import notes_sqlite                 # 使うときだけ読み込む
+        backend = notes_sqlite.SqliteBackend(notes_sqlite.db_path(filepath))
+    elif name == "split":
+        import notes_split
+        backend = notes_split.SplitBackend(filepath)
+    elif name == "sharded":
+        import notes_shards
+        backend = notes_shards.ShardedBackend(filepath)
+    else:
+        raise ValueError(f"unknown backend: {name}")
+    if not archived:
+        return backend
+    import notes_index
+    import notes_schema
+    import notes_archive
+    return notes_index.IndexedBackend(notes_archive.ArchivedBackend(notes_schema.wrap(backend), filepath), filepath)
+
+
+# ===== 読み込み結果のキャッシュ（Flask のように同じプロセスで何度も読む場合） =====
+class NotesCache:
+    """パース済みのメモ一覧をプロセス内で使い回すためのキャッシュ
+
+    バックエンドの signature()（notes.json / ジャーナルや notes.db の
+    inode, st_mtime_ns, st_size）が前回と同じなら、ファイルは読まずに
+    前回の一覧を返す。
+    返した一覧は共有物なので、呼び出し側で書き換えないこと。
+
+    アプリ自身の書き込みは apply_batch / add / update / delete を通す。loader が NoteStore を返していて、
+    lock（write_lock を返す関数）を渡してあれば、書く直前までほかから書かれていないことをロックの中で確かめてから、
+    保存先に書いたのと同じ ops をキャッシュの NoteStore にも当てる（読み直し・並べ直しはしない）。
+    lock が無いとき（group commit のように、書き込みが別のスレッドで行われるとき）は、書いたあとに一覧を捨てる。
+    """
+
+    def __init__(self, backend, loader=None, lock=None):
+        self.backend = backend
+        self.loader = loader or (lambda b: b.load_all())
+        self.lock = lock
+        self.hits = 0
+        self.misses = 0
+        self.patches = 0
+        self._lock = threading.Lock()
+        self._sig = None
+        self._notes = None
+        self._derived = {}
+
+    def _refresh(self):
+        sig = self.backend.signature()
+        if self._notes is not None and sig == self._sig:
+            self.hits += 1
+            return self._notes
+        self.misses += 1
+        self._notes = self.loader(self.backend)
+        self._sig = sig
+        self._derived = {}
+        return self._notes
+
+    def get(self):
+        """最新のメモ一覧を返す（変わっていなければキャッシュから）"""
+        with self._lock:
+            return self._refresh()
+
+    def derived(self, name, builder):
+        """一覧から作る派生データ（並べ替え済みリストなど）も、一覧と同じ寿命でキャッシュする"""
+        with self._lock:
+            notes = self._refresh()
+            if name not in self._derived:
+                self._derived[name] = builder(notes)
+            return self._derived[name]
+
+    def invalidate(self):
+        """次の get() で必ず読み直させる"""
+        with self._lock:
+            self._drop()
+
+    def _drop(self):
+        self._notes = None
+        self._sig = None
+        self._derived = {}
+
+    # ----- アプリ自身の書き込み -----
+    def apply_batch(self, ops, durable=False):
+        """保存先に ops を書き、キャッシュの NoteStore にも同じ ops を当てる（当てられないときは一覧を捨てる）"""
+        if self.lock is None:
+            try:
+                return self.backend.apply_batch(ops, durable=durable)
+            finally:
+                self.invalidate()
+        with self._lock, self.lock():
+            fresh = isinstance(self._notes, NoteStore) and self.backend.signature() == self._sig
+            try:
+                results = self.backend.apply_batch(ops, durable=durable)
+            except BaseException:
+                self._drop()
+                raise
+            if not fresh:
+                self._drop()
+                return results
+            # 保存先で反映できた op だけを当てる（apply_ops が保存先と同じように version / created_ts をそろえる）
+            applied = [op for op, result in zip(ops, results) if not isinstance(result, Exception)]
+            for result in apply_ops(self._notes, applied)[0]:
+                if isinstance(result, Exception):
+                    self._drop()            # 保存先とキャッシュが食い違った（ふつうは起きない）→ 読み直してもらう
+                    return results
+            self._sig = self.backend.signature()
+            self._derived = {}
+            self.patches += bool(applied)
+        return results
+
+    def next_id(self):
+        """保存先から ID を払い出す（SQLite は次の ID を notes.db の中に持つので、払い出しでも signature が変わる）"""
+        if self.lock is None:
+            return self.backend.next_id()
+        with self._lock, self.lock():
+            fresh = self._notes is not None and self.backend.signature() == self._sig
+            new_id = self.backend.next_id()
+            if fresh:
+                self._sig = self.backend.signature()    # メモは変わっていないので、一覧はそのまま使える
+            return new_id
+
+    def add(self, note):
+        return unwrap(self.apply_batch([("add", note)])[0])
+
+    def update(self, note_id, fields, expected_version=None):
+        """expected_version を渡すと、version が違うとき VersionConflict にする"""
+        return unwrap(self.apply_batch([("update", note_id, fields, expected_version)])[0])
+
+    def delete(self, note_id):
+        return unwrap(self.apply_batch([("delete", note_id)])[0])
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "patches": self.patches}
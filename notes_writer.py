@@ -0,0 +1,157 @@
+# 書き込みをまとめる（group commit）ためのラッパー
+#
+# /add などの POST が一度にたくさん来ると、JSON バックエンドでは1件ごとに
+# notes.json を丸ごと書き直すことになる。GroupCommitBackend は変更をキューに入れ、
+# 書き込み担当のスレッドが数ミリ秒ぶんをまとめて apply_batch() で1回だけ保存する。
+# 各リクエストは「自分の変更が入ったまとまり」の保存が終わるまで待ってから戻る。
+#
+# durability（耐久性）の選び方：
+#   "batch"   … まとめた1回ごとに fsync（速い。まとまりの中の変更は一緒に確定する）
+#   "request" … まとめずに1件ごとに保存して fsync（遅いが、いちばん慎重）
+
+import time
+import queue
+import threading
+
+import notes_store
+
+DURABILITY_CHOICES = ("batch", "request")
+
+
+class _Pending:
+    """キューに積まれた変更1件と、その結果を待つための目印"""
+
+    __slots__ = ("op", "done", "result")
+
+    def __init__(self, op):
+        self.op = op
+        self.done = threading.Event()
+        self.result = None
+
+
+class GroupCommitBackend:
+    """ほかのバックエンドを包んで、書き込みだけをまとめて行う（読み込みはそのまま渡す）"""
+
+    def __init__(self, backend, interval_ms=5, durability="batch", max_batch=512):
+        if durability not in DURABILITY_CHOICES:
+            raise ValueError(f"durability must be one of {DURABILITY_CHOICES}")
+        self.backend = backend
+        self.name = backend.name
+        self.interval = interval_ms / 1000
+        self.durability = durability
+        self.max_batch = max_batch
+        self.batches = 0                    # 何回保存したか（ベンチ・確認用）
+        self.ops = 0                        # 何件の変更を保存したか
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # ----- 読み込み系はそのまま -----
+    def load_all(self):
+        return self.backend.load_all()
+
+    def get(self, note_id):
+        return self.backend.get(note_id)
+
+    def load_heads(self):
+        return self.backend.load_heads()
+
+    def body(self, note):
+        return self.backend.body(note)
+
+    def with_bodies(self, heads):
+        return self.backend.with_bodies(heads)
+
+    def load_range(self, date_from=None, date_to=None):
+        return self.backend.load_range(date_from, date_to)
+
+    def iter_notes(self, date_from=None, date_to=None, heads=False):
+        return self.backend.iter_notes(date_from, date_to, heads)
+
+    def count(self):
+        return self.backend.count()
+
+    def allocate_ids(self, count=1):
+        return self.backend.allocate_ids(count)
+
+    def next_id(self):
+        return self.backend.next_id()
+
+    def signature(self):
+        return self.backend.signature()
+
+    # ----- 書き込み系はキュー経由 -----
+    def add(self, note):
+        return self._submit(("add", note))
+
+    def update(self, note_id, fields, expected_version=None):
+        return self._submit(("update", note_id, fields, expected_version))
+
+    def delete(self, note_id):
+        return self._submit(("delete", note_id))
+
+    def apply_batch(self, ops, durable=False):
+        return self.backend.apply_batch(ops, durable=durable)
+
+    def _submit(self, op):
+        if self.durability == "request" or self._closed:
+            result = self.backend.apply_batch([op], durable=self.durability == "request")[0]
+            self.batches += 1
+            self.ops += 1
+            return notes_store.unwrap(result)
+        self._ensure_thread()
+        pending = _Pending(op)
+        self._queue.put(pending)
+        pending.done.wait()
+        return notes_store.unwrap(pending.result)
+
+    def _ensure_thread(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="notes-group-commit", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            # 最初の1件が来てから interval のあいだに届いた変更を、同じまとまりに入れる
+            end = time.monotonic() + self.interval
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        try:
+            results = self.backend.apply_batch([p.op for p in batch], durable=True)
+        except Exception as e:          # 保存そのものに失敗したら、まとまり全員に同じ例外を返す
+            results = [e] * len(batch)
+        self.batches += 1
+        self.ops += len(batch)
+        for pending, result in zip(batch, results):
+            pending.result = result
+            pending.done.set()
+
+    def close(self):
+        """キューに残っている変更を保存してから、書き込みスレッドを止める"""
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
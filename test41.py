@@ -2,38 +2,26 @@ import os
 import json
 import datetime
 
+import notes_store      # 【追加】書き込みは test47 / test48 と同じ保存先の窓口を通す（新しいメモも今の形にそろう）
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 NOTES_PATH = os.path.join(BASE_DIR, "data", "notes.json")
 
 def load_notes(filepath):
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            content = json.load(f)
-            if not content:
-                return []
-            return content
-    except FileNotFoundError:
-        print("ファイルがありません。")
-        return []
+        content = notes_store.open_backend(filepath).load_all()   # 【変更】書くときと同じ保存先の窓口から読む（ジャーナルや notes.json 以外の保存先も見える）
+        if not content:
+            return []
+        return content
     except json.JSONDecodeError as e:
         print(f"ファイルが破損しています: {e}")
         return []
     except Exception as e:
         print(f"予期せぬエラーが発生しました: {e}")
         return []
-    
-def save_notes(data, filepath):
-    try:
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            print("JSONファイルの保存に成功しました。")
-    except Exception as e:
-        print(f"予期せぬエラーが発生しました: {e}")
 
 def next_id(data): # わからなかったため、test36.pyからコピー
-    if not data: return 1
-    return max(row.get("id",0) for row in data) + 1
+    return notes_store.open_backend(NOTES_PATH).next_id()   # 【変更】最大値+1ではなく、保存先が覚えている「次のID」から払い出す
 
 def add_note(data): # test36.pyを参考
     while True:
@@ -98,8 +86,9 @@ def main():
         print("登録ができませんでした。")
         return
     
-    data.append(note)
-    save_notes(data, NOTES_PATH)
+    # 【変更】notes.json を丸ごと書き直さず、1件分だけ保存先に渡す（version / created_ts などは保存先が足す）
+    notes_store.open_backend(NOTES_PATH).add(note)
+    print("保存しました。")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
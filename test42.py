@@ -1,6 +1,8 @@
-# load_notes(filepath)JSONファイルを読み込む（なければ空リストを返す）
-# save_notes(data, filepath)JSONファイルを保存する
+# load_notes(filepath)メモを読み込む（なければ空リストを返す）
+# save_change(func, *args)1件分の変更（追加・更新・削除）を保存先に書く
 # next_id(data)新しいIDを発行する
+# 【変更】notes.json を直接書き直さず、test47 / test48 と同じ保存先の窓口（notes_store.open_backend）を通す。
+#         通せば、新しいメモも今の形（version / created_ts など。notes_schema.py）にそろい、ジャーナルや検索インデックスとも食い違わない。
 # add_note()新しいメモを作成する（Create）
 # list_notes()登録されたメモを一覧表示する（Read）
 # update_note()指定IDのメモを更新する（Update）
@@ -12,20 +14,18 @@ import os
 import json
 import datetime
 
+import notes_store
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 NOTES_PATH = os.path.join(BASE_DIR, "data", "notes.json")
 
 def load_notes(filepath):
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if not data:
-                print("データはありません。")
-                return []
-            return data
-    except FileNotFoundError:
-        print("データはありません。")
-        return []
+        data = notes_store.open_backend(filepath).load_all()   # 古い形で保存されたメモも、今の形にそろえて返ってくる
+        if not data:
+            print("データはありません。")
+            return []
+        return data
     except json.JSONDecodeError as e:
         print(f"JSONファイルが破損しています: {e}")
         return []
@@ -33,18 +33,17 @@ def load_notes(filepath):
         print(f"データ読み込み中に予期せぬエラーが起きました: {e}")
         return []
 
-def save_notes(data, filepath):
+def save_change(func, *args):   # 例：save_change(backend.add, note)。全件を書き直さず、変わった1件分だけを保存先に渡す
     try:
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            print("JSONファイルに保存しました。")
+        result = func(*args)
+        print("保存しました。")
+        return result
     except Exception as e:
-        print(f"JSONファイル保存中に予期せぬエラーが起きました: {e}")
+        print(f"保存中に予期せぬエラーが起きました: {e}")
+        return None
 
 def next_id(data):
-    if not data: return 1
-    return max(row.get("id", 0) for row in data) + 1
+    return notes_store.open_backend(NOTES_PATH).next_id()   # 最大値+1ではなく、保存先が覚えている「次のID」から払い出す
 
 # 【Create】データを作る
 def add_note(data):
@@ -83,22 +82,22 @@ def list_notes(data):
 # 【Update】データを更新する
 # ==============================
 # 【変更】update_note：責務を「更新のみ」に絞る
-# - 成功 True / 失敗 False を返す
-# - データは「その場で書き換え」る（保存はしない）
+# - 成功 (ID, 変更する項目の辞書) / 失敗 None を返す
+# - 保存はしない（main側で保存先に渡す。version や updated_ts は保存先がそろえる）
 # - 成功メッセージは出さず、エラー/警告だけ出す（main側で成功メッセージを出すため）
 # ==============================
 def update_note(data):
     try:
         if not data:
             print("更新対象のデータがありません。")
-            return False
+            return None
         
         target_id = input("IDを入力してください: ").strip()
         try:
             target_id = int(target_id)
         except (TypeError, ValueError):
             print("IDは数字で入力してください。")
-            return False
+            return None
         
         # 該当IDを探す
         found_index = None  # この書き方が堅牢（理由は if found_index is None を使うため）
@@ -109,7 +108,7 @@ def update_note(data):
         
         if found_index is None: # forループが終わった上で、found_indexがNoneのときの処理をする。
             print(f"該当のIDがありません: {target_id}")
-            return False
+            return None
         
         # 既存のデータを取得
         current = data[found_index]
@@ -119,7 +118,7 @@ def update_note(data):
 
         if new_title == "" and new_body == "":
             print("入力が空だったため、変更は行いませんでした。")
-            return False
+            return None
 
         # 据え置き処理   
         if new_title == "":
@@ -127,17 +126,19 @@ def update_note(data):
         if new_body == "":
             new_body = current.get("body", "")
 
-        # その場で書き換え（置き換え dict を作らず、既存を更新）
-        current['title'] = new_title
-        current['body'] = new_body
-        current['updated_at'] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        # 変える項目だけの辞書を作る（data の中身はそのまま。保存は main で行う）
+        fields = {
+            "title": new_title,
+            "body": new_body,
+            "updated_at": datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        }
 
-        # 成功したことだけを返す
-        return True
+        # どのIDを、どう変えるかを返す
+        return target_id, fields
     
     except Exception as e:
         print(f"更新中に予期せぬエラーが起きました: {e}")
-        return False
+        return None
 
         # # 置き換える新レコードを作成
         # updated = {
@@ -169,16 +170,14 @@ def delete_note(data, filepath):
             print("IDは数字で入力してください。")
             return
         
-        before = len(data)
-        new_data = [row for row in data if row.get("id") != target_id]
-        after = len(new_data)
-
-        if before == after:
+        if not any(row.get("id") == target_id for row in data):
             print(f"該当のIDはありません: {target_id}")
             return
         
-        save_notes(new_data, filepath)
-        print(f"ID {target_id} のメモを削除しました。現在の件数: {after}")
+        backend = notes_store.open_backend(filepath)
+        if not save_change(backend.delete, target_id):   # 消した1件分だけを保存先に書く（全件の書き直しはしない）
+            return
+        print(f"ID {target_id} のメモを削除しました。現在の件数: {backend.count()}")
     
     except Exception as e:
         print(f"データ削除中に予期せぬエラーが起きました: {e}")
@@ -203,8 +202,7 @@ def main():
                 if not note:
                     print("登録できませんでした。")
                     continue
-                data.append(note)
-                save_notes(data, NOTES_PATH)
+                save_change(notes_store.open_backend(NOTES_PATH).add, note)   # 保存先が version / created_ts などを足して今の形で書く
 
             elif num == 2:
                 data = load_notes(NOTES_PATH)
@@ -212,10 +210,13 @@ def main():
 
             elif num == 3:
                 data = load_notes(NOTES_PATH) # 元のデータを読み込み
-                changed = update_note(data)   # 読み込んだデータを更新。TrueかFalseを返す。
-                if not changed:               # Trueなら先へ進む。Falseならやり直し
+                changed = update_note(data)   # 変更内容を聞く。(ID, 変更する項目) か None を返す。
+                if not changed:               # 中身があれば先へ進む。Noneならやり直し
+                    continue
+                target_id, fields = changed
+                backend = notes_store.open_backend(NOTES_PATH)
+                if save_change(backend.update, target_id, fields) is None:   # 変えた項目だけを保存先に渡す（version は保存先が1つ増やす）
                     continue
-                save_notes(data, NOTES_PATH)  # update_noteで更新されたデータを保存。更新データはreturnされなくても、関数が機能した時点で内部的に更新されている。
                 print("更新が完了しました。")
 
             elif num == 4:
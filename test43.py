@@ -1,12 +1,16 @@
 # argparse学習のため、test42.pyからロジックをコピー
 # main部分にargparseを追加
 # コマンドラインと対話型メニュー入力の両方が使える仕様になった
+# 【変更】notes.json を直接書き直さず、test47 / test48 と同じ保存先の窓口（notes_store.open_backend）を通す
+# （新しいメモも今の形 = version / created_ts など（notes_schema.py）にそろい、ジャーナルや検索インデックスとも食い違わない）
 
 import os
 import json
 import datetime
 import argparse
 
+import notes_store
+
 # 入力の制限
 MAX_TITLE_LEN = 100
 MAX_BODY_LEN = 1000
@@ -61,15 +65,11 @@ NOTES_PATH = os.path.join(BASE_DIR, "data", "notes.json")
 
 def load_notes(filepath):
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if not data:
-                print("データはありません。")
-                return []
-            return data
-    except FileNotFoundError:
-        print("データはありません。")
-        return []
+        data = notes_store.open_backend(filepath).load_all()   # 古い形で保存されたメモも、今の形にそろえて返ってくる
+        if not data:
+            print("データはありません。")
+            return []
+        return data
     except json.JSONDecodeError as e:
         print(f"JSONファイルが破損しています: {e}")
         return []
@@ -77,42 +77,30 @@ def load_notes(filepath):
         print(f"データ読み込み中に予期せぬエラーが起きました: {e}")
         return []
 
-def save_notes(data, filepath):
-    """メモデータをJSONファイルに保存する（エラー時は内容を説明的に出力）"""
-    try:
-        dirpath = os.path.dirname(filepath)
-        os.makedirs(dirpath, exist_ok=True)
-        tmp_path = os.path.join(dirpath, ".notes.json.tmp")
-
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        
-        os.replace(tmp_path, filepath)
+def save_change(func, *args):
+    """1件分の変更（例：save_change(backend.add, note)）を保存先に書く（エラー時は内容を説明的に出力）
 
-        print("JSONファイルに保存しました。")
+    全件を書き直さず、変わった1件分だけを渡す。一時ファイル→置き換え・ロック・fsync は保存先（notes_store.py）が行う。
+    成功したら保存先の戻り値を、失敗したら None を返す。
+    """
+    try:
+        result = func(*args)
+        print("保存しました。")
+        return result
     except PermissionError:
         print("保存に失敗しました:書き込み権限がありません。")
         print("対処方法:フォルダのアクセス権限を確認してください。")
     except FileNotFoundError:
         print("保存に失敗しました:保存先フォルダが存在しません。")
         print("対処:フォルダ構成を確認してください（data/ フォルダなど）。")
-    except json.JSONDecodeError:
-        print("保存に失敗しました:JSON形式の変換中にエラーが発生しました。")
-        print("対処:特殊文字や構造の不整合を確認してください。")
     except Exception as e:
         print("保存処理で予期せぬエラーが発生しました。")
         print(f"詳細情報: {type(e).__name__} - {e}")
         print("対処:一度プログラムを再起動し、再度お試しください。")
-    finally:
-        try:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except Exception:
-            pass
+    return None
 
 def next_id(data):
-    if not data: return 1
-    return max(row.get("id", 0) for row in data) + 1
+    return notes_store.open_backend(NOTES_PATH).next_id()   # 最大値+1ではなく、保存先が覚えている「次のID」から払い出す
 
 # 【Create】データを作る
 def add_note(data):
@@ -156,22 +144,22 @@ def list_notes(data):
 # 【Update】データを更新する
 # ==============================
 # 【変更】update_note：責務を「更新のみ」に絞る
-# - 成功 True / 失敗 False を返す
-# - データは「その場で書き換え」る（保存はしない）
+# - 成功 (ID, 変更する項目の辞書) / 失敗 None を返す
+# - 保存はしない（main側で保存先に渡す。version や updated_ts は保存先がそろえる）
 # - 成功メッセージは出さず、エラー/警告だけ出す（main側で成功メッセージを出すため）
 # ==============================
 def update_note(data):
     try:
         if not data:
             print("更新対象のデータがありません。")
-            return False
+            return None
         
         target_id = input("IDを入力してください: ").strip()
         try:
             target_id = int(target_id)
         except (TypeError, ValueError):
             print("IDは数字で入力してください。")
-            return False
+            return None
         
         # 該当IDを探す
         found_index = None  # この書き方が堅牢（理由は if found_index is None を使うため）
@@ -182,7 +170,7 @@ def update_note(data):
         
         if found_index is None: # forループが終わった上で、found_indexがNoneのときの処理をする。
             print(f"該当のIDがありません: {target_id}")
-            return False
+            return None
         
         # 既存のデータを取得
         current = data[found_index]
@@ -192,7 +180,7 @@ def update_note(data):
 
         if new_title == "" and new_body == "":
             print("入力が空だったため、変更は行いませんでした。")
-            return False
+            return None
 
         # 据え置き処理   
         if new_title == "":
@@ -200,17 +188,19 @@ def update_note(data):
         if new_body == "":
             new_body = current.get("body", "")
 
-        # その場で書き換え（置き換え dict を作らず、既存を更新）
-        current['title'] = new_title
-        current['body'] = new_body
-        current['updated_at'] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        # 変える項目だけの辞書を作る（data の中身はそのまま。保存は main で行う）
+        fields = {
+            "title": new_title,
+            "body": new_body,
+            "updated_at": datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        }
 
-        # 成功したことだけを返す
-        return True
+        # どのIDを、どう変えるかを返す
+        return target_id, fields
     
     except Exception as e:
         print(f"更新中に予期せぬエラーが起きました: {e}")
-        return False
+        return None
 
         # # 置き換える新レコードを作成
         # updated = {
@@ -242,16 +232,14 @@ def delete_note(data, filepath):
             print("IDは数字で入力してください。")
             return
         
-        before = len(data)
-        new_data = [row for row in data if row.get("id") != target_id]
-        after = len(new_data)
-
-        if before == after:
+        if not any(row.get("id") == target_id for row in data):
             print(f"該当のIDはありません: {target_id}")
             return
         
-        save_notes(new_data, filepath)
-        print(f"ID {target_id} のメモを削除しました。現在の件数: {after}")
+        backend = notes_store.open_backend(filepath)
+        if not save_change(backend.delete, target_id):   # 消した1件分だけを保存先に書く（全件の書き直しはしない）
+            return
+        print(f"ID {target_id} のメモを削除しました。現在の件数: {backend.count()}")
     
     except Exception as e:
         print(f"データ削除中に予期せぬエラーが起きました: {e}")
@@ -305,7 +293,7 @@ def main():
             return
         
         # 既存の add_note(data) を使う場合は、入力を代入してから呼ぶ形にするか、
-        # ここで直接レコードを組み立ててもOK。
+        # ここで直接レコードを組み立ててもOK。（version / created_ts などは保存先が足して今の形で書く）
         new_id = next_id(data)
         now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
         note = {
@@ -314,8 +302,8 @@ def main():
             "body": (body or "（本文なし）"),
             "created_at": now
         }
-        data.append(note)
-        save_notes(data, NOTES_PATH)
+        if save_change(notes_store.open_backend(NOTES_PATH).add, note) is None:
+            return
         print("登録が完了しました。")
         return
     
@@ -366,26 +354,26 @@ def main():
             new_body = current.get("body", "")
 
         
-        current["title"] = new_title
-        current["body"] = new_body
-        current["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-
-        save_notes(data, NOTES_PATH)
+        fields = {
+            "title": new_title,
+            "body": new_body,
+            "updated_at": datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        if save_change(notes_store.open_backend(NOTES_PATH).update, target_id, fields) is None:   # 変えた項目だけを渡す（version は保存先が1つ増やす）
+            return
         print(f"更新が完了しました（#{target_id}）。")
         return
     
     if args.delete is not None: # ④ 削除
-        data = load_notes(NOTES_PATH)
-        before = len(data)
-        new_list = [row for row in data if row.get("id") != args.delete]
-        after = len(new_list)
-        if before == after:
+        backend = notes_store.open_backend(NOTES_PATH)
+        if backend.get(args.delete) is None:
             error(f"該当のIDがありません: {args.delete}",
                 hint="`--list` で存在するIDを確認してから再実行してください。")
             return
         
-        save_notes(new_list, NOTES_PATH)
-        print(f"削除しました（#{args.delete}）。現在の件数: {after}")
+        if not save_change(backend.delete, args.delete):   # 消した1件分だけを保存先に書く（全件の書き直しはしない）
+            return
+        print(f"削除しました（#{args.delete}）。現在の件数: {backend.count()}")
         return
 
     # --- 引数が何も無いときは、従来のメニューへフォールバック ---
@@ -407,8 +395,7 @@ def main():
                 if not note:
                     print("登録できませんでした。")
                     continue
-                data.append(note)
-                save_notes(data, NOTES_PATH)
+                save_change(notes_store.open_backend(NOTES_PATH).add, note)   # 保存先が version / created_ts などを足して今の形で書く
 
             elif num == 2:
                 data = load_notes(NOTES_PATH)
@@ -416,10 +403,13 @@ def main():
 
             elif num == 3:
                 data = load_notes(NOTES_PATH) # 元のデータを読み込み
-                changed = update_note(data)   # 読み込んだデータを更新。TrueかFalseを返す。
-                if not changed:               # Trueなら先へ進む。Falseならやり直し
+                changed = update_note(data)   # 変更内容を聞く。(ID, 変更する項目) か None を返す。
+                if not changed:               # 中身があれば先へ進む。Noneならやり直し
+                    continue
+                target_id, fields = changed
+                backend = notes_store.open_backend(NOTES_PATH)
+                if save_change(backend.update, target_id, fields) is None:   # 変えた項目だけを保存先に渡す（version は保存先が1つ増やす）
                     continue
-                save_notes(data, NOTES_PATH)  # update_noteで更新されたデータを保存。更新データはreturnされなくても、関数が機能した時点で内部的に更新されている。
                 print("更新が完了しました。")
 
             elif num == 4:
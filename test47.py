@@ -1,18 +1,28 @@
 # 「test43.py」のメモアプリをサブコマンド形式として最小限で構成
 
 import os
+import sys
 import csv
 import json
 import datetime
 import argparse
 import wcwidth
 import re
+import itertools
+import io
+import contextlib
 from collections import Counter
 
+import notes_store
+import notes_schema
+import notes_serial
+import notes_index
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 NOTES_PATH = os.path.join(BASE_DIR, "data", "notes.json")
 
 MAX_TITLE_LEN = 100
+EXPORT_FIELDS = ("id", "title", "body", "created_at", "updated_at", "version")   # CSV に必ず出す列
 MAX_BODY_LEN = 1000
 
 RED   = "\033[31m"
@@ -89,52 +99,44 @@ def validate_body(raw):
     return body
 
 # ===== データの読み書き =====
-def load_notes(filepath):
+def open_backend(args):     # --backend（無ければ環境変数 NOTES_BACKEND、既定は json）で保存先を選ぶ
+    return notes_store.open_backend(NOTES_PATH, getattr(args, "backend", None))
+
+def iter_notes(backend, heads=False, date_from=None, date_to=None):     # heads=True なら一覧用の見出しだけ（split / sqlite では本文を読まない）
+    """メモを1件ずつ返す（notes.json が何GBあっても、全件をメモリに載せない）
+
+    date_from / date_to を渡すと、保存先が期間で読む量を減らせる場合はそうする（sharded なら重なる月のファイルだけ）。
+    途中で壊れた箇所に当たったら、エラーを表示してそこで止める。
+    """
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data or []
-    except FileNotFoundError:
-        return []
+        yield from backend.iter_notes(date_from, date_to, heads)
     except json.JSONDecodeError as e:
         error("JSONファイルが壊れているようです。", "バックアップがあれば戻すか、手で整えてください。")
         print(f"詳細: JSONDecodeError - {e}")
-        return []
     except Exception as e:
         error("データ読み込み中に予期せぬエラーが起きました。")
         print(f"詳細: {type(e).__name__} - {e}")
-        return []
-    
-def save_notes(data, filepath):
-    dirpath = os.path.dirname(filepath)
-    os.makedirs(dirpath, exist_ok=True)
-    tmp_path = os.path.join(dirpath, ".notes.json.tmp")
+
+def write_change(func, *args):      # 保存系の処理（全件保存 / ジャーナル追記）を同じエラー処理で包む関数
     try:
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        os.replace(tmp_path, filepath)
-        print("✅️ JSONファイルに保存しました。")
+        result = func(*args)
+        print("✅️ 保存しました。")
+        return result
     except PermissionError as e:
         error("保存に失敗しました（権限不足）。", "data/ フォルダや notes.json の権限を確認してください。")
         print(f"詳細: {type(e).__name__} - {e}")
     except Exception as e:
         error("保存処理で予期せぬエラーが発生しました。")
         print(f"詳細: {type(e).__name__} - {e}")
-    finally:
-        try:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except Exception:
-            pass
-
-def next_id(data):
-    if not data:
-        return 1
-    return max(row.get("id", 0) for row in data) + 1
+    return None
+
+def next_id(backend):
+    """保存先に覚えてある最高到達点から払い出す（削除済みの ID は再利用しない）"""
+    return backend.next_id()
 
 # ===== サブコマンドごとの本体 =====
 def cmd_add(args):
-    data = load_notes(NOTES_PATH)
+    backend = open_backend(args)
 
     title = validate_title(args.title)
     if title is None:
@@ -144,137 +146,229 @@ def cmd_add(args):
         return
     
     now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-    note = {"id": next_id(data), "title": title, "body": body, "created_at": now}
-    data.append(note)
-    save_notes(data, NOTES_PATH)
+    note = {"id": next_id(backend), "title": title, "body": body, "created_at": now}
+    write_change(backend.add, note)
 
 def cmd_list(args):
-    data = load_notes(NOTES_PATH)
-    if not data:
-        print("一覧表示できるデータがありません。")
-        print(f'{YELLOW}まずは: python3 test47.py add "タイトル" --body "本文"{RESET}')
-        return
-    print(f"===== メモ一覧{len(data)}件 =====") 
-    for row in data:
+    d_from = parse_date_ymd(args.date_from)
+    d_to = parse_date_ymd(args.date_to)
+    span = epoch_span(d_from, d_to)
+    count = 0
+    for row in iter_notes(open_backend(args), heads=True, date_from=d_from, date_to=d_to):
+        if not in_date_range(row, span):
+            continue
+        if count == 0:
+            print("===== メモ一覧 =====")
         created = row.get("created_at", "").replace("T", " ")[:16]
         id_col = f"[#{row.get('id')}]"
         title = clip(row.get("title", ""), 22)
         print(pad(id_col, 5), pad(title, 22), created)
+        count += 1
+    if count == 0:
+        print("一覧表示できるデータがありません。")
+        print(f'{YELLOW}まずは: python3 test47.py add "タイトル" --body "本文"{RESET}')
+        return
+    print(f"===== {count}件 =====")
+
+def check_target(args):     # update / delete の「ID 1件」か「--where の条件」のどちらか1つだけが指定されているか
+    if args.keywords is None and args.id is None:
+        error("対象が指定されていません。", "ID を指定するか、--where で条件を指定してください。")
+        return False
+    if args.keywords is not None and args.id is not None:
+        error("ID と --where は一緒に使えません。", "どちらか片方だけを指定してください。")
+        return False
+    if args.keywords is not None and not args.keywords and not (args.date_from or args.date_to):
+        error("--where の条件が空です（全件が対象になってしまいます）。", "キーワードか --from / --to を指定してください。")
+        return False
+    return True
+
+def select_where(backend, args):    # --where の条件に当てはまるメモを1回読んで集める
+    """[(id, version, title), ...]（書き込みは呼び出し側で1回にまとめる）"""
+    return [(row["id"], row["version"], row["title"]) for row in iter_matches(backend, args)]
+
+def show_where(targets, verb, dry_run):     # --where の対象件数と先頭の何件かを表示する
+    print(f"{YELLOW}--where に当てはまるメモ: {len(targets)} 件{RESET}")
+    for note_id, _, title in targets[:10]:
+        print("  ", pad(f"[#{note_id}]", 8), clip(title, 30))
+    if len(targets) > 10:
+        print(f"   …ほか {len(targets) - 10} 件")
+    if dry_run:
+        print(f"（--dry-run なので{verb}していません）")
+
+def report_batch(results, verb):    # まとめて書いた結果のうち、先を越されて反映できなかったものを数える
+    conflicts = sum(isinstance(r, notes_store.VersionConflict) for r in results)
+    missing = sum(r is None or r is False for r in results)
+    done = len(results) - conflicts - missing
+    print(f"{GREEN}✅️ {done} 件を{verb}しました。{RESET}")
+    if conflicts or missing:
+        print(f"{YELLOW}読んだあとにほかから変更・削除されていた {conflicts + missing} 件はそのままにしました。{RESET}")
 
 def cmd_update(args):
-    data = load_notes(NOTES_PATH)
+    if not check_target(args):
+        return
+    backend = open_backend(args)
     target_id = args.id
 
     if (args.title is None) and (args.body is None):
         error("変更していがないため、更新は行いませんでした。", "--title または --body を指定してください。")
         return
     
-    found_index = None
-    for i, row in enumerate(data):
-        if row.get("id") == target_id:
-            found_index = i
-            break
-    if found_index is None:
+    if target_id is not None and backend.get(target_id) is None:
         error(f"該当のIDがありません: {target_id}", "まず list でIDを確認してください。")
         return
-    
-    current = data[found_index]
 
+    # 指定された項目だけを書き換える（保存はロックの中で最新を読み直してから行われる）
+    fields = {}
     if args.title is not None:
         checked = validate_title(args.title)
         if checked is None:
             return
-        new_title = checked
-    else:
-        new_title = current.get("title", "")
+        fields["title"] = checked
 
     if args.body is not None:
         checked = validate_body(args.body)
         if checked is None:
             return
-        new_body = checked
-    else:
-        new_body = current.get("body", "")
+        fields["body"] = checked
 
-    current["title"] = new_title
-    current["body"] = new_body
-    current["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    fields["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    if target_id is not None:
+        write_change(backend.update, target_id, fields)
+        return
 
-    save_notes(data, NOTES_PATH)
+    # --where：当てはまるものを1回読んで集め、読んだときの version つきで1回の書き込みにまとめる
+    targets = select_where(backend, args)
+    show_where(targets, "更新", args.dry_run)
+    if args.dry_run or not targets:
+        return
+    ops = [("update", note_id, dict(fields), version) for note_id, version, _ in targets]
+    results = write_change(backend.apply_batch, ops, True)
+    if results is not None:
+        report_batch(results, "更新")
 
 def cmd_delete(args):
-    data = load_notes(NOTES_PATH)
-    before = len(data)
-    new_data = [row for row in data if row.get("id") != args.id]
-    after = len(new_data)
-    if before == after:
+    if not check_target(args):
+        return
+    backend = open_backend(args)
+    if args.id is None:
+        # --where：当てはまるものを1回読んで集め、1回の書き込みでまとめて消す
+        targets = select_where(backend, args)
+        show_where(targets, "削除", args.dry_run)
+        if args.dry_run or not targets:
+            return
+        results = write_change(backend.apply_batch, [("delete", note_id) for note_id, _, _ in targets], True)
+        if results is not None:
+            report_batch(results, "削除")
+            print(f"🗑️ 現在の件数: {backend.count()}")
+        return
+    if backend.get(args.id) is None:
         error(f"該当のIDがありません: {args.id}", "list で存在するIDを確認してから再実行してください。")
         return
-    save_notes(new_data, NOTES_PATH)
-    print(f"🗑️ 削除しました(#{args.id})。現在の件数: {after}")
+    if not write_change(backend.delete, args.id):
+        return
+    print(f"🗑️ 削除しました(#{args.id})。現在の件数: {backend.count()}")
 
 # ===== search コマンドを追加 =====
-def cmd_search(args):
-    data = load_notes(NOTES_PATH)
+def search_filter(args):    # args の条件を (開始日, 終了日, Query, 期間のエポック秒) にする
+    # 期間の準備（期間を先に決めておくと、月ごとの保存先では重なる月のファイルしか開かない）
+    d_from = parse_date_ymd(args.date_from)
+    d_to = parse_date_ymd(args.date_to)
 
-    if not args.keywords:
-        print(f"{RED}❌️ 検索キーワードを入力してください。{RESET}")
-        return
+    # 条件（複数語 × AND/OR、対象、大文字小文字）は検索インデックスと同じ Query で確かめる
+    #   any: どれかの語がどれかのフィールドに含まれればOK
+    #   all: すべての語が、どれかのフィールドに含まれる必要がある
+    query = notes_index.Query(args.keywords or [], args.match, args.scope, args.case_sensitive)
+    return d_from, d_to, query, epoch_span(d_from, d_to)
+
+def iter_matches(backend, args):    # search / delete --where / update --where で共通に使う絞り込み
+    """args の条件（keywords / --match / --in / --case-sensitive / --from / --to）に当てはまるメモを1件ずつ返す
+
+    キーワードが空なら期間だけで絞る。全件をリストにはしない。
+    """
+    d_from, d_to, query, span = search_filter(args)
+
+    # キーワードがあれば、検索インデックス（notes.index/ を mmap したもの）だけで当てはまる id を先に決める。
+    # 当てはまるものが無ければ notes.json は読まない。あれば、その id の行が出そろったところで読むのをやめる
+    wanted = None
+    if query.words:
+        wanted = set(notes_index.open_index(backend, NOTES_PATH).search(query, span))
+        if not wanted:
+            return
 
-    # 大文字小文字の扱い
-    prep    = (lambda s: s or "")                                             # まず「そのまま返す」関数を入れておく（全経路で存在させる）
-    kw_list = args.keywords[:]                                                # 既定はキーワードもそのまま使う
+    # フィルタ条件（1件ずつ読みながら当てはまるものだけを返す。並びは今までどおり保存順）
+    for row in iter_notes(backend, date_from=d_from, date_to=d_to):
+        if wanted is not None:
+            if row["id"] not in wanted:
+                continue
+            wanted.discard(row["id"])
 
-    if not args.case_sensitive:                                               # 大文字小文字を区別しないときは…
-        prep    = (lambda s: (s or "").lower())                               # 小文字化してから比較する関数に上書き
-        kw_list = [k.lower() for k in args.keywords]                          
+        # キーワードと日付範囲（created_at）。インデックスで決めた行も、読んだ中身で確かめ直す
+        if query.matches(row) and in_date_range(row, span):
+            yield row
 
-    # 期間の準備
-    d_from = parse_date_ymd(args.date_from)
-    d_to = parse_date_ymd(args.date_to)
+        if wanted is not None and not wanted:
+            return
 
-    # フィルタ条件
-    results = []
-    for row in data:
-        title = prep(row.get("title", ""))
-        body = prep(row.get("body", ""))
-
-        # 対象フィールドを選択
-        fields = []
-        if args.scope == "title":
-            fields = [title]
-        elif args.scope == "body":
-            fields = [body]
-        else:
-            fields = [title, body] # both
-
-        # ---- ここが肝：複数語 × AND/OR ----
-        # any: どれかの語がどれかのフィールドに含まれればOK
-        # all: すべての語が、どれかのフィールドに含まれる必要がある
-        def contains(word: str) -> bool:
-            return any(word in f for f in fields)
-        
-        if args.match == "any":
-            ok_text = any(contains(w) for w in kw_list)
-        else:
-            ok_text = all(contains(w) for w in kw_list)
+def iter_ranked(backend, args):     # search --sort relevance
+    """iter_matches と同じメモを、関連度（BM25）の高い順に返す
+
+    順位はインデックスだけで決める（--limit があれば上位の件数だけをヒープで選ぶ）。
+    保存先からは選んだメモだけを読み、そろったところで読むのをやめる。
+    """
+    d_from, d_to, query, span = search_filter(args)
+    ranked = notes_index.open_index(backend, NOTES_PATH).rank(query, span, args.limit or None)
+    order = {note_id: i for i, (_, note_id) in enumerate(ranked)}
+    rows = [None] * len(ranked)
+    left = len(ranked)
+    if left:
+        for row in iter_notes(backend, date_from=d_from, date_to=d_to):
+            i = order.get(row["id"])
+            if i is None:
+                continue
+            rows[i] = row
+            left -= 1
+            if not left:
+                break
+    return (row for row in rows if row is not None)
 
-        if not ok_text:
-            continue
+def cmd_search(args):
+    if not args.keywords:
+        print(f"{RED}❌️ 検索キーワードを入力してください。{RESET}")
+        return
 
-        # 日付範囲（created_at）
-        created_at = row.get("created_at", "")
-        d_created = to_dt(created_at)
-        if d_from and (not d_created or d_created < d_from):
-            continue
-        if d_to:   # d_to の当日23:59:59まで含めたいので、翌日に達したら除外
-            edge = d_to.replace(hour=23, minute=59, second=59)
-            if not d_created or d_created > edge:
-                continue
-        
-        results.append(row)
+    backend = open_backend(args)
+
+    def matches():
+        if args.sort == "relevance":
+            return iter_ranked(backend, args)
+        return iter_matches(backend, args)
+
+    # limit（表示・書き出し・集計はそれぞれ先頭から読み直すので、メモリは1件分で済む）
+    def results():
+        rows = matches()
+        if args.limit and args.limit > 0:
+            rows = itertools.islice(rows, args.limit)
+        return rows
+
+    shown = 0
+    for row in results():
+        if shown == 0:
+            # 見出しとヘッダ（件数は読み終わるまで分からないので最後に出す）
+            print(f'{YELLOW}🔍 検索結果{RESET}  '
+                  f'(scope={args.scope}, case={"敏感" if args.case_sensitive else "無視"}, '
+                  f'sort={"関連度" if args.sort == "relevance" else "保存順"})')
+            print(pad("ID", 6), pad("タイトル", 24), "作成日時")
+
+        # 本文
+        created = row.get("created_at", "").replace("T", " ")[:16]
+        id_col = f"[#{row.get('id')}]"
+        title_raw = row.get("title", "")
+        title_shr = clip(title_raw, 24)
+        title_out = highlight(title_shr, args.keywords, args.case_sensitive)
+        print(pad(id_col, 6), pad(title_out, 24), created)
+        shown += 1
 
-    if not results:
+    if shown == 0:
         joined = " ".join(args.keywords)
         print(f"{RED}「{joined}」を含むメモは見つかりませんでした。{RESET}")
         hints = []
@@ -286,35 +380,15 @@ def cmd_search(args):
         if hints:
             print(f"{YELLOW}ヒント:{RESET} " + " / ".join(hints))
         return
-    
-    # limit
-    if args.limit and args.limit > 0:
-        results = results[:args.limit]
-
-    # 見出しとヘッダ
-    joined = " ".join(args.keywords)
-    print(f'{YELLOW}🔍 検索結果 {len(results)} 件{RESET}  '
-          f'(scope={args.scope}, case={"敏感" if args.case_sensitive else "無視"})')
-    
-    # ヘッダ行（列幅をそろえる）
-    print(pad("ID", 6), pad("タイトル", 24), "作成日時")
-
-    # 本文
-    for row in results:
-        created = row.get("created_at", "").replace("T", " ")[:16]
-        id_col = f"[#{row.get('id')}]"
-        title_raw = row.get("title", "")
-        title_shr = clip(title_raw, 24)
-        title_out = highlight(title_shr, args.keywords, args.case_sensitive)
-        print(pad(id_col, 6), pad(title_out, 24), created)
+    print(f"{YELLOW}（{shown} 件）{RESET}")
 
     # --- もし --export が指定されていたら書き出す ---------
     if getattr(args, "export", None):
-        export_results(results, args.export)
+        export_results(results(), args.export)
 
     # --- もし --stats が指定されていたら簡易集計を表示 -----
     if getattr(args, "stats", False):
-        summarize_results(results, by=getattr(args, "by", "date"),
+        summarize_results(results(), by=getattr(args, "by", "date"),
                           limit=getattr(args, "limit_stats", 10))
 
 def parse_date_ymd(s: str): # 日付で検索するための関数（人間文字からPC文字に変換）
@@ -333,26 +407,56 @@ def to_dt(created_at: str): # 時刻で検索するための関数（人間文
     except Exception:
         return None
     
+def epoch_span(d_from, d_to):   # 期間を、メモの created_ts（エポック秒）とそのまま比べられる数にしておく
+    """d_from の0時から d_to の当日23:59:59まで → (開始, 終了) のエポック秒（指定なしは None）"""
+    lo = notes_store.to_epoch(d_from) if d_from else None
+    hi = notes_store.to_epoch(d_to.replace(hour=23, minute=59, second=59)) if d_to else None
+    return lo, hi
+
+def in_date_range(row, span):   # created_at が期間内か（期間なしなら常に True）
+    """span は epoch_span() の結果。日時の文字列は読まずに、書くときに作っておいた created_ts を比べる"""
+    lo, hi = span
+    if lo is None and hi is None:
+        return True
+    created = row["created_ts"]        # 0 = 作成日時が読めないメモ（期間を指定したときは含めない）
+    if lo is not None and (not created or created < lo):
+        return False
+    if hi is not None and (not created or created > hi):   # d_to の当日23:59:59まで含めたいので、翌日に達したら除外
+        return False
+    return True
+
 def summarize_results(results, by="date", limit=10):    # 検索結果をスピーディに要約して使い所を増やす関数
-    """検索結果を簡易集計して表示する（by=date/title）"""
-    # 全体サマリ
-    total = len(results)
-    dates = []
-    title_lens = []
+    """検索結果を簡易集計して表示する（by=date/title）
+
+    results は1回だけ先頭から読む（iter_notes から来るイテレーターでもよい）。
+    保存先から読んだメモは今の形（notes_schema.py）なので、キーは .get() で補わずにそのまま引く。
+    """
+    # 全体サマリと軸別の内訳を、1回読むあいだに数える
+    total = 0
+    date_min = None
+    date_max = None
+    title_len_sum = 0
     empty_body = 0
+    counter = Counter()
 
     for row in results:
-        created = (row.get("created_at", "")[:10] or "")
+        total += 1
+        created = row["created_at"][:10]
         if created:
-            dates.append(created)
-        t = row.get("title", "")
-        title_lens.append(len(str(t)))
-        if (row.get("body", "") or "") in ("", "(本文なし)"):
+            date_min = created if date_min is None else min(date_min, created)
+            date_max = created if date_max is None else max(date_max, created)
+        t = row["title"]
+        title_len_sum += len(t)
+        if row["body"] in ("", "(本文なし)"):
             empty_body += 1
+        if by == "date":
+            counter[created or "不明日付"] += 1
+        else:
+            counter[t or "(無題)"] += 1
     
-    date_min = min(dates) if dates else "-"
-    date_max = max(dates) if dates else "-"
-    avg_title = (sum(title_lens)/len(title_lens)) if title_lens else 0.0
+    date_min = date_min or "-"
+    date_max = date_max or "-"
+    avg_title = (title_len_sum / total) if total else 0.0
 
     # 見出し（全体サマリ）
     print(f"\n{BLUE}📊 集計サマリ{RESET}")
@@ -362,17 +466,7 @@ def summarize_results(results, by="date", limit=10):    # 検索結果をスピ
     print(f"  本文なし: {empty_body} 件")
 
     # 軸別の内訳
-    key_list = []
-    if by == "date":
-        for row in results:
-            key_list.append((row.get("created_at", "")[:10] or "不明日付"))
-        label = "日付"
-    else:
-        for row in results:
-            key_list.append((row.get("title", "") or "(無題)"))
-        label = "タイトル"
-
-    counter = Counter(key_list)
+    label = "日付" if by == "date" else "タイトル"
     ranked = sorted(counter.items(), key=lambda kv: (-kv[1], str(kv[0])))   # 件数の多い順 → キー名順の複合ソートで見やすく
 
     if limit and limit > 0:
@@ -386,39 +480,312 @@ def summarize_results(results, by="date", limit=10):    # 検索結果をスピ
         print(pad(k_shr, 26), pad(str(cnt), 6))
     
 def export_results(results, mode="csv"):    # 検索結果をCSVやJSONに書き出す関数を追加
-    """検索結果をCSVまたはJSONに保存する（同名回避のため時刻でファイル名を作る）"""
+    """検索結果をCSVまたはJSONに保存する（同名回避のため時刻でファイル名を作る）
+
+    results は1回だけ先頭から読み、1件ずつ書き出す（iter_notes から来るイテレーターでもよい）。
+    """
     now = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
     filename = f"export_{now}.{mode}"
-
-    # ---- 列（キー）をそろえる下ごしらえ -----------------------------------
-    # どうして？ → レコードごとに持つキーが微妙に違っても、CSVの列が崩れないようにするため
-    all_keys = set()
-    for row in results:
-        all_keys.update(row.keys())
-    fieldnames = sorted(all_keys)
+    rows = iter(results)
 
     try:
         if mode == "csv":
+            # ---- 列（キー）をそろえる下ごしらえ -----------------------------------
+            # 保存先から読んだメモはどれも今の形（notes_schema.py）なので、標準の列は必ずそろっている。
+            # 1件ずつキーを拾い直さずに、そのまま DictWriter に渡す（標準以外のキーは1件目にあるものだけ出す）
+            first = next(rows, None)
+            fieldnames = list(EXPORT_FIELDS)
+            if first is not None:
+                fieldnames += sorted(k for k in first if k not in EXPORT_FIELDS and k not in notes_schema.DERIVED_FIELDS)
             with open(filename, "w", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
                 writer.writeheader()
-                for row in results:
-                    safe_row = {key: row.get(key, "") for key in fieldnames}
-                    writer.writerow(safe_row)
+                writer.writerows(itertools.chain([first] if first is not None else [], rows))
         else:
             with open(filename, "w", encoding="utf-8") as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
+                notes_serial.write_pretty(f, map(strip_derived, rows))
          
         print(f"{GREEN}✅️ 検索結果を {filename} に保存しました。{RESET}")
     except Exception as e:
         print(f"{RED}❌️ 書き出しに失敗しました:{RESET} {type(e).__name__} - {e}")
 
+def strip_derived(row):    # 日時から作れる数（created_ts / updated_ts）は書き出さない
+    return {k: v for k, v in row.items() if k not in notes_schema.DERIVED_FIELDS}
+
+# ===== export コマンド（人が読む用に、整形した JSON を書き出す） =====
+def cmd_export(args):
+    """notes.json は詰めた形で保存しているので、読みたいときはこれで indent=2 のファイルを作る"""
+    d_from = parse_date_ymd(args.date_from)
+    d_to = parse_date_ymd(args.date_to)
+    span = epoch_span(d_from, d_to)
+    rows = (strip_derived(row) for row in iter_notes(open_backend(args), date_from=d_from, date_to=d_to)
+            if in_date_range(row, span))
+    if args.out == "-":
+        notes_serial.write_pretty(sys.stdout, rows)
+        return
+    filename = args.out or f"notes_{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    try:
+        with open(filename, "w", encoding="utf-8") as f:
+            count = notes_serial.write_pretty(f, rows)
+    except Exception as e:
+        error("書き出しに失敗しました。")
+        print(f"詳細: {type(e).__name__} - {e}")
+        return
+    print(f"{GREEN}✅️ {count} 件を {filename} に書き出しました（整形した JSON）。{RESET}")
+
+# ===== migrate コマンド（JSON ⇔ SQLite / 分割形式の移行） =====
+def cmd_migrate(args):
+    import notes_sqlite
+    import notes_split
+    import notes_shards
+    modules = {"sqlite": notes_sqlite, "split": notes_split, "sharded": notes_shards}
+    try:
+        if args.to == "json":
+            source = notes_store.open_backend(NOTES_PATH, args.source, archived=False)
+            total = modules[args.source].export_json(source, NOTES_PATH)
+            dest = NOTES_PATH
+        else:
+            source = notes_store.open_backend(NOTES_PATH, "json", archived=False)
+            target = notes_store.open_backend(NOTES_PATH, args.to, archived=False)
+            total = modules[args.to].import_json(NOTES_PATH, target)
+            dest = target.path
+        # 中身をそのまま移したので、移した先の形の版は移す元と同じ（SQLite は列で決まるので記録しない）
+        if args.to != "sqlite":
+            notes_schema.set_version(NOTES_PATH, args.to, notes_schema.stored_version(source))
+    except Exception as e:
+        error("移行に失敗しました。")
+        print(f"詳細: {type(e).__name__} - {e}")
+        return
+    print(f"{GREEN}✅️ {total} 件を {dest} に移行しました。{RESET}")
+    print(f"{YELLOW}次から使うには: --backend {args.to}（または NOTES_BACKEND={args.to}）{RESET}")
+
+# ===== import コマンド（CSV / JSON / JSONL からまとめて取り込む） =====
+IMPORT_FORMATS = {".csv": "csv", ".json": "json", ".jsonl": "jsonl"}
+
+def read_import_rows(path, fmt):    # 取り込むファイルを1行（1件）ずつ dict にして返す
+    """CSV / JSON（export_*.json と同じ配列）/ JSONL を1件ずつ返す（全件をメモリに載せない）"""
+    if fmt == "csv":
+        with open(path, "r", newline="", encoding="utf-8-sig") as f:   # Excel が付ける BOM も読み飛ばす
+            yield from csv.DictReader(f)
+    elif fmt == "jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from notes_store.iter_notes(path)      # notes.json と同じく、配列を少しずつ読む
+
+def cmd_import(args):
+    fmt = args.format or IMPORT_FORMATS.get(os.path.splitext(args.file)[1].lower())
+    if fmt is None:
+        error(f"ファイルの形式が分かりません: {args.file}", "--format csv / json / jsonl で指定してください。")
+        return
+    if not os.path.exists(args.file):
+        error(f"ファイルが見つかりません: {args.file}")
+        return
+
+    # ---- 1回読みながら検証して、取り込むメモを作る（ID は最後にまとめて払い出す） ----
+    now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    notes = []
+    skipped = line_no = 0
+    progress = False                # 進み具合の行（改行なし）を出したままか
+    start = datetime.datetime.now()
+    try:
+        for line_no, row in enumerate(read_import_rows(args.file, fmt), start=1):
+            if line_no % 1000 == 0:
+                rate = line_no / max((datetime.datetime.now() - start).total_seconds(), 1e-6)
+                print(f"\r  {line_no:,} 件を確認（{rate:,.0f} 件/秒）", end="", flush=True)
+                progress = True
+            if not isinstance(row, dict):
+                skipped += 1
+                continue
+            messages = io.StringIO()            # 検証のエラー表示は、何件目かを添えてから出す
+            with contextlib.redirect_stdout(messages):
+                title = validate_title(str(row.get("title") or ""))
+                body = validate_body(row.get("body")) if title is not None else None
+            if title is None or body is None:
+                print(("\n" if progress else "") + f"{line_no} 件目は取り込みません:")
+                print(messages.getvalue(), end="")
+                progress = False
+                skipped += 1
+                continue
+            created = row.get("created_at") or ""
+            updated = row.get("updated_at") or ""
+            notes.append({
+                "id": None,                     # 最後にまとめて払い出す
+                "title": title,
+                "body": body,
+                "created_at": created[:19] if to_dt(created) else now,     # 元の作成日時が読めればそれを残す
+                "updated_at": updated[:19] if to_dt(updated) else None,
+                "version": 1,
+            })
+    except (OSError, UnicodeDecodeError, ValueError, csv.Error) as e:
+        print()
+        error(f"{args.file} を読めませんでした（何も取り込んでいません）。")
+        print(f"詳細: {type(e).__name__} - {e}")
+        return
+    if progress:
+        print()
+    if not notes:
+        print(f"{YELLOW}取り込めるメモがありませんでした（スキップ {skipped} 件）。{RESET}")
+        return
+
+    # ---- ID をまとめて払い出し、1回の書き込みで保存する ----
+    backend = open_backend(args)
+    for note, note_id in zip(notes, backend.allocate_ids(len(notes))):
+        note["id"] = note_id
+    if write_change(backend.apply_batch, [("add", note) for note in notes], True) is None:
+        return
+    elapsed = max((datetime.datetime.now() - start).total_seconds(), 1e-6)
+    print(f"{GREEN}✅️ {len(notes)} 件を取り込みました"
+          f"（#{notes[0]['id']}〜#{notes[-1]['id']}、スキップ {skipped} 件、{len(notes) / elapsed:,.0f} 件/秒）。{RESET}")
+
+# ===== schema コマンド（メモの形の版を見る・今の版に書き直す） =====
+def cmd_schema(args):
+    backend = notes_store.open_backend(NOTES_PATH, getattr(args, "backend", None), archived=False)
+    version = notes_schema.stored_version(backend)
+    print(f"保存先 {backend.name} の形: 版 {version}（今の版は {notes_schema.SCHEMA_VERSION}）")
+    if version >= notes_schema.SCHEMA_VERSION and not (args.upgrade and args.force):
+        print(f"{GREEN}✅️ 今の版です。書き直すものはありません。{RESET}")
+        return
+    if not args.upgrade:
+        print(f"{YELLOW}古い版です。読むときは毎回形を揃えています。書き直すには: schema --upgrade{RESET}")
+        return
+    start = datetime.datetime.now()
+    shown = False
+
+    def progress(done):
+        nonlocal shown
+        shown = True
+        rate = done / max((datetime.datetime.now() - start).total_seconds(), 1e-6)
+        print(f"\r  {done:,} 件（{rate:,.0f} 件/秒）", end="", flush=True)
+
+    try:
+        old, total = notes_schema.migrate(backend, progress, force=args.force)
+    except Exception as e:
+        print()
+        error("書き直しに失敗しました（元のファイルはそのままです）。")
+        print(f"詳細: {type(e).__name__} - {e}")
+        return
+    if shown:
+        print()
+    print(f"{GREEN}✅️ {total} 件を版 {old} → {notes_schema.SCHEMA_VERSION} に書き直しました。{RESET}")
+
+# ===== archive コマンド（古いメモを圧縮して notes.archive/ に移す） =====
+def cmd_archive(args):
+    import notes_archive
+    before = parse_date_ymd(args.before)
+    if before is None:
+        error(f"日付の形式が正しくありません: {args.before}", "YYYY-MM-DD の形で指定してください。")
+        return
+    backend = notes_store.open_backend(NOTES_PATH, getattr(args, "backend", None), archived=False)
+    try:
+        moved = notes_archive.archive_notes(backend, NOTES_PATH, before, args.codec)
+        raw, disk = notes_archive.Archive(NOTES_PATH).disk_usage()
+    except Exception as e:
+        error("アーカイブに失敗しました。")
+        print(f"詳細: {type(e).__name__} - {e}")
+        return
+    if moved == 0:
+        print(f"{YELLOW}{args.before} より前に作られたメモはありませんでした。{RESET}")
+    else:
+        print(f"{GREEN}✅️ {moved} 件を {notes_archive.archive_dir(NOTES_PATH)} に移しました（{args.codec}）。{RESET}")
+    if raw:
+        print(f"アーカイブ全体: {raw / 1e6:.2f}MB → {disk / 1e6:.2f}MB（{1 - disk / raw:.0%} 削減）")
+
+# ===== snapshot / restore コマンド（差分バックアップと、指定時刻への巻き戻し） =====
+def cmd_snapshot(args):
+    import notes_backup
+    if args.list:
+        backups = notes_backup.list_backups(NOTES_PATH)
+        if not backups:
+            print("バックアップはまだありません。")
+            return
+        print(f"{'名前':<18} {'作成日時':<20} {'件数':>8} {'新規チャンク':>12} {'新規 KB':>10}")
+        for name, m in backups:
+            print(f"{name:<18} {m.get('created', ''):<20} {m.get('count', 0):>8} "
+                  f"{m.get('new_chunks', 0):>12} {m.get('new_bytes', 0) / 1000:>10.1f}")
+        return
+    backend = notes_store.open_backend(NOTES_PATH, getattr(args, "backend", None), archived=False)
+    try:
+        m = notes_backup.create_backup(backend, NOTES_PATH)
+    except Exception as e:
+        error("バックアップに失敗しました。")
+        print(f"詳細: {type(e).__name__} - {e}")
+        return
+    print(f"{GREEN}✅️ バックアップしました: {m['name']}（{m['count']} 件）{RESET}")
+    print(f"新しく書いたチャンク {m['new_chunks']} 個（{m['new_bytes'] / 1000:.1f}KB）、"
+          f"前回からハードリンクしたチャンク {m['linked_chunks']} 個")
+
+def cmd_restore(args):
+    import notes_backup
+    found = notes_backup.find_backup(NOTES_PATH, args.at)
+    if found is None:
+        error(f"{args.at} より前のバックアップがありません。", "snapshot --list で取ってあるバックアップを確認してください。")
+        return
+    name, m = found
+    backend = notes_store.open_backend(NOTES_PATH, getattr(args, "backend", None), archived=False)
+    try:
+        added, updated, deleted = notes_backup.restore_backup(backend, NOTES_PATH, name)
+    except Exception as e:
+        error("巻き戻しに失敗しました。")
+        print(f"詳細: {type(e).__name__} - {e}")
+        return
+    print(f"{GREEN}✅️ {m.get('created')} のバックアップ（{name}）に戻しました。"
+          f"追加 {added} 件 / 更新 {updated} 件 / 削除 {deleted} 件{RESET}")
+
+# ===== index コマンド（検索インデックス notes.index/ を見る・作り直す・確かめる） =====
+def cmd_index(args):
+    backend = open_backend(args)
+    index = notes_index.SearchIndex(NOTES_PATH)
+    if args.rebuild:
+        start = datetime.datetime.now()
+        count = index.rebuild(backend)
+        elapsed = (datetime.datetime.now() - start).total_seconds()
+        print(f"{GREEN}✅️ {count} 件から作り直しました（{elapsed:.2f}秒）。{RESET}")
+    else:
+        index = notes_index.open_index(backend, NOTES_PATH)
+    if args.merge:
+        index.merge()
+    stats = index.stats()
+    print(f"{notes_index.index_dir(NOTES_PATH)}: {stats['live']} 件 / セグメント {len(stats['segments'])} 個")
+    print(f"{'名前':<12} {'件数':>8} {'墓石':>8} {'語の数':>8}")
+    for name, count, dead, terms in stats["segments"]:
+        print(f"{name:<12} {count:>8} {dead:>8} {terms:>8}")
+    if not args.check:
+        return
+    problems, tried = index.check(backend, samples=args.samples)
+    if problems:
+        error(f"インデックスに {len(problems)} 件の食い違いがあります。", "index --rebuild で作り直してください。")
+        for problem in problems[:20]:
+            print(f"  - {problem}")
+        return
+    print(f"{GREEN}✅️ 件数と、{tried} 通りの検索の結果が全件を見た場合と一致しました。{RESET}")
+
 # ===== 引数（サブコマンド）の定義 =====
+def add_filter_args(p):     # search と --where で共通の絞り込みオプション
+    p.add_argument("--match", choices=["any", "all"], default="any",
+                   help="any=どれか含む（OR）/ all=すべて含む（AND）")       # AND/ORの切り替えオプションを追加
+    p.add_argument("--in", dest="scope", choices=["title", "body", "both"],
+                   default="both", help="検索対象（title/body/both）")
+    p.add_argument("--from", dest="date_from", help="開始日（YYYY-MM-DD）")
+    p.add_argument("--to", dest="date_to", help="終了日（YYYY-MM-DD）")
+    p.add_argument("--case-sensitive", action="store_true", help="大文字小文字を区別")
+
+def add_where_args(p):      # update / delete の --where（search と同じ条件で対象を選ぶ）
+    p.add_argument("--where", dest="keywords", nargs="*", metavar="KEYWORD",
+                   help="search と同じ条件に当てはまるメモをまとめて対象にする（キーワードを省いて --from / --to だけでも可）")
+    add_filter_args(p)
+    p.add_argument("--dry-run", action="store_true", help="--where に当てはまる件数を表示するだけで、書き込まない")
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="JSONメモアプリ（サブコマンド版）\nadd / list / updata / delete を使って操作できます。",
         formatter_class=argparse.RawTextHelpFormatter
     )
+    parser.add_argument("--backend", choices=["json", "sqlite", "split", "sharded"],
+                        default=notes_store.backend_name(),
+                        help="保存先（既定は環境変数 NOTES_BACKEND、無ければ json）")
     subparsers = parser.add_subparsers(dest="command", help="利用できるコマンド")
 
     # add
@@ -429,31 +796,31 @@ def parse_args():
 
     # list
     p_list = subparsers.add_parser("list", help="メモ一覧を表示")
+    p_list.add_argument("--from", dest="date_from", help="開始日（YYYY-MM-DD）")
+    p_list.add_argument("--to", dest="date_to", help="終了日（YYYY-MM-DD）")
     p_list.set_defaults(func=cmd_list)
 
     # update
-    p_upd = subparsers.add_parser("update", help="メモを更新")
-    p_upd.add_argument("id", type=int, help="更新対象のID")
+    p_upd = subparsers.add_parser("update", help="メモを更新（--where で条件に合うものをまとめて）")
+    p_upd.add_argument("id", type=int, nargs="?", help="更新対象のID（--where のときは省く）")
     p_upd.add_argument("--title", help="新しいタイトル")
     p_upd.add_argument("--body", help="新しい本文")
+    add_where_args(p_upd)
     p_upd.set_defaults(func=cmd_update)
 
     # delete
-    p_del = subparsers.add_parser("delete", help="メモを削除")
-    p_del.add_argument("id", type=int, help="削除対象のID")
+    p_del = subparsers.add_parser("delete", help="メモを削除（--where で条件に合うものをまとめて）")
+    p_del.add_argument("id", type=int, nargs="?", help="削除対象のID（--where のときは省く）")
+    add_where_args(p_del)
     p_del.set_defaults(func=cmd_delete)
 
     # search
     p_search = subparsers.add_parser("search", help="キーワードでメモを検索")
     p_search.add_argument("keywords", nargs="+", help="検索したい文字列を指定")  # スペース区切りで複数指定OK
-    p_search.add_argument("--match", choices=["any", "all"], default="any",
-                          help="any=どれか含む（OR）/ all=すべて含む（AND）")       # AND/ORの切り替えオプションを追加
-    p_search.add_argument("--in", dest="scope", choices=["title", "body", "both"],
-                          default="both", help="検索対象（title/body/both）")
-    p_search.add_argument("--from", dest="date_from", help="開始日（YYYY-MM-DD）")
-    p_search.add_argument("--to", dest="date_to", help="終了日（YYYY-MM-DD）")
-    p_search.add_argument("--case-sensitive", action="store_true", help="大文字小文字を区別")
+    add_filter_args(p_search)
     p_search.add_argument("--limit", type=int, default=0, help="最大表示件数（0は制限なし）")
+    p_search.add_argument("--sort", choices=["saved", "relevance"], default="saved",
+                          help="並び順（saved=保存順 / relevance=関連度の高い順。BM25、タイトルの語を重く数える）")
 
     p_search.add_argument("--stats", action="store_true", help="検索結果を表示する")
     p_search.add_argument("--by", choices=["date", "title"], default="date", help="集計の軸（date=作成日ごと / title=タイトルごと）")
@@ -463,6 +830,58 @@ def parse_args():
     p_search.add_argument("--export", choices=["csv", "json"], help="検索結果をファイルに保存（csv/json）")
     p_search.set_defaults(func=cmd_search)
 
+    # export
+    p_exp = subparsers.add_parser("export", help="メモを人が読みやすい整形した JSON に書き出す（notes.json は詰めた形で保存している）")
+    p_exp.add_argument("--out", help="書き出すファイル（省略時は notes_<日時>.json、- なら画面に出す）")
+    p_exp.add_argument("--from", dest="date_from", help="開始日（YYYY-MM-DD）")
+    p_exp.add_argument("--to", dest="date_to", help="終了日（YYYY-MM-DD）")
+    p_exp.set_defaults(func=cmd_export)
+
+    # migrate
+    p_mig = subparsers.add_parser("migrate", help="notes.json と notes.db（または分割形式）の間でデータを移す")
+    p_mig.add_argument("--to", choices=["sqlite", "split", "sharded", "json"], required=True,
+                       help="sqlite=notes.json→notes.db / split=notes.json→notes.heads.json+本文ファイル / "
+                            "sharded=notes.json→notes/YYYY-MM.jsonl / json=--from の保存先→notes.json")
+    p_mig.add_argument("--from", dest="source", choices=["sqlite", "split", "sharded"], default="sqlite",
+                       help="--to json のときの移行元（既定は sqlite）")
+    p_mig.set_defaults(func=cmd_migrate)
+
+    # import
+    p_imp = subparsers.add_parser("import", help="CSV / JSON / JSONL のメモをまとめて取り込む（export_*.csv / json も可）")
+    p_imp.add_argument("file", help="取り込むファイル")
+    p_imp.add_argument("--format", choices=["csv", "json", "jsonl"], help="ファイルの形式（省略時は拡張子で決める）")
+    p_imp.set_defaults(func=cmd_import)
+
+    # schema
+    p_sch = subparsers.add_parser("schema", help="メモの形の版を表示（--upgrade で今の版に書き直す）")
+    p_sch.add_argument("--upgrade", action="store_true", help="保存先を1回読みながら今の版の形に書き直す")
+    p_sch.add_argument("--force", action="store_true",
+                       help="--upgrade で、記録が今の版でも全件を書き直す（古い形のメモが後から混ざったとき）")
+    p_sch.set_defaults(func=cmd_schema)
+
+    # archive
+    p_arc = subparsers.add_parser("archive", help="古いメモを圧縮して notes.archive/ に移す（list / search からは今までどおり見える）")
+    p_arc.add_argument("--before", required=True, help="この日（YYYY-MM-DD）より前に作られたメモを移す")
+    p_arc.add_argument("--codec", choices=["gzip", "lzma"], default="gzip", help="圧縮形式（lzma は小さいが遅い）")
+    p_arc.set_defaults(func=cmd_archive)
+
+    # snapshot / restore
+    p_snap = subparsers.add_parser("snapshot", help="差分バックアップを取る（前回から変わった部分だけを書く）")
+    p_snap.add_argument("--list", action="store_true", help="取ってあるバックアップを一覧表示")
+    p_snap.set_defaults(func=cmd_snapshot)
+    p_rest = subparsers.add_parser("restore", help="指定した時刻のバックアップに戻す")
+    p_rest.add_argument("--at", required=True,
+                        help="この時刻（YYYY-MM-DD[ HH:MM[:SS]]）までに取った最新のバックアップに戻す（バックアップ名も可）")
+    p_rest.set_defaults(func=cmd_restore)
+
+    # index
+    p_idx = subparsers.add_parser("index", help="検索インデックス（notes.index/）の状態を表示（無い・古いときは作る）")
+    p_idx.add_argument("--rebuild", action="store_true", help="全件から作り直す")
+    p_idx.add_argument("--merge", action="store_true", help="たまったセグメントを今すぐまとめる")
+    p_idx.add_argument("--check", action="store_true", help="インデックスを使った検索と全件を見る検索を比べて確かめる")
+    p_idx.add_argument("--samples", type=int, default=200, help="--check で試す検索の数")
+    p_idx.set_defaults(func=cmd_index)
+
     
 
     return parser.parse_args()
@@ -472,7 +891,7 @@ def main():
     if hasattr(args, "func"):
         args.func(args)
     else:
-        print("❗コマンドを指定してください（add / list / update / delete / search）")
+        print("❗コマンドを指定してください（add / list / update / delete / search / import / migrate / schema / archive / snapshot / restore / index）")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,41 +1,56 @@
-from flask import Flask, render_template, request, redirect, url_for, abort
-import json
+from flask import Flask, render_template, request, redirect, url_for, abort, jsonify
 import os
 import datetime
 from markupsafe import Markup, escape   # 【追加】HTMLの安全な文字化と「このままHTMLにしてOKだよ」の印を使うため
-import re                               # 【追加】キーワードを見つける（正規表現）
+import notes_store                      # 【追加】読み書き（JSON / SQLite のバックエンド）を test47.py と共通化
+import notes_schema                     # 【追加】キャッシュに持つ一覧を省メモリの Note にする
+import notes_index                      # 【追加】キーワード検索の転置インデックス
+import notes_writer                     # 【追加】書き込みをまとめる group commit
+import notes_highlight                  # 【追加】キーワードのハイライトとスニペット（正規表現を使い回す）
 
 app = Flask(__name__)   # Webサーバー本体
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 NOTES_PATH = os.path.join(BASE_DIR, "data", "notes.json")
 
-def load_notes(filepath):
-    """JSONファイルからメモ一覧を読み込む"""
+# 【追加】保存先の設定：環境変数 NOTES_BACKEND=sqlite なら notes.db、何もなければ notes.json
+app.config["NOTES_BACKEND"] = notes_store.backend_name()
+BACKEND = notes_store.open_backend(NOTES_PATH, app.config["NOTES_BACKEND"])
+
+# 【追加】NOTES_GROUP_COMMIT_MS=5 のように指定すると、その間に来た書き込みをまとめて1回で保存する（0 なら使わない）
+#         NOTES_DURABILITY=batch（まとめて fsync）/ request（1件ずつ fsync）
+app.config["NOTES_GROUP_COMMIT_MS"] = int(os.environ.get("NOTES_GROUP_COMMIT_MS", "0"))
+app.config["NOTES_DURABILITY"] = os.environ.get("NOTES_DURABILITY", "batch")
+if app.config["NOTES_GROUP_COMMIT_MS"] > 0:
+    BACKEND = notes_writer.GroupCommitBackend(
+        BACKEND,
+        interval_ms=app.config["NOTES_GROUP_COMMIT_MS"],
+        durability=app.config["NOTES_DURABILITY"],
+    )
+
+def load_notes(backend):
+    """保存先からメモ一覧（見出し）を読み込んで、id で引ける NoteStore にする。split / sqlite では本文を含まないので with_body() で足す
+
+    キャッシュに持ち続けるので、辞書ではなく省メモリの Note（notes_schema.py）にしておく。
+    """
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data or []
-    except FileNotFoundError:
-        return []
+        return notes_store.NoteStore(notes_schema.compact(backend.load_heads()))
     except Exception as e:
         print("読み込みエラー", e)
-        return []
+        return notes_store.NoteStore()
     
-def save_notes(data, filepath):
-    """一時ファイル→置き換えで、途中失敗でも壊れにくく保存する"""
-    dirpath = os.path.dirname(filepath)
-    os.makedirs(dirpath, exist_ok=True)
-    tmp_path = os.path.join(dirpath, ".notes.tmp")
-
-    with open(tmp_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    
-    os.replace(tmp_path, filepath)
-
-def next_id(data):              # 登録する際のIDとして、IDの最大値に＋1した値を返す関数
-    """既存の最大ID+1 を返す（空なら 1）"""
-    return (max((row.get("id", 0) for row in data), default=0) + 1)
+# 【追加】パース済みの一覧をプロセス内で使い回す（ファイルが変わったときだけ読み直す）
+#         この画面からの追加・更新・削除は NOTES_CACHE 経由で書くので、キャッシュの NoteStore もその1件だけ直す
+#         （読み直し・並べ直しをしない）。group commit のときは書き込みが別のスレッドなので、書いたら読み直す。
+NOTES_CACHE = notes_store.NotesCache(
+    BACKEND,
+    loader=load_notes,
+    lock=None if app.config["NOTES_GROUP_COMMIT_MS"] > 0 else (lambda: notes_store.write_lock(NOTES_PATH)),
+)
+
+def next_id():                  # 登録する際のIDとして、保存先に覚えてある「次のID」を返す関数
+    """全件を見ずに次のIDを返す（削除されたIDは再利用しない）"""
+    return NOTES_CACHE.next_id()        # SQLite でも、払い出しのせいでキャッシュを読み直さないように NOTES_CACHE を通す
 
 def validate_title(raw):        # タイトルの空白や改行を除去する関数
     title = (raw or "").strip()
@@ -47,127 +62,72 @@ def validate_body(raw):         # 本文が空なら既定文を入れる関数
     body = (raw or "").strip()
     return body if body else "(本文なし)"
 
-def find_note_by_id(notes, note_id):    # JSON → Python化した一覧から、指定IDの1件を取り出す。
-    """id が一致するメモを返す。無ければ None。"""
-    for row in notes:
-        if row.get("id") == note_id:
-            return row
-    return None
+def find_note_by_id(store, note_id):    # id → 位置の辞書を持つ NoteStore から、指定IDの1件を取り出す。
+    """id が一致するメモを返す。無ければ None。（全件を順番に見ないので件数が増えても速い）"""
+    return store.get(note_id)
 
-# 【追加】キーワードを <mark> でハイライトして、安全にHTMLとして返す
-def highlight_html(text, words, case_sensitive=False):
-    """タイトルなどの文字列の中で、キーワードに <mark> をつけて光らせる関数だよ。"""
+def expected_version_from_request():     # 編集フォームの hidden「version」か、If-Match ヘッダー（"id-version"）から版を取り出す
+    """見つからなければ None（= 版の確認はしない）"""
+    raw = request.form.get("version") or request.headers.get("If-Match", "")
+    raw = raw.strip().strip('"').rsplit("-", 1)[-1]
+    return int(raw) if raw.isdigit() else None
 
-    print("\n[DEBUG] highlight_html() が呼ばれました。")                        # 👀 この関数がいつ動いたかを知るためのログ
-    print("        引数 text =", repr(text))                                  # 👀 元の文字列が何かを確認するよ
-    print("        引数 words =", words)                                      # 👀 ハイライトしたいキーワードのリストを確認するよ
-    print("        引数 case_sensitive =", case_sensitive)                    # 👀 大文字・小文字を区別するかどうかを確認するよ
+def get_store():                        # キャッシュ済みの NoteStore（読み取り専用）を返す
+    return NOTES_CACHE.get()
 
-    s = escape(text or "")                                                    # text が None や空でも安全に、HTML用にエスケープして文字列にするよ
-    # 例： <script> みたいな危ない記号を、「ただの文字」として扱うための変換だよ
+def with_body(note):                    # 【追加】見出しだけのメモに本文を足す（split なら mmap から、その1件分だけ読む）
+    if note is None or "body" in note:
+        return note
+    return dict(note, body=BACKEND.body(note))
 
-    words = [w for w in (words or []) if w]                                   # words の中から、空文字や None を取り除いて「ちゃんとした単語」だけにするよ
-    print("        整理後の words =", words)                                   # 👀 実際にハイライトに使う単語だけが残っているか確認するよ
+def search_notes(query, relevance=False):   # 【追加】notes.index/ のインデックスで当てはまる id を決め、その分だけ本文を読む
+    """query に当てはまるメモ（本文つき）のリスト。インデックスは書き込みのたびに差分が足されるので、ふだんは作り直さない。
 
-    if not words:                                                             # もしハイライトする単語が1つもなかったら…
-        print("        words が空なので、ハイライトはせずにそのまま返します。")
-        return Markup(s)                                                      # 何も変えずに、そのまま HTML として返すよ
-
-    # ここから「どの文字を光らせるか」を決める準備だよ
-    pattern = "|".join(re.escape(w) for w in words)                           # すべての単語を「正規表現用」に安全に並べて、"word1|word2" という形のパターンにするよ
-                                                                              # re.escape(w) は、「.」「+」などの特別な記号も“普通の文字”として扱うようにするおまじないだよ
-
-    flags = 0 if case_sensitive else re.IGNORECASE                            # 大文字・小文字を区別しないときは、re.IGNORECASE フラグを付けるよ
-
-    print("        正規表現パターン =", pattern)                                 # 👀 どんなルールで探すかを確認するよ
-    print("        フラグ =", "そのまま(区別する)" if case_sensitive else "IGNORECASE(区別しない)")
+    relevance=True なら関連度（BM25）の高い順に並べて返す（点数はインデックスの tf と文書の長さだけで決まる）。
+    """
+    store = get_store()
+    index = notes_index.open_index(BACKEND, NOTES_PATH)
+    found = [note_id for _, note_id in index.rank(query)] if relevance else index.search(query)
+    return BACKEND.with_bodies([n for n in map(store.get, found) if n is not None])
 
-    highlighted = re.sub(                                                     # s の中のキーワードに <mark> をつけた新しい文字列を作るよ
-        pattern,                                                              # 「どんな文字を探すか」のルール
-        lambda m: f"<mark>{m.group(0)}</mark>",                               # 見つかったところをどう置き換えるか（<mark>〜</mark> で囲む）
-        s,                                                                    # 探す対象の文字列（エスケープ済み）
-        flags=flags                                                           # 大文字・小文字の扱いルール
-    )
+# 【追加】キーワードを <mark> でハイライトして、安全にHTMLとして返す
+def render_marks(parts):                # [(文字列, 光らせるか), ...] を、エスケープしながら1つの HTML にするよ
+    return Markup("").join(Markup("<mark>%s</mark>") % t if hit else escape(t) for t, hit in parts)
 
-    print("        ハイライト後の文字列(一部) =", repr(highlighted[:80]))         # 👀 長くなりすぎるので先頭80文字だけ確認してみるよ
+def highlight_html(text, words, case_sensitive=False):
+    """タイトルなどの文字列の中で、キーワードに <mark> をつけて光らせる関数だよ。
 
-    return Markup(highlighted)                                                # これは「HTMLとして安全だよ」という印をつけてテンプレートに返すよ
+    正規表現は検索語ごとに1回だけ作って使い回す（notes_highlight.py の LRU）。
+    """
+    text = text or ""                                                         # text が None でも扱えるように、必ず文字列にしておくよ
+    parts = notes_highlight.mark_parts(text, words, case_sensitive)           # 元の文字列の中で一致箇所を探して分ける（エスケープする前に探すよ）
+    return render_marks(parts)                                                # 一致箇所だけ <mark>、ほかはエスケープして返すよ
 
 # 【追加】本文から一致箇所の周辺だけ切り出して、ハイライト付きで返す
-def make_snippet(text, words, case_sensitive=False, ctx=40):
+def make_snippet(text, words, case_sensitive=False, ctx=notes_highlight.SNIPPET_CTX):
     """
     本文の中から、キーワードの「前後だけ」を切り出して、
     その部分をハイライトして短い文章（スニペット）にする関数だよ。
-    """
-
-    print("\n[DEBUG] make_snippet() が呼ばれました。")                            # 👀 この関数が動いたタイミングを知るためのログ
-    print("        引数 text (本文) =", repr(text))                              # 👀 元の本文がどんな文字列か確認するよ
-    print("        引数 words =", words)                                        # 👀 ハイライト対象のキーワード一覧だよ
-    print("        引数 case_sensitive =", case_sensitive)                      # 👀 大文字小文字の区別ルールを確認するよ
-    print("        引数 ctx =", ctx, "(キーワードの前後に何文字ずつ見せるか)")        # 👀 キーワード前後の「おまけ表示」の幅だよ
 
+    一致箇所は1回だけ探して、切り出す場所にも <mark> を付ける場所にも同じものを使うよ。
+    離れた場所に何回も出てくるときは、いくつかの窓を「 … 」でつないで見せる（近い窓は1つにまとめる）。
+    """
     raw = text or ""                                                            # None の場合でも扱いやすいように、必ず文字列にしておくよ
-    text_len = len(raw)                                                         # 本文全体の長さを計算しておくよ
-    print("        本文の長さ =", text_len)
+    spans = notes_highlight.find_spans(raw, words, case_sensitive)              # 本文の中の一致箇所を、ぜんぶまとめて1回で探すよ
 
-    # 🟦 パターン1：本文が空 or キーワードなし → 先頭だけを切って返すモード
-    if not raw or not words:                                                   # 本文がない、またはキーワードが1つもない場合
-        print("        本文が空、またはハイライトする単語がないので、先頭だけ返します。")
+    # 本文が空 or キーワードが見つからない → 先頭だけを切って返す
+    if not spans:
         head = raw[:ctx * 2]                                                   # 先頭から「ctx*2」文字だけを取り出すよ（ちょっと長めに）
         if len(raw) > ctx * 2:                                                 # もし本文がもっと長いなら…
             head = head + "…"                                                  # 「まだ続きがあるよ」という意味で「…」を付け足すよ
-        print("        返すスニペット(簡易) =", repr(head))
         return Markup(escape(head))                                            # HTML用にエスケープして、そのまま返すよ
 
-    # 🟦 パターン2：キーワードあり → 本文のどこに出てくるかを探す
-    flags = 0 if case_sensitive else re.IGNORECASE                             # 大文字小文字を区別しないなら IGNORECASE を使うよ
-    pattern = re.compile("|".join(re.escape(w) for w in words), flags)         # 複数キーワードをまとめて探すための正規表現ルールだよ
-
-    print("        検索用パターン =", pattern.pattern)
-    print("        フラグ =", "そのまま(区別する)" if case_sensitive else "IGNORECASE(区別しない)")
-
-    m = pattern.search(raw)                                                    # 本文の中から、最初にキーワードが出てくる場所を探すよ
-    if not m:                                                                  # もし1回も見つからなかったら…
-        print("        本文内にキーワードが見つかりませんでした。先頭だけ返します。")
-        head = raw[:ctx * 2]                                                   # 先頭だけを使うモードに切り替えるよ
-        if len(raw) > ctx * 2:
-            head = head + "…"
-        print("        返すスニペット(キーワード未検出) =", repr(head))
-        return Markup(escape(head))                                            # ここでもエスケープしてから返すよ
-
-    # 🟦 パターン3：キーワードが見つかった場合 → その前後を切り出す
-    print("        キーワードが見つかりました。")                               
-    print("        マッチ開始位置 m.start() =", m.start())                       # 👀 何文字目からヒットしたのか
-    print("        マッチ終了位置 m.end()   =", m.end())                         # 👀 何文字目までがヒットしたのか
-
-    # キーワードの前後 ctx 文字ぶん余裕を持って切り出すよ
-    start = max(0, m.start() - ctx)                                            # 左側の端：キーワードの少し前から
-    end   = min(len(raw), m.end() + ctx)                                       # 右側の端：キーワードの少し後ろまで
-
-    print("        切り出し開始位置 start =", start)
-    print("        切り出し終了位置 end   =", end)
-
-    piece = raw[start:end]                                                     # 実際にその範囲の文字列を取り出したものが「見せたい中心部分」だよ
-    print("        切り出した部分 piece(一部) =", repr(piece[:80]))
-
-    # 先頭や末尾に「…」を足すかどうかを決めるよ
-    prefix = "…" if start > 0 else ""                                          # もし start が0より大きいなら、「前にもまだ文章があるよ」という意味で「…」を付ける
-    suffix = "…" if end < len(raw) else ""                                     # もし end が本文の最後より小さいなら、「後ろにも続きがあるよ」という合図で「…」を付ける
-
-    print("        prefix(前側の…)", repr(prefix))
-    print("        suffix(後側の…)", repr(suffix))
-
-    # 中心の piece に対して、さっき作った highlight_html でもう一度ハイライトをかけるよ
-    highlighted_piece = highlight_html(piece, words, case_sensitive)           # ここで <mark> 付きの部分を作る
-
-    print("        ハイライト済みの piece(一部) =", repr(str(highlighted_piece)[:80]))
-
-    # 最終的なスニペットは「前の… + ハイライト付き中心 + 後ろの…」という形になるよ
-    snippet = Markup(prefix) + highlighted_piece + Markup(suffix)
-
-    print("        最終的な snippet(一部) =", repr(str(snippet)[:80]))           # 👀 実際に画面に出る短い文章をチェックするよ
-
-    return snippet                                                             # Markup オブジェクトとしてテンプレートに返すよ
+    # キーワードの前後 ctx 文字ずつの窓を作って、窓ごとにハイライトしてつなげるよ
+    wins = notes_highlight.windows(len(raw), spans, ctx)                      # [(開始, 終了), ...]（近い窓はもうつなげてあるよ）
+    pieces = [render_marks(notes_highlight.split_marks(raw, spans, start, end)) for start, end in wins]
+    prefix = "…" if wins[0][0] > 0 else ""                                     # 前にもまだ文章があるなら「…」を付ける
+    suffix = "…" if wins[-1][1] < len(raw) else ""                             # 後ろにも続きがあるなら「…」を付ける
+    return Markup(prefix) + Markup(" … ").join(pieces) + Markup(suffix)        # Markup オブジェクトとしてテンプレートに返すよ
 
 @app.route("/notes/<int:note_id>")
 def show(note_id):
@@ -181,16 +141,16 @@ def show(note_id):
     """
     print("[DEBUG] show() が呼ばれました。note_id =", note_id)
 
-    notes = load_notes(NOTES_PATH)
-    note = find_note_by_id(notes, note_id)
+    store = get_store()                                           # 読むだけなのでキャッシュから（ファイルが変わっていなければ json.load しない）
+    note = with_body(find_note_by_id(store, note_id))             # 本文はこの1件分だけ取り出す
 
-    print("[DEBUG] JSONの中身（一部）:", notes[:2])
+    print("[DEBUG] メモ件数:", len(store))
     print("[DEBUG] 見つかったメモ:", note)
 
     if note is None:
         abort(404, description=f"Note #{note_id} not found.")
 
-    return render_template("test48detail.html", note=note)
+    return render_template("test48detail.html", note=note), 200, {"ETag": notes_store.note_etag(note)}
 
 @app.route("/notes/<int:note_id>/edit", methods=["GET", "POST"])  # 「/notes/数字/edit」というURLに来たら、この関数を動かしてね〜という合図
 def edit(note_id):                                               # note_id には URL の「数字の部分」（例: 5）が入ってくるよ
@@ -211,11 +171,12 @@ def edit(note_id):                                               # note_id に
     print("[DEBUG] edit() に入りました。note_id =", note_id, "method =", request.method)    # 👀 今どのIDのメモを編集しようとしているか、HTTPメソッド(GET/POST)は何かを表示して確認
 
     # ① まず全件をロード（データの倉庫をPythonのリストとして取り出す）
-    notes = load_notes(NOTES_PATH)                               # JSONファイル(メモの倉庫)を全部読み込んで、Pythonのリストにするよ
-    print("[DEBUG] 現在のメモ件数 =", len(notes))                  # 👀 読み込んだメモの件数を確認しておくよ
-
+    # GET は読むだけなのでキャッシュ、POST は書き換えるのでファイルから読み直した自分用のリストを使うよ
     # ② 表示/更新対象の1件を特定（見つからなければ404）
-    note = find_note_by_id(notes, note_id)                        # 読み込んだメモ一覧の中から、id が note_id と同じものを1件探してくるよ
+    if request.method == "GET":
+        note = with_body(find_note_by_id(get_store(), note_id))   # キャッシュ済みの一覧から、id が note_id と同じものを1件探してくるよ（本文はその1件分だけ読む）
+    else:
+        note = BACKEND.get(note_id)                               # 保存先から直接1件だけ取ってくるよ（SQLite なら1行だけ読む）
     print("[DEBUG] 対象の note =", note)                          # 👀 本当に見つかったか、中身がどうなっているかを確認するよ
 
     if note is None:                                              # もし note が見つからなかったら（＝そんなIDはなかったら）
@@ -227,17 +188,19 @@ def edit(note_id):                                               # note_id に
         print("[DEBUG][GET] 編集フォームを初期表示します。title =", note.get("title"), "body =", note.get("body"))
         # 👀 これからフォームに入れる予定のタイトルと本文を表示して確認するよ
 
-        return render_template(                                   # 編集用のHTML(test48edit.html)をブラウザに返すよ
+        html = render_template(                                   # 編集用のHTML(test48edit.html)を作るよ
             "test48edit.html",                                    # 使うテンプレートファイルの名前だよ
-            note=note,                                            # 今編集しようとしている1件分のメモをテンプレートに渡すよ
+            note=note,                                            # 今編集しようとしている1件分のメモをテンプレートに渡すよ（version も hidden で埋め込まれる）
             error=None,                                           # 今の時点ではエラーメッセージはないので「None」にしておくよ
         )
+        return html, 200, {"ETag": notes_store.note_etag(note)}   # 「どの版を見せたか」を ETag ヘッダーでも伝えるよ
 
     # ここまで来たら method は「POST」だけだよ（フォームから送信されたあとの処理）
     print("[DEBUG][POST] フォームから送信されました。値を受け取ります。")  # 👀 ここからが「更新ボタンを押したあとの処理」だとわかるように出しておくよ
 
     raw_title = request.form.get("title")                         # フォームから送られてきた「タイトルの生データ」を取り出すよ（まだ検証前）
     raw_body  = request.form.get("body")                          # フォームから送られてきた「本文の生データ」を取り出すよ（まだ検証前）
+    expected_version = expected_version_from_request()            # 編集画面を開いたときの version（hidden か If-Match ヘッダー）だよ
     print("[DEBUG][POST] 受け取った raw_title =", raw_title)        # 👀 本当にフォームから届いているか確認するよ
     print("[DEBUG][POST] 受け取った raw_body  =", raw_body)         # 👀 空文字になっていないかなどを確認できるよ
 
@@ -257,22 +220,37 @@ def edit(note_id):                                               # note_id に
             error="タイトルは必須です。",                            # 画面に表示するエラーメッセージだよ
             last_title=raw_title or "",                           # 入力していたタイトルをそのまま戻してあげるよ（書き直しが楽になる）
             last_body=raw_body or "",                             # 入力していた本文もそのまま戻してあげるよ
+            last_version=expected_version,                        # 最初に開いたときの version を引き継ぐよ（ここで最新にすると確認をすり抜けてしまう）
         )
 
     # ここまで来たら、タイトルはOKなので、実際に note の中身を書き換えていくよ
     print("[DEBUG][POST] note を更新します（書き換え前）:", note)     # 👀 書き換える前の note の状態を確認するよ
 
-    # ⑥ ここで状態変更：Pythonの辞書を上書き（1件分）
-    note["title"] = new_title                                     # note 辞書の title を、新しいタイトルで上書きするよ
-    note["body"]  = new_body                                      # note 辞書の body を、新しい本文で上書きするよ
+    # ⑥⑦ ここで状態変更：1件分の辞書を上書きして、そのまま永続化
     now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")   # 今の日時を「2025-11-10T12:34:56」という形の文字にするよ
-    note["updated_at"] = now                                      # note 辞書に updated_at というキーで「いつ更新したか」を記録しておくよ
+    fields = {
+        "title": new_title,                                       # 新しいタイトル
+        "body": new_body,                                         # 新しい本文
+        "updated_at": now,                                        # 「いつ更新したか」の記録
+    }
+    try:
+        # 1件だけ書き換えて保存（ジャーナルモードなら1行追記、SQLite なら1行 UPDATE）
+        # 開いたときの version と今の version が違えば、ほかの人（ほかのプロセス）に先を越されている
+        note = NOTES_CACHE.update(note_id, fields, expected_version=expected_version)   # キャッシュの一覧もこの1件だけ直るよ
+    except notes_store.VersionConflict as e:
+        print("[DEBUG][POST] version が合わないので保存しません。いまの version =", notes_store.note_version(e.current))
+        return render_template(
+            "test48edit.html",
+            note=e.current,                                       # 最新の内容（メタ情報と version）を見せるよ
+            error="ほかの画面で先に更新されました。最新の内容を確認してから、もう一度保存してください。",
+            last_title=raw_title or "",                           # 入力中の内容は消さずに残しておくよ
+            last_body=raw_body or "",
+        ), 409
+    if note is None:                                              # 読んでから書くまでの間に、別のリクエストが消していた場合
+        abort(404, description=f"Note #{note_id} not found.")
 
     print("[DEBUG][POST] note を更新しました（書き換え後）:", note)   # 👀 書き換えたあとの note の状態を表示して、ちゃんと変わったか確認するよ
-
-    # ⑦ 全体（notesリスト）をJSONに書き戻す。永続化
-    save_notes(notes, NOTES_PATH)                                 # 書き換えた note を含む notes リスト全体を、JSONファイルに保存し直すよ
-    print("[DEBUG][POST] save_notes() による保存が完了しました。")    # 👀 保存が終わったことをログに残しておくよ
+    print("[DEBUG][POST] 保存が完了しました。")                      # 👀 保存が終わったことをログに残しておくよ
 
     # ⑧ 完了後は詳細ページへ戻す（updated=1 で更新完了を伝える）
     return redirect(url_for("show", note_id=note_id, updated=1))  # 保存が終わったら、詳細ページ /notes/<id>?updated=1 へ移動してもらうよ
@@ -332,30 +310,21 @@ def add():                                      # メモを新しく追加する
             last_body=raw_body or ""                          # 本文も同じく戻してあげる
         )
 
-    # ⑤ ここまで来たら title / body は使える状態なので、実際にJSONから一覧を読み込む
-    notes = load_notes(NOTES_PATH)                            # いま保存されているメモ一覧を全部読み込んで、Pythonのリストにするよ
-
-    print("[DEBUG][POST] 追加前のメモ件数 =", len(notes))        # 👀 追加する前に何件あるかを確認するよ
-
-    # ⑥ 1件分のメモ（辞書）を組み立てる
+    # ⑤⑥ ここまで来たら title / body は使える状態なので、1件分のメモ（辞書）を組み立てる
     now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")  # 「いまの時刻」を文字列に変換する（例: 2025-11-10T12:34:56）
     new_note = {
-        "id": next_id(notes),                                  # いまあるIDの最大値+1 を新しいIDとして使うよ
+        "id": next_id(),                                       # 保存先に覚えてある「次のID」を使うよ（削除されたIDは使い回さない）
         "title": title,                                        # さっきチェック済みのタイトル
         "body": body,                                          # さっきチェック済みの本文
         "created_at": now                                      # このメモを作った日時
     }
     print("[DEBUG][POST] 追加する new_note =", new_note)        # 👀 本当に正しいデータになっているか確認するよ
 
-    # ⑦ リストの末尾に新しいメモを追加（メモの件数が1件増える）
-    notes.append(new_note)                                     # ここでメモ一覧の「Python上のデータ」が変化するよ（状態が変わる）
-
-    print("[DEBUG][POST] 追加後のメモ件数 =", len(notes))         # 👀 メモ件数が1件増えたかどうかを確認しておくよ
-
-    # ⑧ 変わったリスト全体を JSONファイルに保存し直す（永続化）
-    save_notes(notes, NOTES_PATH)                              # ファイルに書き戻すことで、プログラムを終了しても消えないようにするよ
+    # ⑦⑧ リストの末尾に新しいメモを追加して、永続化する
+    NOTES_CACHE.add(new_note)                                  # ジャーナルモードなら1行追記、SQLite なら1行 INSERT、どちらでもなければ全件を保存し直すよ
+                                                               # キャッシュの一覧にもこの1件だけ足すので、一覧を読み直さないよ
     
-    print("[DEBUG][POST] save_notes() による保存が完了しました。")
+    print("[DEBUG][POST] 保存が完了しました。")
 
     # ⑨ 最後に一覧ページへ戻る（?added=1 は「追加に成功したよ」という小さなフラグ）
     return redirect(url_for("index", added=1))                 # / にリダイレクトして、index() 関数に処理をまかせるよ
@@ -384,20 +353,13 @@ def delete(note_id):                                                 # note_id 
     print("[DEBUG] delete() に入りました。note_id =", note_id, "method =", request.method)  # 👀 今どのIDのメモに対して delete が呼ばれたか、HTTPメソッドが何かを確認
 
     # ① まずは全件ロード：削除候補を探すために、いまのメモ一覧をすべて読む
-    notes = load_notes(NOTES_PATH)                                     # JSONファイルの中身をリストとして読み込むよ
-    print("[DEBUG] 現在のメモ件数 =", len(notes))                        # 👀 削除前の件数を確認するよ
-
     # ② 指定IDのメモを1件探す（見つからなければ None）
-    note = next((n for n in notes if n.get("id") == note_id), None)    # リストの中から id が note_id のものを1つ取り出すよ
+    if request.method == "GET":                                        # 確認画面だけならキャッシュで十分だよ
+        note = with_body(find_note_by_id(get_store(), note_id))        # 辞書を1回引くだけなので、全件を順番に見なくていいよ
+    else:
+        note = BACKEND.get(note_id)                                    # 消す直前なので保存先から直接確認するよ
     print("[DEBUG] 削除対象の note =", note)                            # 👀 本当に見つかったかどうかをチェックするよ
 
-    # noteの内包表記をバラした場合
-    # note = None
-    # for n in notes:
-    #     if n.get("id") == note_id:
-    #         note = n
-    #         break
-
     if note is None:                                                   # もし見つからなかったら（例：URLのIDが存在しない）
         print("[DEBUG] 該当IDのメモが見つかりません。404を返します。")
         abort(404)                                                     # ブラウザには「ページが見つかりません(404)」を返すよ
@@ -410,29 +372,13 @@ def delete(note_id):                                                 # note_id 
     # ④ ここから先は「POST」＝ ユーザーが「削除します」ボタンを押したあと
     print("[DEBUG][POST] 削除実行がリクエストされました。note_id =", note_id)
 
-    # ⑤ 削除後の新しいリストを作る（＝ 指定ID以外のメモだけを集める）
-    before = len(notes)                                                # 削除前の件数を覚えておくよ（確認用）
-    new_list = [n for n in notes if n.get("id") != note_id]            # id が note_id ではないものだけを集めて新しいリストを作るよ
-    after = len(new_list)                                              # 削除後の件数を数えておくよ
-
-    # new_listの内包表記をバラした場合
-    # new_list = []
-    # for n in notes:
-    #     if n.get("id") != note_id:
-    #         new_list.append(n)
+    # ⑤⑥ 指定IDのメモを保存先から消す（ジャーナルモードなら「削除」の1行を追記、SQLite なら1行 DELETE）
+    deleted = NOTES_CACHE.delete(note_id)                              # キャッシュの一覧からもこの1件だけ消すよ
 
-    print("[DEBUG][POST] 削除前件数 =", before, "削除後件数 =", after)
-    # 👀 本当に1件減っているかどうかをチェックできるよ
-
-    if before == after:                                                    # 件数が変わっていない = 何も消せていない
-        print("[DEBUG][POST] 件数が変わっていません。何も削除されていないようです。")
-        # 理論的にはここには来ないはずだけど、安全のためチェックしているよ
-        # この場合も一応404にするか、メッセージを出す運用もあり
+    if not deleted:                                                    # 確認してから消すまでの間に、別のリクエストが先に消していた場合
+        print("[DEBUG][POST] 何も削除されませんでした。")
         abort(404)
-
-    # ⑥ 新しいリストを JSON に保存し直す（ここで「本当にファイルが書き変わる」）
-    save_notes(new_list, NOTES_PATH)                                       # 変更後の new_list で notes.json を上書きするよ
-    print(f"[DEBUG][POST] ID={note_id} のメモを削除しました。現在の件数: {after}")
+    print(f"[DEBUG][POST] ID={note_id} のメモを削除しました。")
 
     # ⑦ 削除が終わったら一覧ページ("/")へ戻す（?deleted=1 は「削除できたよ」の印）
     return redirect(url_for("index", deleted=1))                           # 一覧ページの index() 関数にバトンを渡すよ
@@ -444,8 +390,8 @@ def search():                                                              # 「
 
     データの流れ（ざっくり）：
       1. ブラウザから /search?q=キーワード という形で文字が送られてくる
-      2. JSONファイルから全メモを読み込む
-      3. タイトル or 本文に、そのキーワードを含むメモだけに絞り込む
+      2. 転置インデックス（notes_index.py / data/notes.index/）で、タイトル or 本文にキーワードを含むメモの id を探す
+      3. 見つかったメモだけ本文を読む
       4. 作成日時 created_at をもとに「新しい順」に並び替える
       5. 画面用の形（ID／タイトルHTML／本文スニペット）に整えてからテンプレートに渡す
     """
@@ -458,22 +404,20 @@ def search():                                                              # 「
     # 空白の前後を削って、小文字化したバージョンも作っておく（検索用）
     q = q_raw.strip().lower()                                              # 例：「  Python  」→「python」みたいに整える
 
-    # ② 全件ロード ------------------------------------------------------------
-    notes = load_notes(NOTES_PATH)                                         # JSONファイルの中身を全部読み込んで、Pythonのリストにするよ
-    print("[DEBUG] 現在のメモ件数 =", len(notes))                            # 👀 そもそも何件の中から探すのかを確認するよ
+    # ② 件数の確認 ------------------------------------------------------------
+    print("[DEBUG] 現在のメモ件数 =", len(get_store()))                      # 👀 そもそも何件の中から探すのかを確認するよ
 
     # ③ キーワードでフィルタ（部分一致） --------------------------------------
+    # ふだんは q 全体を1つの語として探す。?match=any / all のときは、空白で区切った語ごとに探すよ
+    match = request.args.get("match", "")
+    sort = "relevance" if request.args.get("sort") == "relevance" else "date"   # ?sort=relevance なら関連度の高い順
     if q:                                                                  # q が空でないときだけ検索する（何も入ってないなら検索しない）
         print("[DEBUG] キーワード検索を実行します。検索語 =", q)
-
-        def norm(s):                                                       # norm は「比較用に文字を整える小さな関数」だよ
-            return (s or "").lower()                                       # None や空にも対応しつつ、小文字にして返す（"Python"→"python"）
-
-        results = [                                                        # ここで「検索にヒットしたメモだけ」を集めた新しいリストを作るよ
-            n for n in notes                                               # もともとの全メモを1件ずつ n として見る
-            if (q in norm(n.get("title", "")))                             # タイトルを小文字化して、その中に q が入っているか？
-            or (q in norm(n.get("body", "")))                              # または、本文の中に q が入っているか？
-        ]
+        query = notes_index.Query(
+            q.split() if match in ("any", "all") else [q],                 # 語のリスト（大文字小文字は区別しない）
+            match="all" if match == "all" else "any",
+        )
+        results = search_notes(query, relevance=sort == "relevance")      # インデックスで、タイトル・本文に q があるメモを探すよ
     else:
         print("[DEBUG] キーワードが空なので、検索は実行しません。")           # 👀 何も入力されていないときはここに来るよ
         results = []                                                       # この場合は「検索結果なし」として扱う
@@ -481,21 +425,18 @@ def search():                                                              # 「
     print("[DEBUG] キーワードにマッチした件数 =", len(results))            # 👀 絞り込んだあとの件数を確認するよ
 
     # ④ 作成日時で並び替え（新しい順に） -------------------------------------
-    def to_dt_safe(created_str):                                           # created_at の文字列を datetime 型に安全に変換するための小さな関数
-        try:
-            # 例："2025-11-10T12:34:56" → datetime(2025, 11, 10, 12, 34, 56)
-            return datetime.datetime.strptime((created_str or "")[:19], "%Y-%m-%dT%H:%M:%S")
-        except Exception:
-            # 変換に失敗したとき（壊れた日付など）は、いちばん古い日付として扱う
-            return datetime.datetime.min
-
-    results_sorted = sorted(                                               # 絞り込んだ結果を、新しい順に並び替えたリストを作るよ
-        results,                                                           # 並べ替え対象は「検索にヒットしたメモ」たち
-        key=lambda n: to_dt_safe(n.get("created_at", "")),                 # 並べ替えの基準：各メモの created_at を datetime に変換したもの
-        reverse=True                                                       # reverse=True なので「大きい＝新しい」ものが先頭に来るよ
-    )
+    # created_ts は保存するときに created_at から作っておいたエポック秒（int）なので、
+    # 日時の文字列を1件ずつ datetime に直さずに、そのまま数として比べられるよ
+    # ?sort=relevance のときは、もう関連度の高い順に並んでいるのでそのまま使うよ
+    if sort == "relevance":
+        results_sorted = results
+    else:
+        results_sorted = sorted(                                           # 絞り込んだ結果を、新しい順に並び替えたリストを作るよ
+            results,                                                       # 並べ替え対象は「検索にヒットしたメモ」たち
+            key=lambda n: (n["created_ts"], n["id"]),                      # 並べ替えの基準：作成日時の数（同じ時刻なら id の大きいほうを先に）
+            reverse=True                                                   # reverse=True なので「大きい＝新しい」ものが先頭に来るよ
+        )
 
-    print("[DEBUG] 並び替え後の件数 =", len(results_sorted))                  # 👀 件数は変わらないはずだけど、確認しておくよ
 
     # ⑤ 画面用の形に整える（ID / タイトルHTML / 本文スニペット） ------------
     # 複数キーワードに対応するために、q_raw をスペースで区切ってリストにするよ
@@ -513,12 +454,7 @@ def search():                                                              # 「
         title_html = highlight_html(n.get("title", ""), words)             # ここで title の中のキーワードに <mark> を差し込むよ
 
         # 本文から「キーワードの前後だけ」を取り出して、ハイライトした短い文章にする
-        body_snip = make_snippet(n.get("body", ""), words)                 # 1件ずつ「本文のチラ見せ」を作るよ
-
-        print("[DEBUG] 1件分 アイテム作成:",
-              "id=", n.get("id"),
-              "created_fmt=", created_fmt,
-              "title(元)=", n.get("title", ""))
+        body_snip = make_snippet(n.get("body", ""), words)                 # 1件ずつ「本文のチラ見せ」を作るよ（一致箇所は1回だけ探す）
 
         items.append({                                                     # この1件を、テンプレートで扱いやすい形の辞書にしてリストに追加するよ
             "id": n.get("id"),                                             # メモのID（リンクや表示に使う）
@@ -534,6 +470,7 @@ def search():                                                              # 「
     return render_template(
         "test48search.html",                                               # 検索結果を表示するテンプレートファイル
         q=q_raw,                                                           # 元の入力文字（小文字化せず、そのまま見た目用として渡す）
+        sort=sort,                                                         # 並び順（"date" = 新しい順 / "relevance" = 関連度順）
         count=len(items),                                                  # ヒットした件数（0件なら「見つかりません」と表示）
         items=items                                                        # 1行ごとのデータを詰め込んだリスト（HTMLの for で回す）
     )
@@ -541,24 +478,24 @@ def search():                                                              # 「
 @app.route("/")
 def index():
     """トップページ（メモ一覧）"""
-    notes = load_notes(NOTES_PATH)
+    notes = get_store()
     if not notes:
         return render_template("test48list.html", notes=[], empty=True)
     
     # ===== 並び替え処理 =====
     # 目的：作成日時 created_at を基準に新しい順に並べる
     # データの流れ：
-    #   1．各行の created_at を datetime に変換
-    #   2．新しいものから順に並べ直す
-    def to_dt_safe(created):
-        try:
-            return datetime.datetime.strptime(created[:19], "%Y-%m-%dT%H:%M:%S")
-        except Exception:
-            return datetime.datetime.min    # 日付が壊れている場合は1番古く扱う
-        
-    notes_sorted = sorted(notes, key=lambda n : to_dt_safe(n.get("created_at", "")), reverse=True)
+    #   1．NoteStore が (created_ts, id) の並びを持っている（created_ts は保存するときに作ったエポック秒）
+    #   2．新しい順の一覧はその並びを後ろから切り出すだけ（日時の文字列は読まない・並べ直さない）
+    #   3．NoteStore はキャッシュそのもの。この画面からの追加・更新・削除では並びを1か所だけ直すので、並べ直しは起きない
+    notes_sorted = notes.newest_first()
 
     return render_template("test48list.html", notes=notes_sorted, empty=False)
 
+@app.route("/debug/cache")
+def cache_stats():
+    """キャッシュのヒット/ミス回数（負荷をかけても misses が増えなければ json.load していない）"""
+    return jsonify(NOTES_CACHE.stats())
+
 if __name__ == "__main__":
     app.run(debug=True, port=8000)
\ No newline at end of file